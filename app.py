@@ -1,12 +1,25 @@
-from flask import Flask, request, render_template, redirect, flash, session, jsonify, g
+from flask import Flask, Response, request, render_template, redirect, flash, session, jsonify, g, stream_with_context
 from sqlalchemy.exc import IntegrityError, NoResultFound
 from functools import wraps
+import asyncio
+import json
+import math
+import os
 
 from forms import SignUpForm, LoginForm
-from models import db, connect_db, User, Genre, User_Genre
+from models import db, connect_db, User, Genre, User_Genre, EnrichmentJob, JOB_DONE, JOB_FAILED
 from config import FLASK_SECRET_KEY, SQLALCHEMY_DATABASE_URI_PROD
-from spotify_client import SpotifyClient
+from spotify_client import SpotifyClient, PlaylistTracks, STREAM_BATCH_SIZE, PLAYLIST_PAGE_LIMIT
+from async_spotify_client import AsyncSpotifyClient
+from caches import ArtistCache, AudioFeaturesStore, PlaylistCache, StaleWhileRevalidateCache
+from circuit_breaker import CircuitBreakers
+from retry_policy import RetryPolicies, RetryPolicy
+from playlist_index import IndexedPlaylist
+from rate_limiter import RateLimitScheduler
+from token_manager import TokenManager
+from metrics import REGISTRY, CONTENT_TYPE, instrument_app
 from enums import FavoriteStatus, FAVORITE_STATUS_MAP
+from export import EXPORT_FORMATS, pyarrow
 
 # TODO:
 # - Genre filter on table
@@ -16,10 +29,13 @@ from enums import FavoriteStatus, FAVORITE_STATUS_MAP
 
 TESTING = False   # Set True here if you are running tests
 CURR_USER_KEY = "logged_in_user"
+SERVER_SIDE_TABLE_MIN_TRACKS = 500  # playlists this long are paged, sorted and searched on the server
+MAX_TABLE_PAGE_SIZE = 500
+BACKGROUND_JOB_MIN_TRACKS = 1000  # playlists this long are enriched by the background worker (enrichment_worker.py), not in the request. Keep it >= SERVER_SIDE_TABLE_MIN_TRACKS
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = FLASK_SECRET_KEY
-app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI_PROD
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SPOTIFY_EXPLORER_DATABASE_URL', SQLALCHEMY_DATABASE_URI_PROD)  # e.g. a scratch database for the benchmarks
 # app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///spotify_explorer'  # Local DB if preferred for development
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS']  =  False
 
@@ -34,8 +50,41 @@ if TESTING:
     app.testing = True
 
 connect_db(app) 
-
-spotify = SpotifyClient()
+instrument_app(app)  # before any other request hooks, so their SQL queries are counted too
+
+artist_cache = ArtistCache(app)
+audio_features_store = AudioFeaturesStore(app)
+scheduler = RateLimitScheduler()  # token bucket file shared by all workers on this host
+token_manager = TokenManager()  # fetches a token on first use (not at import) and shares it across workers
+playlist_cache = PlaylistCache()  # indexed playlists for the server-side table
+playlist_info_cache = StaleWhileRevalidateCache()  # last good playlist details, served stale while Spotify is slow or failing
+artist_details_cache = StaleWhileRevalidateCache()  # the same for artist pages
+breakers = CircuitBreakers()  # shared by both clients, so they stop calling a failing endpoint together
+retry_policies = RetryPolicies(endpoints={
+    # Playlist pages and enrichment batches are fetched by the dozen, so a few slow ones hold up the whole table: hedge them
+    '/playlists/{id}/tracks': RetryPolicy(hedge_percentile=95),
+    '/audio-features': RetryPolicy(hedge_percentile=95),
+    '/artists': RetryPolicy(hedge_percentile=95),
+    # A genre page waits on its playlist search, and can offer the other source's playlist instead
+    '/search': RetryPolicy(max_attempts=2),
+})
+spotify = SpotifyClient(artist_cache=artist_cache, audio_features_store=audio_features_store, scheduler=scheduler, token_manager=token_manager, breakers=breakers, retry_policies=retry_policies)
+spotify_async = AsyncSpotifyClient(artist_cache=artist_cache, audio_features_store=audio_features_store, scheduler=scheduler, token_manager=token_manager, breakers=breakers, retry_policies=retry_policies)  # used by the async (I/O-bound) views; runs on its own shared event loop
+
+# Read when /metrics is scraped
+REGISTRY.add_stats(artist_cache.stats)
+REGISTRY.add_stats(audio_features_store.stats)
+REGISTRY.add_stats(lambda: playlist_cache.stats())  # playlist_cache may be replaced (e.g. by the benchmarks)
+REGISTRY.add_stats(playlist_info_cache.stats, prefix='playlist_info_cache_')
+REGISTRY.add_stats(artist_details_cache.stats, prefix='artist_details_cache_')
+REGISTRY.add_stats(breakers.stats)
+REGISTRY.add_stats(retry_policies.stats, prefix='upstream_')
+REGISTRY.add_stats(scheduler.stats, prefix='rate_limit_')
+REGISTRY.add_stats(spotify.transport_stats, prefix='transport_')
+REGISTRY.add_stats(spotify.coalescing_stats, prefix='coalescing_', client='sync')
+REGISTRY.add_stats(spotify_async.coalescing_stats, prefix='coalescing_', client='async')
+REGISTRY.add_stats(spotify.enrichment_stats, client='sync')
+REGISTRY.add_stats(spotify_async.enrichment_stats, client='async')
 
 ##############################################################################
 # User signup/login/logout 
@@ -183,6 +232,11 @@ def home():
     """Render the home page."""
     return render_template('home.html')
 
+@app.route('/metrics')
+def show_metrics():
+    """Expose upstream call, route and cache metrics in the Prometheus text format."""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 @app.route('/genres')
 def genre_index():
     """Render the genre index page."""
@@ -206,30 +260,195 @@ def get_playlist():
 def playlist_inspector(playlist_id):
     """Render the playlist inspector page. The track data used to populate the playlist tracks data will be a separate AJAX request."""
 
-    playlist_info_payload = spotify.get_playlist_info(playlist_id)
+    playlist_info_payload, stale = playlist_info_cache.get(playlist_id, lambda: spotify.get_playlist_info(playlist_id))
 
     if not playlist_info_payload:
         flash("Wasn't able to fetch the playlist :/  (Devs: see logs for details)", "warning")
         return redirect('/')
+
+    if stale:
+        mark_stale('/playlists/{id}', 'playlist')
+
+    job = pending_enrichment_job(playlist_id, playlist_info_payload)
     
     # set playlist link
     playlist_link = f'https://open.spotify.com/playlist/{playlist_id}'
 
-    # TODO: show a genre count table (maybe broken down by parent genre vs specific genre)
-
-    return render_template('playlist-inspector.html', playlist=playlist_info_payload, playlist_link=playlist_link)
+    return render_template('playlist-inspector.html', playlist=playlist_info_payload, playlist_link=playlist_link, server_side=use_server_side_table(playlist_info_payload), job=job)
 
 @app.route('/get-playlist-tracks/<playlist_id>')
-def playlist_tracks(playlist_id):
-    """Provide playlist track data to the bootstrap-table's AJAX request."""
+async def playlist_tracks(playlist_id):
+    """Provide playlist track data to the bootstrap-table's AJAX request.
+    Big playlists that aren't enriched yet get a 202 with their background job's progress instead."""
+
+    playlist_info_payload = await get_current_playlist_info(playlist_id)
+    snapshot_id = playlist_info_payload.get('snapshot_id') if playlist_info_payload else None
+
+    if snapshot_id and request.if_none_match.contains(snapshot_id):
+        return not_modified(snapshot_id)
+
+    job = pending_enrichment_job(playlist_id, playlist_info_payload)
 
-    tracks = spotify.get_playlist_tracks(playlist_id)
+    if job is not None:
+        return job_response(job)
+
+    playlist, served_snapshot_id = await get_indexed_playlist(playlist_id, snapshot_id)
+    tracks = playlist.tracks if playlist is not None else None
 
     # Create a JSON response
     response = jsonify(tracks)
 
-    # Add Cache-Control header to force caching for 3 hours
-    response.headers['Cache-Control'] = 'max-age=10600'
+    # Say how many tracks the playlist really has, and why the list was cut short (if it was)
+    if tracks is not None:
+        response.headers['X-Total-Tracks'] = str(tracks.total)
+        response.headers['X-Tracks-Truncated'] = tracks.truncated_reason or 'false'
+
+    return add_snapshot_etag(response, served_snapshot_id)
+
+@app.route('/get-playlist-tracks/<playlist_id>/page')
+async def playlist_tracks_page(playlist_id):
+    """Provide one page of playlist track data to the bootstrap-table's AJAX request, in server-side mode.
+    Takes the table's `offset`, `limit`, `sort`, `order` and `search` query params, and responds with the
+    `total` number of matching tracks and the page of `rows`.
+    Big playlists that aren't enriched yet get a 202 with their background job's progress instead."""
+
+    playlist_info_payload = await get_current_playlist_info(playlist_id)
+    snapshot_id = playlist_info_payload.get('snapshot_id') if playlist_info_payload else None
+
+    if snapshot_id and request.if_none_match.contains(snapshot_id):
+        return not_modified(snapshot_id)
+
+    job = pending_enrichment_job(playlist_id, playlist_info_payload)
+
+    if job is not None:
+        return job_response(job)
+
+    playlist, served_snapshot_id = await get_indexed_playlist(playlist_id, snapshot_id)
+
+    if playlist is None:
+        return jsonify({'error': "Wasn't able to fetch the playlist's tracks"}), 502
+
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_TABLE_PAGE_SIZE)
+
+    total, tracks = playlist.page(offset, limit, request.args.get('sort'), request.args.get('order', 'asc'), request.args.get('search'))
+
+    response = jsonify({'total': total, 'totalNotFiltered': len(playlist.tracks), 'rows': [track.to_dict() for track in tracks]})
+
+    return add_snapshot_etag(response, served_snapshot_id)
+
+@app.route('/get-playlist-tracks/<playlist_id>/summary')
+def playlist_tracks_summary(playlist_id):
+    """Provide the playlist's summary statistics (see playlist_summary.py) to the genre count table's AJAX request:
+    how its audio features and popularity are distributed, and how many tracks each genre and artist has.
+
+    The summary is worked out from the tracks the tracks table just loaded (it's only asked for once they have, see
+    loadGenreCounts in script.js), so it's served from the playlist cache, tagged with the snapshot cached there.
+    It never calls Spotify: if the playlist isn't cached, it responds with a 404 instead."""
+
+    snapshot_id, playlist = playlist_cache.previous_snapshot(playlist_id)
+
+    if playlist is None:
+        return jsonify({'error': "The playlist's tracks haven't been loaded", 'genres': []}), 404
+
+    if snapshot_id and request.if_none_match.contains(snapshot_id):
+        return not_modified(snapshot_id)
+
+    return add_snapshot_etag(jsonify(playlist.summary()), snapshot_id)
+
+@app.route('/get-playlist-tracks/<playlist_id>/job', methods=["POST"])
+async def enrich_playlist_tracks(playlist_id):
+    """Queue the playlist's tracks to be enriched by the background worker, or queue its failed job again
+    (it picks up where it left off). Respond with the job's progress, or 204 if the tracks are ready to be fetched."""
+
+    playlist_info_payload = await get_current_playlist_info(playlist_id)
+
+    if not playlist_info_payload:
+        return jsonify({'error': "Wasn't able to fetch the playlist"}), 502
+
+    job = pending_enrichment_job(playlist_id, playlist_info_payload, retry=True)
+
+    if job is None:
+        return Response(status=204)
+
+    return job_response(job)
+
+@app.route('/jobs/<int:job_id>')
+def show_job(job_id):
+    """Report a background enrichment job's progress, for the page to poll."""
+
+    job = EnrichmentJob.query.get_or_404(job_id)
+
+    return jsonify(job.progress())
+
+@app.route('/get-playlist-tracks/<playlist_id>/stream')
+def stream_playlist_tracks(playlist_id):
+    """Stream playlist track data as newline-delimited JSON (one track per line), a batch at a time.
+    The bootstrap-table appends the rows as they arrive, so the first rows show up without waiting for the whole playlist.
+    If this version of the playlist is already cached (or an older version can be updated), it's streamed from the cache.
+    Otherwise the streamed tracks are cached once the stream completes."""
+
+    playlist_info_payload = spotify.get_playlist_info(playlist_id)
+    snapshot_id = playlist_info_payload.get('snapshot_id') if playlist_info_payload else None
+
+    if snapshot_id and request.if_none_match.contains(snapshot_id):
+        return not_modified(snapshot_id)
+
+    batches = iter_playlist_track_batches(playlist_id, playlist_info_payload)
+
+    def generate():
+        for tracks_batch in batches:
+            if tracks_batch is None:
+                yield json.dumps({'error': "Wasn't able to fetch all of the playlist's tracks"}) + '\n'
+                return
+
+            yield ''.join(json.dumps(track.to_dict()) + '\n' for track in tracks_batch)
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    # Don't let proxies buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+
+    return add_snapshot_etag(response, snapshot_id)
+
+@app.route('/get-playlist-tracks/<playlist_id>/export.<file_format>')
+def export_playlist_tracks(playlist_id, file_format):
+    """Download the playlist's enriched tracks as a CSV (.csv), Arrow (.arrow) or Parquet (.parquet) file.
+    The file is written and sent a batch of tracks at a time. Tracks come from the playlist cache when they can
+    (so exporting a playlist that was just inspected costs no Spotify calls), and are cached when they can't."""
+
+    if file_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"Can't export to {file_format}. Try one of: {', '.join(EXPORT_FORMATS)}"}), 404
+
+    write, mimetype, needs_pyarrow = EXPORT_FORMATS[file_format]
+
+    if needs_pyarrow and pyarrow is None:
+        return jsonify({'error': f"Exporting to {file_format} needs pyarrow, which isn't installed"}), 501
+
+    playlist_info_payload, stale = playlist_info_cache.get(playlist_id, lambda: spotify.get_playlist_info(playlist_id))
+
+    if not playlist_info_payload:
+        return jsonify({'error': "Wasn't able to fetch the playlist"}), 502
+
+    if stale:
+        mark_stale('/playlists/{id}')
+
+    job = pending_enrichment_job(playlist_id, playlist_info_payload)
+
+    if job is not None:
+        return job_response(job)
+
+    def complete_batches():
+        for tracks_batch in iter_playlist_track_batches(playlist_id, playlist_info_payload):
+            if tracks_batch is None:
+                # Cut the download off, rather than let a partial file look complete
+                raise RuntimeError(f"Wasn't able to fetch all of playlist {playlist_id}'s tracks for the export")
+
+            yield tracks_batch
+
+    response = Response(stream_with_context(write(complete_batches())), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{playlist_id}.{file_format}"'
+    response.headers['X-Accel-Buffering'] = 'no'
 
     return response
 
@@ -249,7 +468,7 @@ def search_genre():
         return redirect('/genres')  
 
 @app.route('/genre-inspector/<genre_title>')
-def genre_inspector(genre_title):
+async def genre_inspector(genre_title):
     """View the Spotify of Sounds of Spotify playlist for a genre."""
 
     # See if genre in db
@@ -269,26 +488,52 @@ def genre_inspector(genre_title):
     # Get playlist source (owner type) from query string
     source = request.args.get('source')
 
-    if source == 'spotify' or source == 'thesoundsofspotify':
-        playlist_id = spotify.get_playlist_by_genre(genre.title, source)
-        alt_source = 'thesoundsofspotify' if source == 'spotify' else 'spotify'
-    elif source is None:
+    if source is None:
         source = 'spotify'
-        playlist_id = spotify.get_playlist_by_genre(genre.title, source)
-        alt_source = 'thesoundsofspotify'
-    else: 
+
+    if source not in Genre.PLAYLIST_COLUMNS:
         flash("I don't currently support the type of playlist you were looking for.", "warning")
         return redirect('/')
 
-    playlist_info_payload = spotify.get_playlist_info(playlist_id)
+    alt_source = 'thesoundsofspotify' if source == 'spotify' else 'spotify'
+
+    # Resolve both sources at once, so we know whether to offer the alternate source's playlist
+    playlist_ids = await resolve_genre_playlists(genre)
+    playlist_id = playlist_ids.get(source)
+    alt_playlist_id = playlist_ids.get(alt_source)
+
+    playlist_info_payload, stale = None, False
+    fetch_statuses = []
+
+    if playlist_id:
+        def fetch():
+            payload, status = spotify_async.run_sync(spotify_async.get_playlist_info(playlist_id, with_status=True))
+            fetch_statuses.append(status)
+            return payload
+
+        playlist_info_payload, stale = await asyncio.to_thread(playlist_info_cache.get, playlist_id, fetch)
 
     if not playlist_info_payload:
-        flash(f"""Wasn't able to find {source.title()}'s playlist for that genre :/  Try looking for <a href="/genre-inspector/{genre.title}?source={alt_source}">{alt_source.title()}'s version</a>.""", "warning")  
+        if 404 in fetch_statuses:
+            # The stored playlist is gone. Search for it again next time. (Not on a timeout or 5xx: Spotify may just be down.)
+            genre.forget_playlist_id(source)
+            db.session.commit()
+
+        if alt_playlist_id:
+            flash(f"""Wasn't able to find {source.title()}'s playlist for that genre :/  Try looking for <a href="/genre-inspector/{genre.title}?source={alt_source}">{alt_source.title()}'s version</a>.""", "warning")
+        else:
+            flash("Wasn't able to find a playlist for that genre :/", "warning")
+
         return redirect(request.referrer or '/')
+
+    if stale:
+        mark_stale('/playlists/{id}', 'playlist')
     
     playlist_link = f'https://open.spotify.com/playlist/{playlist_id}'
 
-    return render_template('genre-inspector.html', genre=genre, source=source, playlist=playlist_info_payload, playlist_link=playlist_link, last_viewed=last_viewed, favorite_status=favorite_status, FavoriteStatus=FavoriteStatus)
+    job = pending_enrichment_job(playlist_id, playlist_info_payload)
+
+    return render_template('genre-inspector.html', genre=genre, source=source, playlist=playlist_info_payload, playlist_link=playlist_link, last_viewed=last_viewed, favorite_status=favorite_status, FavoriteStatus=FavoriteStatus, server_side=use_server_side_table(playlist_info_payload), alt_playlist_id=alt_playlist_id, job=job)
 
 @app.route('/users/update-genre-favorite-status', methods=["POST"])
 @login_required
@@ -319,19 +564,22 @@ def update_genre_favorite_status():
 def show_artist(artist_id):
     """Render the artist page. At this point, it just shows the artist's top tracks."""
 
-    artist_payload = spotify.get_artist_details(artist_id)
+    artist_payload, stale = artist_details_cache.get(artist_id, lambda: spotify.get_artist_details(artist_id))
 
     if not artist_payload:
         flash("Wasn't able to fetch the artist :/  (Devs: see logs for details)", "warning")
         return redirect('/')
 
+    if stale:
+        mark_stale('/artists/{id}', 'artist')
+
     return render_template('artist-detail.html', artist=artist_payload)
 
 @app.route('/artists/<artist_id>/top-tracks')
-def get_artist_top_tracks(artist_id):
+async def get_artist_top_tracks(artist_id):
     """Fetch the artist's top tracks via bootstrap-table AJAX call."""
 
-    top_tracks_payload = spotify.get_artist_top_tracks(artist_id)
+    top_tracks_payload = await spotify_async.run(spotify_async.get_artist_top_tracks(artist_id))
 
     # Create a JSON response
     response = jsonify(top_tracks_payload)
@@ -343,6 +591,198 @@ def get_artist_top_tracks(artist_id):
 
 # Misc Functions ################################################
 
+async def resolve_genre_playlists(genre):
+    """Return {source: playlist id} for the genre's playlist from each source (the id is None if the source has none).
+
+    Playlists resolved recently enough are read from the genre's row. The rest are searched for concurrently, and
+    the results (including "no playlist found") are saved. A source whose search failed is left out."""
+
+    playlist_ids = {}
+    sources_to_search = []
+
+    for source in Genre.PLAYLIST_COLUMNS:
+        resolved, playlist_id = genre.playlist_id(source)
+
+        if resolved:
+            playlist_ids[source] = playlist_id
+        else:
+            sources_to_search.append(source)
+
+    if sources_to_search:
+        found = await spotify_async.run(spotify_async.find_genre_playlists(genre.title, sources_to_search))
+
+        for source, playlist_id in found.items():
+            genre.set_playlist_id(source, playlist_id)
+
+        db.session.commit()
+        playlist_ids.update(found)
+
+    return playlist_ids
+
+async def get_current_playlist_info(playlist_id):
+    """Do the cheap metadata fetch that tells us which version of the playlist is current (its `snapshot_id`) and
+    how many tracks it has. Return None if it failed."""
+
+    return await spotify_async.run(spotify_async.get_playlist_info(playlist_id))
+
+def pending_enrichment_job(playlist_id, playlist_info_payload, retry=False):
+    """Big playlists are fetched and enriched by the background worker (see enrichment_worker.py), so a web worker
+    isn't kept busy for the whole playlist. Return the playlist's job (queuing it if there isn't one yet) while it's
+    queued, running or failed, so the caller can report its progress instead of the tracks. With `retry`, a failed job is queued again.
+
+    Return None once the tracks can be served from this request: the playlist is short, it's cached (or an older
+    version is, which is quick to update), or its job is done (its tracks are then put in the playlist cache)."""
+
+    snapshot_id = playlist_info_payload.get('snapshot_id') if playlist_info_payload else None
+    total = (playlist_info_payload or {}).get('tracks', {}).get('total', 0)
+
+    if not snapshot_id or total < BACKGROUND_JOB_MIN_TRACKS:
+        return None
+
+    if playlist_cache.get(playlist_id, snapshot_id) is not None or playlist_cache.previous(playlist_id) is not None:
+        return None
+
+    job = EnrichmentJob.for_snapshot(playlist_id, snapshot_id)
+
+    if job is None:
+        return enqueue_enrichment_job(playlist_id, playlist_info_payload)
+
+    if job.status == JOB_FAILED and retry:
+        job.retry()
+
+    if job.status != JOB_DONE:
+        return job
+
+    tracks = PlaylistTracks(job.total, spotify.max_tracks)
+    tracks.extend(job.tracks())
+    playlist_cache.put(playlist_id, IndexedPlaylist(tracks), snapshot_id)
+
+    return None
+
+def enqueue_enrichment_job(playlist_id, playlist_info_payload):
+    """Queue a job to enrich this version of the playlist (its pages, up to max_tracks worth), or return the one already queued."""
+
+    total = playlist_info_payload.get('tracks', {}).get('total', 0)
+    pages_total = math.ceil(min(total, spotify.max_tracks) / PLAYLIST_PAGE_LIMIT)
+
+    return EnrichmentJob.enqueue(playlist_id, playlist_info_payload['snapshot_id'], total, pages_total)
+
+def job_response(job):
+    """A 202 with the job's progress, pointing at where to poll for more."""
+
+    status_url = f'/jobs/{job.id}'
+
+    response = jsonify({**job.progress(), 'status_url': status_url})
+    response.status_code = 202
+    response.headers['Location'] = status_url
+
+    return response
+
+async def get_indexed_playlist(playlist_id, snapshot_id):
+    """Return (the playlist's enriched, indexed tracks, the snapshot they are of). Read them from the cache if this
+    snapshot of the playlist is cached. If an older version is cached, update it (only the added tracks are enriched).
+    Otherwise fetch and enrich the tracks. Either way, cache them under the snapshot.
+
+    If they couldn't be fetched, return the last cached version of the playlist (marked stale) with its own, older
+    snapshot, so it isn't tagged as the current one. Return (None, None) if there isn't one."""
+
+    playlist = playlist_cache.get(playlist_id, snapshot_id) if snapshot_id else None
+
+    if playlist is None:
+        previous = playlist_cache.previous(playlist_id) if snapshot_id else None
+
+        if previous is not None:
+            tracks = await spotify_async.run(spotify_async.update_playlist_tracks(playlist_id, previous.tracks))
+        else:
+            tracks = await spotify_async.run(spotify_async.get_playlist_tracks(playlist_id))
+
+        if tracks is None:
+            # Spotify is failing. The last version we had is better than nothing.
+            previous_snapshot_id, playlist = playlist_cache.previous_snapshot(playlist_id)
+
+            if playlist is not None:
+                mark_stale('/playlists/{id}/tracks')
+
+            return playlist, previous_snapshot_id
+
+        playlist = IndexedPlaylist(tracks)
+
+        if snapshot_id:
+            playlist_cache.put(playlist_id, playlist, snapshot_id)
+
+    return playlist, snapshot_id
+
+def iter_playlist_track_batches(playlist_id, playlist_info_payload):
+    """Yield the playlist's enriched tracks in batches (in playlist order).
+
+    If this version of the playlist is already cached (or an older version can be updated, which only enriches
+    the added tracks), the batches are read from the cache. Otherwise they're fetched and enriched as they're
+    yielded, and cached once the last one is out. If a call fails, None is yielded and the generator stops."""
+
+    snapshot_id = playlist_info_payload.get('snapshot_id') if playlist_info_payload else None
+
+    playlist = playlist_cache.get(playlist_id, snapshot_id) if snapshot_id else None
+    previous = playlist_cache.previous(playlist_id) if snapshot_id and playlist is None else None
+
+    if previous is not None:
+        tracks = spotify.update_playlist_tracks(playlist_id, previous.tracks)
+
+        if tracks is not None:
+            playlist = IndexedPlaylist(tracks)
+            playlist_cache.put(playlist_id, playlist, snapshot_id)
+
+    if playlist is not None:
+        for start in range(0, len(playlist.tracks), STREAM_BATCH_SIZE):
+            yield playlist.tracks[start:start + STREAM_BATCH_SIZE]
+        return
+
+    # The tracks come back with the same limits (and truncation metadata) as get_playlist_tracks, or None if a call failed
+    tracks = yield from spotify.iter_playlist_tracks(playlist_id)
+
+    if tracks is not None and snapshot_id:
+        playlist_cache.put(playlist_id, IndexedPlaylist(tracks), snapshot_id)
+
+def mark_stale(endpoint, kind=None):
+    """Mark the response as served from a stale cached payload. If that's because Spotify's `endpoint` is failing
+    (its circuit is open), also tell the user the `kind` of details they're seeing may be out of date."""
+
+    g.served_stale = True
+
+    if kind and breakers.is_open(endpoint):
+        flash(f"Spotify isn't responding right now, so these {kind} details may be out of date.", "warning")
+
+@app.after_request
+def add_stale_warning(response):
+    if g.get('served_stale'):
+        response.headers['Warning'] = '110 - "Response is Stale"'
+
+    return response
+
+def add_snapshot_etag(response, snapshot_id):
+    """Tag the response with the playlist's snapshot, so the browser can ask whether it changed (and get a 304 if it didn't)."""
+
+    if snapshot_id and response.status_code == 200:
+        response.set_etag(snapshot_id)
+
+        # The browser may keep the response, but has to check that the playlist hasn't changed before using it
+        response.headers['Cache-Control'] = 'no-cache'
+
+    return response
+
+def not_modified(snapshot_id):
+    """A bodyless 304 for a browser that already has this snapshot of the playlist."""
+
+    response = Response(status=304)
+    response.set_etag(snapshot_id)
+    response.headers['Cache-Control'] = 'no-cache'
+
+    return response
+
+def use_server_side_table(playlist_info_payload):
+    """Page, sort and search long playlists on the server, so the browser doesn't have to download every track."""
+    return (playlist_info_payload.get('tracks') or {}).get('total', 0) >= SERVER_SIDE_TABLE_MIN_TRACKS
+
+
 def extract_playlist_id(link):
     parts = link.split('/')
 
@@ -0,0 +1,548 @@
+"""Asyncio version of the SpotifyClient, used by the I/O-bound routes.
+
+What it buys is concurrency within a request: a playlist's pages and their audio features / artists calls are
+all in flight at once, on one shared connection pool. It doesn't let a worker serve more requests at once. Under
+gunicorn's gthread workers (see the Procfile) a Flask async view still holds its worker thread until it returns
+(asgiref runs the view's loop in that thread), so the number of requests a process serves at once is its thread
+count, and the Procfile's --threads is sized for requests that spend most of their time waiting on Spotify.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+
+import aiohttp
+
+from spotify_client import (SpotifyClient, PlaylistTracks, SUCCESS_STATUS_CODES, PLAYLIST_PAGE_LIMIT, DEFAULT_MAX_WORKERS,
+                            DEFAULT_MAX_TRACKS, DEFAULT_MAX_MEMORY_BYTES, clean_playlist_tracks, clean_top_tracks)
+from enrichment import EnrichmentPlan
+from coalesce import AsyncSingleFlight, coalesced
+from metrics import record_upstream_call, record_retry
+from circuit_breaker import CircuitBreakers
+from retry_policy import RetryPolicies
+from transport import DEFAULT_POOL_SIZE, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, API_BASE_URL
+from token_manager import TokenManager
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSpotifyClient:
+    """An asyncio sibling of the SpotifyClient with the same public methods (as coroutines).
+
+    All of the client's coroutines run on one long-lived event loop in a background thread, so every
+    request handled by this process shares the same aiohttp connection pool. Use `run()` to await
+    one of the client's coroutines from a Flask async view (which runs on its own, short-lived loop, in
+    the thread serving the request):
+
+        tracks = await spotify_async.run(spotify_async.get_playlist_tracks(playlist_id))
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT, max_concurrency=DEFAULT_MAX_WORKERS, artist_cache=None, audio_features_store=None, scheduler=None, token_manager=None,
+                 max_tracks=DEFAULT_MAX_TRACKS, max_memory_bytes=DEFAULT_MAX_MEMORY_BYTES, api_base_url=API_BASE_URL, breakers=None, retry_policies=None):
+        self.pool_size = pool_size
+        self.api_base_url = api_base_url  # point at a stand-in (e.g. fake_spotify) to run without the real API
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.max_concurrency = max_concurrency
+
+        # Limits for very large playlists (see spotify_client.PlaylistTracks)
+        self.max_tracks = max_tracks
+        self.max_memory_bytes = max_memory_bytes
+
+        # Optional caches.ArtistCache / caches.AudioFeaturesStore. Their database calls are run in a thread so they don't block the event loop.
+        self.artist_cache = artist_cache
+        self.audio_features_store = audio_features_store
+
+        # Optional rate_limiter.RateLimitScheduler. Its bucket is checked in a thread, and waiting for a turn sleeps without blocking the event loop.
+        self.scheduler = scheduler
+
+        # Requests to an endpoint that keeps failing are turned away without being sent. Share the sync client's to share what they learn.
+        self.breakers = breakers or CircuitBreakers()
+
+        # Server errors and dropped connections are retried with backoff, and slow requests to some endpoints are hedged (see retry_policy.py)
+        self.retry_policies = retry_policies or RetryPolicies()
+
+        # Concurrent calls for the same playlist / artist / genre search share one upstream operation
+        self.single_flight = AsyncSingleFlight()
+
+        self.enrichment_calls_made = 0
+        self.enrichment_calls_saved = 0
+        self.tracks_reused = 0  # enriched tracks carried over by update_playlist_tracks
+
+        # Share the sync client's TokenManager to share its token. Token fetches run in a thread, off the event loop.
+        self.tokens = token_manager or TokenManager()
+
+        # The session has to be created on the shared loop, so it's set up lazily
+        self.session = None
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='spotify-event-loop', daemon=True)
+        self._thread.start()
+
+    def run(self, coro):
+        """Schedule a coroutine on the shared event loop. Returns an awaitable for the caller's loop."""
+        return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    def run_sync(self, coro):
+        """Run a coroutine on the shared event loop and block until it's done (for non-async callers)."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def get_session(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    async def get_token(self, expired_token=None):
+        """Return a valid access token, or a replacement for `expired_token`.
+        Only fetching a new token does any I/O, and that runs in a thread so it doesn't block the event loop."""
+
+        if expired_token is not None:
+            return await asyncio.to_thread(self.tokens.refresh, expired_token)
+
+        access_token = self.tokens.current_token()
+
+        if access_token is not None:
+            return access_token
+
+        return await asyncio.to_thread(self.tokens.get_token)
+
+    async def api_get(self, url, params=None, with_status=False):
+        """Make a GET request to the Spotify API and return the JSON payload, or None if the request failed.
+        If the access token expired, get a new token and try the request one more time.
+        If Spotify responds with a 429, back off for the Retry-After period and try again.
+        Server errors and dropped connections are retried as the endpoint's RetryPolicy says.
+        If the endpoint's circuit is open, return None without sending the request.
+
+        With `with_status`, return (payload, status code) instead, so callers can tell a 404 from an outage.
+        The status code is None if no response came back (a timeout, an open circuit, no token)."""
+
+        payload, status = await self.get_with_status(url, params)
+
+        return (payload, status) if with_status else payload
+
+    async def get_with_status(self, url, params):
+        if not self.breakers.for_url(url).allow():
+            print(f"Error: Spotify keeps failing, so not requesting {url} for now")
+            return None, None
+
+        session = await self.get_session()
+        access_token = await self.get_token()
+
+        if access_token is None:
+            return None, None
+
+        policy = self.retry_policies.for_url(url)
+        token_refreshed = False
+        rate_limit_retries = self.scheduler.max_retries if self.scheduler is not None else 0
+        attempt = 1
+
+        while True:
+            if self.scheduler is not None and not await self.scheduler.wait_for_slot_async():
+                print(f"Error: gave up waiting for a rate limit slot to request {url}")
+                return None, None
+
+            try:
+                status, headers, payload = await self.send_hedged(session, url, params, access_token)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                if policy.should_retry_exception(e, attempt):
+                    self.retry_policies.record_retry(url, 'connection_error')
+                    await asyncio.sleep(policy.backoff(attempt))
+                    attempt += 1
+                    continue
+
+                self.breakers.record(url, None)
+                print(f"Error: {e!r}")
+                return None, None
+
+            if policy.should_retry_status(status, attempt):
+                self.retry_policies.record_retry(url, 'server_error')
+                await asyncio.sleep(policy.backoff(attempt))
+                attempt += 1
+                continue
+
+            if status == 429 and rate_limit_retries > 0:
+                record_retry(url, 'rate_limited')
+                rate_limit_retries -= 1
+                await asyncio.to_thread(self.scheduler.rate_limited, headers)
+                continue
+
+            if not token_refreshed and self.should_retry(status, payload):
+                # get new token and try request again
+                record_retry(url, 'expired_token')
+                token_refreshed = True
+                access_token = await self.get_token(expired_token=access_token)
+
+                if access_token is None:
+                    return None, None
+
+                continue
+
+            break
+
+        self.breakers.record(url, status)
+
+        if status not in SUCCESS_STATUS_CODES:
+            logger.warning("Spotify responded %s to %s: %s", status, url, payload)
+            return None, status
+
+        return payload, status
+
+    async def send_hedged(self, session, url, params, access_token):
+        """Send the request and return (status, headers, payload). If the endpoint's policy hedges and no response has
+        come back by the time most of its requests have, send a duplicate and use whichever response comes back first
+        (the other is cancelled). Raises the request's error if every copy of it failed."""
+
+        hedge_delay = self.retry_policies.hedge_delay(url)
+
+        if hedge_delay is None:
+            return await self.send_request(session, url, params, access_token)
+
+        original = asyncio.ensure_future(self.send_request(session, url, params, access_token))
+        done, _ = await asyncio.wait([original], timeout=hedge_delay)
+
+        if done:
+            return original.result()
+
+        duplicate = asyncio.ensure_future(self.send_duplicate(session, url, params, access_token))
+        pending = {original, duplicate}
+        error = None
+
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif task.result() is not None:
+                        self.retry_policies.record_hedge(url, won=task is duplicate)
+                        return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise error
+
+    async def send_duplicate(self, session, url, params, access_token):
+        """Send a hedged request's duplicate, if the rate limit allows it. Return None if it doesn't."""
+
+        if self.scheduler is not None and not await self.scheduler.wait_for_slot_async():
+            return None
+
+        return await self.send_request(session, url, params, access_token)
+
+    async def send_request(self, session, url, params, access_token):
+        """Send one request and record how it went. Return (status, headers, payload)."""
+
+        started = time.perf_counter()
+
+        try:
+            async with session.get(url, headers={'Authorization': f'Bearer {access_token}'}, params=params) as response:
+                body = await response.read()
+                payload = decode_payload(response.status, body)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            record_upstream_call(url, time.perf_counter() - started, None)
+            raise
+
+        seconds = time.perf_counter() - started
+        record_upstream_call(url, seconds, response.status, len(body))
+        self.retry_policies.record_latency(url, seconds)
+
+        return response.status, response.headers, payload
+
+    def retry_stats(self):
+        """Report how many requests were retried (for server errors and dropped connections) and hedged."""
+        return self.retry_policies.stats()
+
+    def coalescing_stats(self):
+        """Report how many calls were coalesced into an identical call that was already in flight."""
+        return self.single_flight.stats()
+
+    def enrichment_stats(self):
+        """Report how many enrichment calls were made, how many the enrichment planner saved,
+        and how many enriched tracks were reused when updating a changed playlist."""
+        return {
+            'enrichment_calls_made': self.enrichment_calls_made,
+            'enrichment_calls_saved': self.enrichment_calls_saved,
+            'tracks_reused': self.tracks_reused,
+        }
+
+    def should_retry(self, status, payload):
+        # With client credentials, any 401 means our token is expired or no longer valid
+        return status == 401
+
+    @coalesced
+    async def get_playlist_info(self, playlist_id, with_status=False):
+        """Get metadata about a playlist from the Spotify API. With `with_status`, return (payload, status code) (see `api_get`)."""
+
+        playlist_url = f'{self.api_base_url}/playlists/{playlist_id}'
+        fields =  'id, href, name, images, snapshot_id, tracks(total)'
+        params = {'fields': fields, 'market': 'US'}
+
+        return await self.api_get(playlist_url, params, with_status)
+
+    @coalesced
+    async def get_playlist_tracks(self, playlist_id):
+        """Get metadata about playlist tracks from the Spotify API.
+        Append audio features and artist genre & popularity.
+
+        The whole playlist is fetched first (see `fetch_playlist_tracks`) and then enriched in one pass.
+        Tracks are returned in playlist order, as a PlaylistTracks list."""
+
+        tracks = await self.fetch_playlist_tracks(playlist_id)
+
+        if tracks is None:
+            return None
+
+        return await self.enrich_tracks(tracks)
+
+    async def update_playlist_tracks(self, playlist_id, previous_tracks):
+        """Bring a previously enriched version of a playlist up to date, enriching only the tracks added since.
+        See SpotifyClient.update_playlist_tracks."""
+
+        tracks = await self.fetch_playlist_tracks(playlist_id)
+
+        if tracks is None:
+            return None
+
+        previous = {track.id: track for track in previous_tracks if track.id}
+        added_tracks = [track for track in tracks if track.id not in previous]
+
+        if await self.enrich_tracks(added_tracks) is None:
+            return None
+
+        tracks[:] = [previous.get(track.id, track) for track in tracks]
+        self.tracks_reused += len(tracks) - len(added_tracks)
+
+        return tracks
+
+    async def fetch_playlist_tracks(self, playlist_id):
+        """Get all of a playlist's tracks, without enriching them.
+
+        After the first page, the remaining pages are fetched concurrently, `max_concurrency` at a time.
+        Tracks are returned in playlist order, as a PlaylistTracks list: at most `max_tracks` of them,
+        with its metadata saying if the list was cut short."""
+
+        first_page = await self.get_playlist_tracks_page(playlist_id, 0)
+
+        if first_page is None:
+            return None
+
+        tracks = PlaylistTracks(first_page.get('total', 0), self.max_tracks, self.max_memory_bytes)
+        room_left = tracks.add_batch(clean_playlist_tracks(first_page))
+
+        offsets = range(PLAYLIST_PAGE_LIMIT, min(tracks.total, self.max_tracks), PLAYLIST_PAGE_LIMIT)
+
+        # Fetch a window of pages at a time, so only a few raw pages are in memory at once
+        # and we can stop as soon as the memory ceiling is reached
+        for start in range(0, len(offsets), self.max_concurrency):
+            if not room_left:
+                break
+
+            window = offsets[start:start + self.max_concurrency]
+            pages = await asyncio.gather(*(self.get_playlist_tracks_page(playlist_id, offset) for offset in window))
+
+            if any(page is None for page in pages):
+                return None
+
+            for page in pages:
+                room_left = tracks.add_batch(clean_playlist_tracks(page))
+
+                if not room_left:
+                    break
+
+        if tracks.truncated:
+            print(f"Playlist {playlist_id} cut short at {len(tracks)} of {tracks.total} tracks ({tracks.truncated_reason})")
+
+        return tracks
+
+    async def get_playlist_tracks_page(self, playlist_id, offset):
+        """Get one page of a playlist's tracks, starting at `offset`."""
+
+        playlist_tracks_url = f'{self.api_base_url}/playlists/{playlist_id}/tracks'
+        fields =  'next, offset, total, items(track(id, name, popularity, duration_ms, is_playable, preview_url, type, artists(id, name), album(name, href)))'
+        params = {'fields': fields, 'market': 'US', 'limit': PLAYLIST_PAGE_LIMIT, 'offset': offset}
+
+        return await self.api_get(playlist_tracks_url, params)
+
+    async def gather_limited(self, coros):
+        """Await the coroutines concurrently, at most `max_concurrency` at a time. Results come back in order."""
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def limited(coro):
+            async with semaphore:
+                return await coro
+
+        return list(await asyncio.gather(*(limited(coro) for coro in coros)))
+
+    async def enrich_tracks(self, tracks):
+        """Append audio features and artist details to the tracks, with the batches of both calls made concurrently."""
+
+        if not tracks:
+            return tracks
+
+        plan = EnrichmentPlan(tracks, self.api_base_url)
+        await self.use_stored_audio_features(plan)
+        await self.use_cached_artists(plan)
+
+        payloads = await self.gather_limited(self.api_get(url, params) for url, params in plan.requests())
+
+        if any(payload is None for payload in payloads):
+            return None
+
+        self.enrichment_calls_made += plan.calls_planned()
+        self.enrichment_calls_saved += plan.calls_saved()
+
+        plan.apply(payloads)
+        await self.store_fetched_audio_features(plan)
+        await self.cache_fetched_artists(plan)
+
+        return tracks
+
+    async def use_cached_artists(self, plan):
+        """Only fetch the artists that aren't in the artist cache (or are stale)."""
+
+        if self.artist_cache is not None:
+            plan.use_cached_artists(await asyncio.to_thread(self.artist_cache.get_many, plan.artist_ids))
+
+    async def cache_fetched_artists(self, plan):
+        if self.artist_cache is not None:
+            await asyncio.to_thread(self.artist_cache.put_many, list(plan.fetched_artists.values()))
+
+    async def use_stored_audio_features(self, plan):
+        """Only fetch audio features for tracks we've never seen before."""
+
+        if self.audio_features_store is not None:
+            plan.use_stored_audio_features(await asyncio.to_thread(self.audio_features_store.get_many, plan.track_ids))
+
+    async def store_fetched_audio_features(self, plan):
+        if self.audio_features_store is not None:
+            await asyncio.to_thread(self.audio_features_store.put_many, list(plan.fetched_audio_features.values()))
+
+    async def get_track_audio_features(self, tracks):
+        """ Get track audio features from spotify and append them to the tracks list """
+
+        plan = EnrichmentPlan(tracks, self.api_base_url)
+        await self.use_stored_audio_features(plan)
+
+        payloads = await self.gather_limited(self.api_get(url, params) for url, params in plan.audio_features_requests())
+
+        if any(payload is None for payload in payloads):
+            return None
+
+        plan.apply_audio_features(payloads)
+        await self.store_fetched_audio_features(plan)
+
+        return tracks
+
+    async def get_tracks_artists(self, tracks):
+        """ Get artist details (namely popularity & genres) and append to tracks """
+
+        plan = EnrichmentPlan(tracks, self.api_base_url)
+        await self.use_cached_artists(plan)
+
+        payloads = await self.gather_limited(self.api_get(url, params) for url, params in plan.artists_requests())
+
+        if any(payload is None for payload in payloads):
+            return None
+
+        plan.apply_artists(payloads)
+        await self.cache_fetched_artists(plan)
+
+        return tracks
+
+    @coalesced
+    async def get_artist_details(self, artist_id):
+        """ Get the details for a singluar artist """
+        if self.artist_cache is not None:
+            artist_payload = await asyncio.to_thread(self.artist_cache.get, artist_id)
+
+            if artist_payload:
+                return artist_payload
+
+        artist_url = f'{self.api_base_url}/artists/{artist_id}'
+
+        artist_payload = await self.api_get(artist_url)
+
+        if artist_payload and self.artist_cache is not None:
+            await asyncio.to_thread(self.artist_cache.put_many, [artist_payload])
+
+        return artist_payload
+
+    @coalesced
+    async def get_artist_top_tracks(self, artist_id):
+        """ Get the top tracks for a particular artist """
+        artist_top_tracks_url = f'{self.api_base_url}/artists/{artist_id}/top-tracks'
+        params = {'ids': artist_id, 'market': 'US'}
+
+        payload = await self.api_get(artist_top_tracks_url, params)
+
+        if payload is None:
+            return None
+
+        return clean_top_tracks(payload.get('tracks'))
+
+    async def get_playlist_by_genre(self, genre_title, source):
+        """ Find either the official Spotify playist or "Every Noise's" thesoundsofspotify playlist for the genre using the Spotify Search API. """
+
+        playlist_search_results = await self.search_genre_playlists(genre_title, source)
+
+        if playlist_search_results is None:
+            return None
+
+        return self.find_matching_playlist(playlist_search_results, genre_title, source)
+
+    async def find_genre_playlists(self, genre_title, sources):
+        """Find the genre's playlist from each of the sources, searching for them concurrently.
+        Return {source: playlist id, or None if the source has no playlist for the genre}. Sources whose search failed are left out."""
+
+        search_results = await self.gather_limited(self.search_genre_playlists(genre_title, source) for source in sources)
+
+        return {source: self.find_matching_playlist(playlist_search_results, genre_title, source)
+                for source, playlist_search_results in zip(sources, search_results) if playlist_search_results is not None}
+
+    @coalesced
+    async def search_genre_playlists(self, genre_title, source):
+        """Search for the genre's playlists from `source`. Return the search results, or None if the search failed."""
+
+        search_url = f"{self.api_base_url}/search"
+
+        if source == 'spotify':
+            query = f'{genre_title}'
+        elif source == 'thesoundsofspotify':
+            query = f'the sound of {genre_title}'
+
+        params = {'q':query,'type':'playlist', 'market':'US', 'limit':'10'}
+
+        payload = await self.api_get(search_url, params)
+
+        if payload is None:
+            return None
+
+        return payload.get('playlists', {}).get('items', {})
+
+    # Matching search results doesn't do any I/O, so share the synchronous client's implementation
+    find_matching_playlist = SpotifyClient.find_matching_playlist
+    replace_genre_title = SpotifyClient.replace_genre_title
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+def decode_payload(status, body):
+    """Return the response body's JSON payload, or None if it's empty. An error response that isn't JSON (like a
+    gateway's HTML error page) has no payload either: its status code says what went wrong, and whether to retry.
+    Raises ValueError if a successful response isn't JSON."""
+
+    if not body:
+        return None
+
+    try:
+        return json.loads(body)
+    except ValueError:
+        if status in SUCCESS_STATUS_CODES:
+            raise
+        return None
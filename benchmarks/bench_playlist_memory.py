@@ -0,0 +1,64 @@
+"""Show that the memory used per track stays flat as playlists grow (from 100 to 10,000 tracks).
+
+Run from the project root:
+
+    python -m benchmarks.bench_playlist_memory
+
+Each playlist is fetched and enriched from the in-process synthetic API, so the numbers measure
+the client, not the network. `peak` is the most memory allocated at any point while fetching,
+`retained` is what the returned tracks still hold on to.
+"""
+import argparse
+import tempfile
+import time
+import tracemalloc
+
+from fake_spotify.synthetic import SyntheticTransport
+from spotify_client import SpotifyClient
+from token_manager import TokenManager
+
+PLAYLIST_SIZES = [100, 1000, 2500, 5000, 10000]
+
+
+def measure(playlist_size, max_tracks):
+    transport = SyntheticTransport(playlist_size=playlist_size)
+
+    with tempfile.NamedTemporaryFile(suffix='.json') as token_cache:
+        tokens = TokenManager(transport, cache_path=token_cache.name)
+        tokens.get_token()
+
+        client = SpotifyClient(transport=transport, token_manager=tokens, max_tracks=max_tracks)
+
+        tracemalloc.start()
+        started = time.perf_counter()
+
+        tracks = client.get_playlist_tracks('synthetic')
+
+        seconds = time.perf_counter() - started
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'tracks': len(tracks),
+        'truncated': tracks.truncated_reason,
+        'seconds': seconds,
+        'peak_per_track': peak / len(tracks),
+        'retained_per_track': retained / len(tracks),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=PLAYLIST_SIZES)
+    parser.add_argument('--max-tracks', type=int, default=max(PLAYLIST_SIZES))
+    args = parser.parse_args()
+
+    print(f"{'tracks':>8} {'seconds':>8} {'peak/track':>12} {'retained/track':>15}  truncated")
+
+    for playlist_size in args.sizes:
+        result = measure(playlist_size, args.max_tracks)
+        print(f"{result['tracks']:>8} {result['seconds']:>8.2f} {result['peak_per_track']:>10.0f} B {result['retained_per_track']:>13.0f} B  {result['truncated'] or '-'}")
+
+
+if __name__ == '__main__':
+    main()
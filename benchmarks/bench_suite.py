@@ -0,0 +1,346 @@
+"""Microbenchmarks for the SpotifyClient, the genre catalogue and the Flask routes, run against the fake Spotify server.
+
+Run from the project root:
+
+    python -m benchmarks.bench_suite --save-baseline     # once, before a change
+    python -m benchmarks.bench_suite                     # after it: compares with the baseline
+
+The fake server (fake_spotify) runs in its own process, on a free port, so its work isn't counted. The app
+runs against a scratch SQLite database seeded with the full genre catalogue (or --database-url, whose tables
+are dropped and re-seeded). The shared rate limit is switched off, so the timings measure the code, not the budget.
+
+For each benchmark:
+- `seconds`: the median (and fastest) wall time of `--repeats` runs
+- `upstream_calls`: Spotify API requests per run, as counted by the fake server
+- `peak_bytes`: the most memory allocated at any point during a run (tracemalloc)
+- `retained_bytes` / `retained_blocks`: memory (and the number of allocations) a run left behind
+
+Results are written as JSON. Against a baseline, a benchmark regresses if it's more than `--tolerance`
+slower or uses that much more peak memory, or if it makes more upstream calls; the exit status is then 1.
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import requests
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+DEFAULT_OUTPUT = os.path.join(RESULTS_DIR, 'latest.json')
+DEFAULT_BASELINE = os.path.join(RESULTS_DIR, 'baseline.json')
+DEFAULT_REPEATS = 5
+DEFAULT_TOLERANCE = 0.2  # 20% slower (or more peak memory) than the baseline is a regression
+
+PLAYLIST_SIZES = [50, 500, 5000]
+GENRE_LOOKUP_STEP = 100      # look up every 100th genre of the catalogue (plus one that isn't in it)
+MATCHING_PLAYLIST_CALLS = 1000
+BENCHMARK_GENRE = 'cowpunk'
+SERVER_STARTUP_TIMEOUT = 10  # seconds
+BENCH_TOKEN_CACHE_PATH = os.path.join(tempfile.gettempdir(), 'spotify-explorer-bench-token.json')  # not the app's shared token cache
+
+
+class FakeSpotifyProcess:
+    """The fake Spotify server, running in a subprocess on a free port."""
+
+    def __init__(self):
+        self.port = free_port()
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        self.process = subprocess.Popen([sys.executable, '-m', 'fake_spotify.server', '--port', str(self.port)],
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        deadline = time.monotonic() + SERVER_STARTUP_TIMEOUT
+
+        while time.monotonic() < deadline:
+            try:
+                self.upstream_calls()
+                return
+            except requests.ConnectionError:
+                time.sleep(0.1)
+
+        self.stop()
+        raise RuntimeError("The fake Spotify server didn't start")
+
+    def upstream_calls(self):
+        return requests.get(f'{self.base_url}/_fake/stats').json()['api_requests']
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+class Benchmark:
+    """A named operation to time. `setup` (untimed) runs before every run of `run`."""
+
+    def __init__(self, name, run, setup=None, operations=1):
+        self.name = name
+        self.run = run
+        self.setup = setup or (lambda: None)
+        self.operations = operations
+
+    def measure(self, fake_spotify, repeats):
+        self.setup()
+        self.run()  # warm up: imports, connections, the token and the database caches
+
+        timings = []
+        calls_before = fake_spotify.upstream_calls()
+
+        for _ in range(repeats):
+            self.setup()
+            started = time.perf_counter()
+            self.run()
+            timings.append(time.perf_counter() - started)
+
+        upstream_calls = (fake_spotify.upstream_calls() - calls_before) / repeats
+
+        # Memory is measured on a separate run, since tracing allocations slows everything down
+        self.setup()
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        self.run()
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        retained = [stat for stat in after.compare_to(before, 'filename') if stat.size_diff > 0]
+
+        return {
+            'operations': self.operations,
+            'seconds': statistics.median(timings),
+            'fastest_seconds': min(timings),
+            'upstream_calls': upstream_calls,
+            'peak_bytes': peak,
+            'retained_bytes': sum(stat.size_diff for stat in retained),
+            'retained_blocks': sum(max(stat.count_diff, 0) for stat in retained),
+        }
+
+
+def client_benchmarks(fake_spotify):
+    """Benchmarks of the SpotifyClient on its own, without the app's caches."""
+
+    from spotify_client import SpotifyClient
+    from token_manager import TokenManager
+    from fake_spotify.catalog import Catalog
+
+    tokens = TokenManager(cache_path=BENCH_TOKEN_CACHE_PATH)
+
+    def new_client():
+        return SpotifyClient(token_manager=tokens, max_tracks=max(PLAYLIST_SIZES))
+
+    benchmarks = []
+
+    for size in PLAYLIST_SIZES:
+        # A new client each run, so nothing is coalesced or reused. They all share one token.
+        benchmarks.append(Benchmark(f'get_playlist_tracks[{size}]', lambda size=size: new_client().get_playlist_tracks(f'synthetic-{size}')))
+
+    client = new_client()
+    catalog = Catalog()
+    genre_titles = [f'genre {n}' for n in range(MATCHING_PLAYLIST_CALLS)]
+    search_results = {title: decoys(title) + catalog.search_playlists(title) for title in genre_titles}
+
+    def find_matching_playlists():
+        for title in genre_titles:
+            client.find_matching_playlist(search_results[title], title, 'spotify')
+
+    benchmarks.append(Benchmark('find_matching_playlist', find_matching_playlists, operations=MATCHING_PLAYLIST_CALLS))
+
+    return benchmarks
+
+
+def decoys(genre_title):
+    """Search results that don't match, so find_matching_playlist goes through a full page of 10 results."""
+    return [{'id': f'decoy{n}', 'name': f'{genre_title} vibes {n}', 'owner': {'id': f'listener{n}'}} for n in range(8)]
+
+
+def point_at(fake_spotify, database_url):
+    """Point the client and the app at the fake server and the scratch database. Must run before they're imported."""
+
+    os.environ['SPOTIFY_API_BASE_URL'] = f'{fake_spotify.base_url}/v1'
+    os.environ['SPOTIFY_ACCOUNTS_BASE_URL'] = fake_spotify.base_url
+    os.environ['SPOTIFY_EXPLORER_DATABASE_URL'] = database_url
+
+    # A token left over from another run's fake server would only be turned away with a 401
+    if os.path.exists(BENCH_TOKEN_CACHE_PATH):
+        os.remove(BENCH_TOKEN_CACHE_PATH)
+
+
+def app_benchmarks(fake_spotify):
+    """Benchmarks of the genre catalogue and the app's routes."""
+
+    import app as app_module
+    from caches import PlaylistCache
+    from models import Genre
+
+    # Keep the fake server's tokens out of the real app's shared token cache, and don't wait on the shared rate limit
+    app_module.token_manager.cache_path = BENCH_TOKEN_CACHE_PATH
+    app_module.spotify.scheduler = None
+    app_module.spotify_async.scheduler = None
+
+    app = app_module.app
+    user_id = seed_database()
+
+    with app.app_context():
+        genre_titles = [genre.title for genre in Genre.query.order_by(Genre.id)][::GENRE_LOOKUP_STEP] + ['not a genre at all']
+
+    def lookup_genres():
+        with app.app_context():
+            for title in genre_titles:
+                Genre.lookup_genre(title)
+
+    def clear_playlist_cache():
+        app_module.playlist_cache = PlaylistCache()
+
+    def get(url, logged_in=False):
+        def run():
+            client = app.test_client()
+
+            if logged_in:
+                with client.session_transaction() as session:
+                    session[app_module.CURR_USER_KEY] = user_id
+
+            response = client.get(url)
+
+            if response.status_code != 200:
+                raise RuntimeError(f"{url} responded with {response.status_code}")
+
+        return run
+
+    return [
+        Benchmark('Genre.lookup_genre', lookup_genres, operations=len(genre_titles)),
+        Benchmark('GET /get-playlist-tracks[500]', get('/get-playlist-tracks/synthetic-500'), setup=clear_playlist_cache),
+        Benchmark('GET /genre-inspector', get(f'/genre-inspector/{BENCHMARK_GENRE}')),
+        Benchmark('GET /users/<id>', get(f'/users/{user_id}', logged_in=True)),
+    ]
+
+
+def seed_database():
+    """Create the tables and add every genre of the catalogue, plus a user with a few favorite, saved and disliked genres.
+    Return the user's id."""
+
+    from app import app
+    from enums import FavoriteStatus
+    from models import db, Genre, User, User_Genre
+    from research.genre_dict_list import genre_dict_list
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        db.session.add_all(Genre(title=genre['title'],
+                                 en_energy_score=genre['energy_score'],
+                                 en_dynamic_variation_score=genre['dynamic_variation_score'],
+                                 en_instrumentalness_score=genre['instrumentalness_score'],
+                                 en_organic_mechanical_score=genre['organic_mechanical_score'],
+                                 en_dense_spiky_score=genre['dense_spiky_score'],
+                                 en_popularity_score=genre['popularity_score']) for genre in genre_dict_list)
+
+        user = User.signup("benchmark", "benchmark@example.com", "benchmark")
+        db.session.commit()
+
+        statuses = [FavoriteStatus.FAVORITE, FavoriteStatus.SAVE, FavoriteStatus.DISLIKE]
+        db.session.add_all(User_Genre(user_id=user.id, genre_id=genre_id, favorite_status=statuses[genre_id % 3]) for genre_id in range(1, 31))
+        db.session.commit()
+
+        return user.id
+
+
+def compare(results, baseline, tolerance):
+    """Print each benchmark next to its baseline. Return the names of the benchmarks that regressed."""
+
+    regressions = []
+
+    print(f"{'benchmark':<32} {'seconds':>9} {'vs base':>8} {'calls':>7} {'vs base':>8} {'peak KB':>9} {'vs base':>8}")
+
+    for name, result in results['benchmarks'].items():
+        base = baseline['benchmarks'].get(name) if baseline else None
+        regressed = False
+
+        if base:
+            slower = result['seconds'] / base['seconds'] - 1 if base['seconds'] else 0.0
+            more_memory = result['peak_bytes'] / base['peak_bytes'] - 1 if base['peak_bytes'] else 0.0
+            more_calls = result['upstream_calls'] - base['upstream_calls']
+            regressed = slower > tolerance or more_memory > tolerance or more_calls > 0
+            changes = (f'{slower:+8.0%}', f'{more_calls:+8.1f}', f'{more_memory:+8.0%}')
+        else:
+            changes = ('       -',) * 3
+
+        print(f"{name:<32} {result['seconds']:>9.4f} {changes[0]} {result['upstream_calls']:>7.1f} {changes[1]} "
+              f"{result['peak_bytes'] / 1024:>9.0f} {changes[2]}{'  REGRESSION' if regressed else ''}")
+
+        if regressed:
+            regressions.append(name)
+
+    return regressions
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS, help='timed runs of each benchmark')
+    parser.add_argument('--only', default=None, help='only run the benchmarks whose name contains this')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='where to write the results')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='results to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='also save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='allowed slowdown / peak memory growth (0.2 is 20%%)')
+    parser.add_argument('--database-url', default=None, help="a scratch database (its tables are dropped!), instead of a temporary SQLite file")
+    args = parser.parse_args()
+
+    database_dir = tempfile.TemporaryDirectory()
+    database_url = args.database_url or f"sqlite:///{os.path.join(database_dir.name, 'bench.db')}"
+    fake_spotify = FakeSpotifyProcess()
+
+    try:
+        point_at(fake_spotify, database_url)
+
+        benchmarks = client_benchmarks(fake_spotify) + app_benchmarks(fake_spotify)
+        benchmarks = [benchmark for benchmark in benchmarks if args.only is None or args.only in benchmark.name]
+
+        results = {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'repeats': args.repeats,
+            'benchmarks': {},
+        }
+
+        for benchmark in benchmarks:
+            print(f"Running {benchmark.name}...")
+            results['benchmarks'][benchmark.name] = benchmark.measure(fake_spotify, args.repeats)
+    finally:
+        fake_spotify.stop()
+        database_dir.cleanup()
+
+    baseline = None
+
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.tolerance)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+
+    for path in [args.output] + ([args.baseline] if args.save_baseline else []):
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    print(f"Results written to {args.output}" + (f" and saved as the baseline ({args.baseline})" if args.save_baseline else ''))
+
+    if regressions:
+        print(f"{len(regressions)} regression(s) against {args.baseline}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
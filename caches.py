@@ -0,0 +1,313 @@
+"""Caches that sit in front of the Spotify API."""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from models import Artist, TrackAudioFeatures
+
+DEFAULT_ARTIST_TTL = timedelta(days=3)
+DEFAULT_PLAYLIST_TTL = timedelta(days=1)  # playlists are also checked against their snapshot_id on every request
+DEFAULT_MAX_PLAYLISTS = 32  # indexed playlists kept in memory per worker
+DEFAULT_FRESH_FOR = timedelta(minutes=5)      # payloads younger than this are served without asking Spotify
+DEFAULT_KEEP_STALE_FOR = timedelta(days=1)    # older payloads are dropped rather than served stale
+DEFAULT_MAX_PAYLOADS = 1000
+REVALIDATE_WORKERS = 2
+
+
+class ArtistCache:
+    """Read-through cache of artist metadata (genres, popularity, followers) backed by the artists table.
+
+    Artists fetched longer than `ttl` ago count as stale and are refetched. Each call runs in its own
+    app context, so the cache can be used from worker threads and from the async client's event loop.
+    """
+
+    def __init__(self, app, ttl=DEFAULT_ARTIST_TTL):
+        self.app = app
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, artist_ids):
+        """Return a dict of {artist_id: artist payload} for the fresh, cached artists among `artist_ids`."""
+
+        artist_ids = list(dict.fromkeys(artist_ids))
+
+        with self.app.app_context():
+            artists = Artist.get_fresh(artist_ids, self.ttl)
+            payloads = {artist_id: artist.to_payload() for artist_id, artist in artists.items()}
+
+        with self._lock:
+            self.hits += len(payloads)
+            self.misses += len(artist_ids) - len(payloads)
+
+        return payloads
+
+    def get(self, artist_id):
+        """Return the cached artist payload, or None if the artist is missing or stale."""
+        return self.get_many([artist_id]).get(artist_id)
+
+    def put_many(self, artist_payloads):
+        """Store freshly fetched Spotify artist objects."""
+
+        artist_payloads = [artist for artist in artist_payloads if artist]
+
+        if not artist_payloads:
+            return
+
+        with self.app.app_context():
+            Artist.save_payloads(artist_payloads)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'artist_cache_hits': self.hits,
+            'artist_cache_misses': self.misses,
+            'artist_cache_hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class AudioFeaturesStore:
+    """Permanent store of track audio features backed by the track_audio_features table.
+
+    A track's audio features never change, so once stored they are never fetched from Spotify again.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, track_ids):
+        """Return a dict of {track_id: audio features payload} for the stored tracks among `track_ids`."""
+
+        track_ids = list(dict.fromkeys(track_ids))
+
+        with self.app.app_context():
+            stored = TrackAudioFeatures.get_many(track_ids)
+            payloads = {track_id: features.to_payload() for track_id, features in stored.items()}
+
+        with self._lock:
+            self.hits += len(payloads)
+            self.misses += len(track_ids) - len(payloads)
+
+        return payloads
+
+    def put_many(self, audio_features_payloads):
+        """Store freshly fetched Spotify audio features objects."""
+
+        audio_features_payloads = [features for features in audio_features_payloads if features]
+
+        if not audio_features_payloads:
+            return
+
+        with self.app.app_context():
+            TrackAudioFeatures.save_payloads(audio_features_payloads)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'audio_features_store_hits': self.hits,
+            'audio_features_store_misses': self.misses,
+            'audio_features_store_hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class PlaylistCache:
+    """In-memory cache of indexed playlists (see playlist_index.IndexedPlaylist), keyed by playlist id.
+
+    Each playlist is cached under its Spotify `snapshot_id`, which changes whenever the playlist does. A lookup
+    for a different snapshot is a miss, so an unchanged playlist is never rebuilt and a changed one is never
+    served stale. The old version stays available from `previous()` until it's replaced, so a changed playlist
+    can be updated incrementally. Each worker keeps its own `max_playlists` most recently used playlists,
+    for up to `ttl` each.
+    """
+
+    def __init__(self, ttl=DEFAULT_PLAYLIST_TTL, max_playlists=DEFAULT_MAX_PLAYLISTS):
+        self.ttl = ttl
+        self.max_playlists = max_playlists
+
+        self._lock = threading.Lock()
+        self._playlists = OrderedDict()  # {playlist_id: (cached_at, snapshot_id, playlist)}, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.snapshot_changes = 0
+
+    def get(self, playlist_id, snapshot_id=None):
+        """Return the cached playlist, or None if it's missing, expired or cached under a different snapshot."""
+
+        with self._lock:
+            cached = self._lookup(playlist_id)
+
+            if cached is not None and cached[1] != snapshot_id:
+                self.snapshot_changes += 1
+                cached = None
+
+            if cached is None:
+                self.misses += 1
+                return None
+
+            self._playlists.move_to_end(playlist_id)
+            self.hits += 1
+
+            return cached[2]
+
+    def previous(self, playlist_id):
+        """Return the cached version of the playlist whatever its snapshot (or None), to update incrementally."""
+        return self.previous_snapshot(playlist_id)[1]
+
+    def previous_snapshot(self, playlist_id):
+        """Return (snapshot_id, playlist) for the cached version of the playlist whatever its snapshot, or (None, None)."""
+
+        with self._lock:
+            cached = self._lookup(playlist_id)
+            return cached[1:] if cached is not None else (None, None)
+
+    def _lookup(self, playlist_id):
+        """Return the (cached_at, snapshot_id, playlist) entry for the playlist, dropping it if it expired. Call with the lock held."""
+
+        cached = self._playlists.get(playlist_id)
+
+        if cached is not None and time.monotonic() - cached[0] > self.ttl.total_seconds():
+            del self._playlists[playlist_id]
+            return None
+
+        return cached
+
+    def put(self, playlist_id, playlist, snapshot_id=None):
+        with self._lock:
+            self._playlists[playlist_id] = (time.monotonic(), snapshot_id, playlist)
+            self._playlists.move_to_end(playlist_id)
+
+            while len(self._playlists) > self.max_playlists:
+                self._playlists.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'playlist_cache_hits': self.hits,
+            'playlist_cache_misses': self.misses,
+            'playlist_cache_hit_ratio': self.hits / lookups if lookups else 0.0,
+            'playlist_cache_snapshot_changes': self.snapshot_changes,
+            'playlist_cache_size': len(self._playlists),
+        }
+
+
+class StaleWhileRevalidateCache:
+    """In-memory cache of the last good payload for each key (e.g. a playlist's details), so pages can still be
+    served when Spotify is slow or failing.
+
+    - Payloads younger than `fresh_for` are fresh.
+    - Older ones are stale: they can still be served, while `revalidate()` refreshes them in the background
+      (one refresh per key at a time). If Spotify is failing, the refresh fails and the stale payload is kept.
+    - Payloads older than `keep_stale_for` are dropped, and have to be fetched again.
+    """
+
+    def __init__(self, fresh_for=DEFAULT_FRESH_FOR, keep_stale_for=DEFAULT_KEEP_STALE_FOR, max_payloads=DEFAULT_MAX_PAYLOADS):
+        self.fresh_for = fresh_for
+        self.keep_stale_for = keep_stale_for
+        self.max_payloads = max_payloads
+
+        self._lock = threading.Lock()
+        self._payloads = OrderedDict()  # {key: (fetched_at, payload)}, least recently used first
+        self._refreshing = set()
+        self._executor = None
+
+        self.fresh_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.failed_refreshes = 0
+
+    def lookup(self, key):
+        """Return (payload, stale). The payload is None if nothing usable is cached."""
+
+        with self._lock:
+            cached = self._payloads.get(key)
+            age = time.monotonic() - cached[0] if cached is not None else None
+
+            if cached is None or age > self.keep_stale_for.total_seconds():
+                self._payloads.pop(key, None)
+                self.misses += 1
+                return None, False
+
+            self._payloads.move_to_end(key)
+            stale = age > self.fresh_for.total_seconds()
+
+            if stale:
+                self.stale_hits += 1
+            else:
+                self.fresh_hits += 1
+
+            return cached[1], stale
+
+    def put(self, key, payload):
+        with self._lock:
+            self._payloads[key] = (time.monotonic(), payload)
+            self._payloads.move_to_end(key)
+
+            while len(self._payloads) > self.max_payloads:
+                self._payloads.popitem(last=False)
+
+    def revalidate(self, key, fetch):
+        """Call `fetch()` on a background thread and cache what it returns, unless that's None (the fetch failed).
+        Does nothing if the key is already being refreshed."""
+
+        with self._lock:
+            if key in self._refreshing:
+                return
+
+            self._refreshing.add(key)
+
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=REVALIDATE_WORKERS, thread_name_prefix='revalidate')
+
+        self._executor.submit(self._refresh, key, fetch)
+
+    def _refresh(self, key, fetch):
+        try:
+            payload = fetch()
+        except Exception as e:
+            print(f"Error: couldn't refresh {key}: {e!r}")
+            payload = None
+
+        if payload:
+            self.put(key, payload)
+        else:
+            with self._lock:
+                self.failed_refreshes += 1
+
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def get(self, key, fetch):
+        """Return (payload, stale). A fresh payload is returned as is. A stale one is returned right away and
+        refreshed in the background. Otherwise `fetch()` is called (and its payload cached, unless it's None)."""
+
+        payload, stale = self.lookup(key)
+
+        if payload is None:
+            payload = fetch()
+
+            if payload:
+                self.put(key, payload)
+
+            return payload, False
+
+        if stale:
+            self.revalidate(key, fetch)
+
+        return payload, stale
+
+    def stats(self):
+        return {
+            'fresh_hits': self.fresh_hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'failed_refreshes': self.failed_refreshes,
+            'size': len(self._payloads),
+        }
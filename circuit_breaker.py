@@ -0,0 +1,111 @@
+"""Circuit breakers that stop the clients from piling requests onto a Spotify endpoint that keeps failing."""
+import threading
+import time
+
+from metrics import endpoint_name
+
+DEFAULT_FAILURE_THRESHOLD = 5  # failures in a row (errors, timeouts, 5xx, 429s) that open the circuit
+DEFAULT_RESET_TIMEOUT = 30     # seconds the circuit stays open before one trial request is let through
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Counts an endpoint's failures in a row. After `failure_threshold` of them the circuit opens and requests
+    are turned away without being sent. After `reset_timeout` seconds, one trial request is let through
+    (half open): if it succeeds the circuit closes again, if it fails the circuit stays open for another round."""
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.rejected = 0
+
+    def allow(self):
+        """Return True if a request may be sent now."""
+
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # The next trial waits another reset_timeout, in case this one never reports back
+                self.state = HALF_OPEN
+                self.opened_at = time.monotonic()
+                return True
+
+            # Open, or half open with the trial request still out
+            self.rejected += 1
+            return False
+
+    def is_open(self):
+        with self._lock:
+            return self.state != CLOSED
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    print(f"Circuit opened after {self.failures} failures in a row")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+
+class CircuitBreakers:
+    """One CircuitBreaker per Spotify endpoint family (e.g. /playlists/{id}/tracks), so a failing search
+    doesn't stop playlists from loading. Share one instance between clients to share what they learn."""
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def for_url(self, url):
+        return self.for_endpoint(endpoint_name(url))
+
+    def for_endpoint(self, endpoint):
+        with self._lock:
+            if endpoint not in self._breakers:
+                self._breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self._breakers[endpoint]
+
+    def record(self, url, status):
+        """Record the outcome of a request. `status` is None if no response came back. Server errors and
+        429s (that are still 429s after backing off) count as failures; anything else means the endpoint is up."""
+
+        breaker = self.for_url(url)
+
+        if status is None or status == 429 or status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+    def is_open(self, endpoint):
+        """Is the endpoint family's circuit open (or half open)? e.g. is_open('/playlists/{id}')"""
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+        return breaker is not None and breaker.is_open()
+
+    def stats(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+
+        return {
+            'circuits_open': sum(breaker.is_open() for breaker in breakers),
+            'circuit_rejected_requests': sum(breaker.rejected for breaker in breakers),
+        }
@@ -0,0 +1,109 @@
+"""Single-flight request coalescing: concurrent callers asking for the same thing share one upstream call."""
+import asyncio
+import copy
+import threading
+from concurrent.futures import Future
+from functools import wraps
+
+
+class SingleFlight:
+    """Coalesce concurrent calls by key, for threaded callers.
+
+    The first caller for a key runs the function. Anyone else who asks for the same key while it's
+    in flight waits for that call and gets a shallow copy of its result (or the same exception), so a
+    caller that changes the list or dict it got back doesn't change anyone else's. Once the call
+    finishes, the key is forgotten, so results are never served stale.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, func):
+        with self._lock:
+            self.calls += 1
+            future = self._in_flight.get(key)
+
+            if future is not None:
+                self.coalesced += 1
+                is_leader = False
+            else:
+                future = self._in_flight[key] = Future()
+                is_leader = True
+
+        if not is_leader:
+            return shallow_copy(future.result())
+
+        try:
+            result = func()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def stats(self):
+        return {'calls': self.calls, 'coalesced': self.coalesced}
+
+
+class AsyncSingleFlight:
+    """Coalesce concurrent calls by key, for coroutines running on one event loop. Like SingleFlight,
+    callers who join a call in flight get a shallow copy of its result."""
+
+    def __init__(self):
+        self._in_flight = {}
+
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, coro_func):
+        self.calls += 1
+        task = self._in_flight.get(key)
+
+        if task is not None:
+            self.coalesced += 1
+            return shallow_copy(await asyncio.shield(task))
+
+        task = self._in_flight[key] = asyncio.ensure_future(coro_func())
+        task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        # shield() so one caller giving up doesn't cancel the call for everyone else
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {'calls': self.calls, 'coalesced': self.coalesced}
+
+
+def shallow_copy(result):
+    """Copy a shared result's outer list or dict (keeping a PlaylistTracks' metadata), and those in a tuple
+    like (payload, status). What they contain, like the Tracks, is still shared."""
+
+    if isinstance(result, tuple):
+        return tuple(copy.copy(item) for item in result)
+
+    return copy.copy(result)
+
+
+def coalesced(method):
+    """Decorate a client method so concurrent calls with the same arguments share one call (uses `self.single_flight`)."""
+
+    if asyncio.iscoroutinefunction(method):
+        @wraps(method)
+        async def async_wrapper(self, *args, **kwargs):
+            key = (method.__name__, args, tuple(sorted(kwargs.items())))
+            return await self.single_flight.do(key, lambda: method(self, *args, **kwargs))
+
+        return async_wrapper
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        return self.single_flight.do(key, lambda: method(self, *args, **kwargs))
+
+    return wrapper
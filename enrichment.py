@@ -0,0 +1,131 @@
+"""Plan and apply the audio-features / artist enrichment of a playlist's tracks."""
+from math import ceil
+
+from transport import API_BASE_URL
+
+AUDIO_FEATURES_BATCH_LIMIT = 100  # max ids per audio-features request
+ARTISTS_BATCH_LIMIT = 50          # max ids per artists request
+PAGE_SIZE = 50                    # tracks per playlist page, which is what enrichment used to be batched by
+
+
+class EnrichmentPlan:
+    """The upstream calls needed to enrich a list of tracks.
+
+    Track ids and artist ids are de-duplicated across the whole list and packed into the largest
+    batches the API allows. Once the batches have been fetched, `apply()` fans the results back
+    out to every track that shares the id.
+
+    Audio features and artists that are already stored (or were fetched for an earlier batch of the same
+    playlist) can be handed to `use_stored_audio_features()` and `use_cached_artists()` so only the rest are fetched. After `apply()`, `fetched_audio_features` and
+    `fetched_artists` hold the objects that came back from the API.
+    """
+
+    def __init__(self, tracks, api_base_url=API_BASE_URL):
+        self.tracks = tracks
+        self.api_base_url = api_base_url
+        self.stored_audio_features = {}
+        self.fetched_audio_features = {}
+        self.cached_artists = {}
+        self.fetched_artists = {}
+
+        # dict.fromkeys de-duplicates while keeping first-seen order
+        self.track_ids = list(dict.fromkeys(track.id for track in tracks if track.id))
+        self.artist_ids = list(dict.fromkeys(track.artist_id for track in tracks if track.artist_id))
+
+        self.audio_features_batches = chunk(self.track_ids, AUDIO_FEATURES_BATCH_LIMIT)
+        self.artists_batches = chunk(self.artist_ids, ARTISTS_BATCH_LIMIT)
+
+    def use_stored_audio_features(self, stored_audio_features):
+        """Drop the tracks with stored audio features (a dict of {track_id: features payload}) from the audio features batches."""
+
+        self.stored_audio_features.update((track_id, stored_audio_features[track_id]) for track_id in self.track_ids if track_id in stored_audio_features)
+        self.track_ids = [track_id for track_id in self.track_ids if track_id not in stored_audio_features]
+        self.audio_features_batches = chunk(self.track_ids, AUDIO_FEATURES_BATCH_LIMIT)
+
+    def use_cached_artists(self, cached_artists):
+        """Drop the cached artists (a dict of {artist_id: artist payload}) from the artists batches."""
+
+        self.cached_artists.update((artist_id, cached_artists[artist_id]) for artist_id in self.artist_ids if artist_id in cached_artists)
+        self.artist_ids = [artist_id for artist_id in self.artist_ids if artist_id not in cached_artists]
+        self.artists_batches = chunk(self.artist_ids, ARTISTS_BATCH_LIMIT)
+
+    def audio_features_requests(self):
+        return [(f'{self.api_base_url}/audio-features', {'ids': ','.join(ids)}) for ids in self.audio_features_batches]
+
+    def artists_requests(self):
+        return [(f'{self.api_base_url}/artists', {'ids': ','.join(ids)}) for ids in self.artists_batches]
+
+    def requests(self):
+        """Return (url, params) for every upstream call in the plan, audio features first."""
+        return self.audio_features_requests() + self.artists_requests()
+
+    def apply(self, payloads):
+        """Fan the payloads (in the same order as `requests()`) back out to the tracks."""
+
+        split = len(self.audio_features_batches)
+
+        self.apply_audio_features(payloads[:split])
+        self.apply_artists(payloads[split:])
+
+        return self.tracks
+
+    def apply_audio_features(self, payloads):
+        self.fetched_audio_features = index_by_id(payload.get('audio_features', []) for payload in payloads)
+        audio_features = self.known_audio_features()
+        return add_audio_features(self.tracks, [audio_features.get(track.id) for track in self.tracks])
+
+    def apply_artists(self, payloads):
+        self.fetched_artists = index_by_id(payload.get('artists', []) for payload in payloads)
+        artists = self.known_artists()
+        return add_artist_details(self.tracks, [artists.get(track.artist_id) for track in self.tracks])
+
+    def known_audio_features(self):
+        """All of the audio features the plan used, stored or fetched (after `apply()`)."""
+        return {**self.stored_audio_features, **self.fetched_audio_features}
+
+    def known_artists(self):
+        """All of the artists the plan used, cached or fetched (after `apply()`)."""
+        return {**self.cached_artists, **self.fetched_artists}
+
+    def calls_planned(self):
+        return len(self.audio_features_batches) + len(self.artists_batches)
+
+    def calls_without_plan(self):
+        """The calls the old page-by-page enrichment would have made: one of each per page of tracks."""
+        return 2 * ceil(len(self.tracks) / PAGE_SIZE)
+
+    def calls_saved(self):
+        return max(self.calls_without_plan() - self.calls_planned(), 0)
+
+
+def chunk(ids, size):
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
+
+def index_by_id(payload_lists):
+    """Flatten lists of Spotify objects into a dict keyed by id (skipping the nulls Spotify returns for unknown ids)."""
+    return {obj['id']: obj for objs in payload_lists for obj in objs if obj}
+
+def add_audio_features(tracks, track_audio_features):
+    """Add audio features to the Tracks. `track_audio_features` lines up index-for-index with `tracks`."""
+
+    for track, audio_features in zip(tracks, track_audio_features):
+        if audio_features:
+            track.danceability = audio_features.get("danceability") # float: 0.0 - 1.0
+            track.energy = audio_features.get("energy") # float: 0.0 - 1.0
+            track.acousticness = audio_features.get("acousticness") # float: 0.0 - 1.0
+            track.instrumentalness = audio_features.get("instrumentalness") # float: 0.0 - 1.0
+            track.positivity = audio_features.get("valence")  # float: 0.0 - 1.0
+            track.tempo = audio_features.get("tempo") # float: beats per minute
+
+    return tracks
+
+def add_artist_details(tracks, artists):
+    """Add artist metadata to the Tracks. `artists` lines up index-for-index with `tracks`."""
+
+    for track, artist in zip(tracks, artists):
+        if artist:
+            track.artist_followers = (artist.get("followers") or {}).get("total")
+            track.artist_popularity = artist.get("popularity")
+            track.artist_genres = artist.get("genres")
+
+    return tracks
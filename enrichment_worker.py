@@ -0,0 +1,135 @@
+"""Fetch and enrich big playlists queued by the web app (see EnrichmentJob), so a web worker isn't kept busy for the whole playlist.
+
+    python enrichment_worker.py          # keep working through the queue
+    python enrichment_worker.py --once   # work through the queue, then exit
+
+Jobs are claimed from the enrichment_jobs table, so several workers can share the queue. Pages of the playlist
+are fetched and enriched a chunk at a time, and each page is saved as soon as it's done. That's the checkpoint:
+a job that failed (or whose worker crashed) is claimed again and only fetches the pages it's missing.
+
+A job is for one version (snapshot) of the playlist. Its snapshot is checked before the pages are fetched and
+again once they all are. If the playlist changed, the job's pages are dropped and its new version is queued instead.
+"""
+import argparse
+import time
+from datetime import timedelta
+
+from app import app, spotify, enqueue_enrichment_job  # the web app's client, so the worker shares its caches, token and rate limit budget
+from models import db, EnrichmentJob
+from spotify_client import PLAYLIST_PAGE_LIMIT, clean_playlist_tracks
+
+POLL_INTERVAL = 2                          # seconds between looks at an empty queue
+JOB_STALL_TIMEOUT = timedelta(minutes=2)   # a running job not updated for this long has lost its worker
+MAX_ATTEMPTS = 3                           # tries per job before it's marked failed (it can still be retried from the page)
+PAGES_PER_CHUNK = 2                        # pages enriched (and saved) together: 100 tracks fill an audio features batch
+
+
+def playlist_changed(spotify, job):
+    """Return the playlist's current details if it changed since the job was queued, False if it didn't,
+    or None if they couldn't be fetched."""
+
+    playlist_info_payload = spotify.get_playlist_info(job.playlist_id)
+
+    if playlist_info_payload is None:
+        return None
+
+    return playlist_info_payload if playlist_info_payload.get('snapshot_id') != job.snapshot_id else False
+
+
+def supersede_job(job, playlist_info_payload):
+    """Drop the pages of a job whose playlist changed, and queue the playlist's new version instead."""
+
+    job.supersede()
+    new_job = enqueue_enrichment_job(job.playlist_id, playlist_info_payload)
+
+    print(f"Job {job.id}: playlist {job.playlist_id} changed, so its new version was queued as job {new_job.id}")
+
+
+def run_job(spotify, job):
+    """Fetch and enrich the pages the job is missing, saving each chunk of pages. Return True if the job is done."""
+
+    done_offsets = job.done_offsets()
+    offsets = [page * PLAYLIST_PAGE_LIMIT for page in range(job.pages_total) if page * PLAYLIST_PAGE_LIMIT not in done_offsets]
+
+    known_audio_features = {}
+    known_artists = {}
+
+    for start in range(0, len(offsets), PAGES_PER_CHUNK):
+        chunk_offsets = offsets[start:start + PAGES_PER_CHUNK]
+        pages = spotify.map_concurrently(lambda offset: spotify.get_playlist_tracks_page(job.playlist_id, offset), chunk_offsets)
+
+        if any(page is None for page in pages):
+            return False
+
+        pages_tracks = [clean_playlist_tracks(page) for page in pages]
+
+        if spotify.enrich_tracks([track for tracks in pages_tracks for track in tracks], known_audio_features, known_artists) is None:
+            return False
+
+        for offset, tracks in zip(chunk_offsets, pages_tracks):
+            job.save_page(offset, tracks)
+
+        print(f"Job {job.id}: {job.pages_done}/{job.pages_total} pages of playlist {job.playlist_id}")
+
+    return True
+
+
+def work(spotify, once=False):
+    """Claim and run jobs until the queue is empty (if `once`) or forever."""
+
+    while True:
+        job = EnrichmentJob.claim_next(JOB_STALL_TIMEOUT, MAX_ATTEMPTS)
+
+        if job is None:
+            if once:
+                return
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        print(f"Job {job.id}: enriching playlist {job.playlist_id} (attempt {job.attempts}, {job.pages_done}/{job.pages_total} pages already done)")
+
+        try:
+            changed = playlist_changed(spotify, job)
+            finished = changed is False and run_job(spotify, job)
+
+            if finished:
+                # The pages were fetched over a while: make sure they're all of the version the job is for
+                changed = playlist_changed(spotify, job)
+                finished = changed is False
+        except KeyboardInterrupt:
+            # Put it back in the queue straight away, without using up an attempt
+            db.session.rollback()
+            job.attempts -= 1
+            job.release("Interrupted", MAX_ATTEMPTS)
+            raise
+        except Exception as e:
+            db.session.rollback()
+            print(f"Job {job.id} crashed: {e}")
+            job.release(str(e), MAX_ATTEMPTS)
+            continue
+
+        if changed:
+            supersede_job(job, changed)
+        elif finished:
+            job.finish()
+            print(f"Job {job.id}: done")
+        else:
+            job.release("Wasn't able to fetch the playlist's tracks", MAX_ATTEMPTS)
+            print(f"Job {job.id}: a request failed, {job.status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--once', action='store_true', help='exit once the queue is empty')
+    args = parser.parse_args()
+
+    with app.app_context():
+        try:
+            work(spotify, args.once)
+        except KeyboardInterrupt:
+            db.session.rollback()
+            print("Interrupted. The job was put back in the queue, and picks up where it left off.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""Write enriched playlist tracks out as CSV, Arrow or Parquet files, a batch of tracks at a time.
+
+Each writer takes an iterable of track batches (lists of Tracks) and yields the file's bytes as each batch is
+written, so a response can send the file while it's being made without ever holding all of it.
+
+Arrow and Parquet need pyarrow (pip install pyarrow). CSV works without it.
+"""
+import csv
+import io
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # only the columnar formats need it
+    pyarrow = None
+
+from track import Track
+
+# Every Track field, in the order the table shows them
+EXPORT_COLUMNS = list(Track.__slots__)
+
+CSV_GENRE_SEPARATOR = '; '     # artist_genres is one CSV column
+PARQUET_ROW_GROUP_SIZE = 1000  # tracks per Parquet row group (batches are collected until there are this many)
+
+# pyarrow type names of the columns. Audio features are 0.0 - 1.0 (tempo is BPM), popularity is 0 - 100.
+ARROW_COLUMN_TYPES = {
+    'id': 'string',
+    'name': 'string',
+    'album': 'string',
+    'artist_id': 'string',
+    'artist_name': 'string',
+    'duration_ms': 'int32',
+    'popularity': 'int8',
+    'preview_url': 'string',
+    'danceability': 'float32',
+    'energy': 'float32',
+    'acousticness': 'float32',
+    'instrumentalness': 'float32',
+    'positivity': 'float32',
+    'tempo': 'float32',
+    'artist_popularity': 'int8',
+    'artist_followers': 'int64',
+    'artist_genres': 'list<string>',
+}
+
+
+class ChunkSink(io.RawIOBase):
+    """A write-only file that keeps what's written to it until `collect()` is called, so pyarrow's writers
+    can write to it while the bytes written so far are sent."""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def collect(self):
+        """Return the bytes written since the last call."""
+
+        data = b''.join(self.chunks)
+        self.chunks = []
+
+        return data
+
+
+def iter_csv(batches):
+    """Yield a CSV file of the tracks: the header row first, then the rows of each batch as it comes in."""
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(EXPORT_COLUMNS)
+
+    for tracks in batches:
+        writer.writerows(csv_row(track) for track in tracks)
+
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+    yield buffer.getvalue().encode()
+
+
+def csv_row(track):
+    row = [getattr(track, column) for column in EXPORT_COLUMNS]
+
+    genres = EXPORT_COLUMNS.index('artist_genres')
+    row[genres] = CSV_GENRE_SEPARATOR.join(row[genres]) if row[genres] is not None else None
+
+    return row
+
+
+def iter_arrow(batches):
+    """Yield an Arrow IPC stream of the tracks, with one record batch per batch of tracks."""
+
+    sink = ChunkSink()
+    schema = arrow_schema()
+
+    with pyarrow.ipc.new_stream(sink, schema) as writer:
+        for tracks in batches:
+            writer.write_batch(record_batch(tracks, schema))
+            yield sink.collect()
+
+    yield sink.collect()
+
+
+def iter_parquet(batches, row_group_size=PARQUET_ROW_GROUP_SIZE):
+    """Yield a Parquet file of the tracks, a row group at a time. The file's footer comes last."""
+
+    sink = ChunkSink()
+    schema = arrow_schema()
+    pending_tracks = []
+
+    with pyarrow.parquet.ParquetWriter(sink, schema) as writer:
+        for tracks in batches:
+            pending_tracks.extend(tracks)
+
+            if len(pending_tracks) >= row_group_size:
+                writer.write_batch(record_batch(pending_tracks, schema))
+                pending_tracks = []
+                yield sink.collect()
+
+        if pending_tracks:
+            writer.write_batch(record_batch(pending_tracks, schema))
+
+    yield sink.collect()
+
+
+def arrow_schema():
+    return pyarrow.schema([(column, arrow_type(ARROW_COLUMN_TYPES[column])) for column in EXPORT_COLUMNS])
+
+
+def arrow_type(type_name):
+    if type_name == 'list<string>':
+        return pyarrow.list_(pyarrow.string())
+    return pyarrow.type_for_alias(type_name)
+
+
+def record_batch(tracks, schema):
+    """Turn a batch of Tracks into an Arrow record batch, one typed column per field."""
+    return pyarrow.RecordBatch.from_pydict({column: [getattr(track, column) for track in tracks] for column in EXPORT_COLUMNS}, schema=schema)
+
+
+# format: (writer, mimetype, needs pyarrow)
+EXPORT_FORMATS = {
+    'csv': (iter_csv, 'text/csv', False),
+    'arrow': (iter_arrow, 'application/vnd.apache.arrow.stream', True),
+    'parquet': (iter_parquet, 'application/vnd.apache.parquet', True),
+}
@@ -0,0 +1,13 @@
+"""A local stand-in for the Spotify Web API, for running the app and tests without network access or credentials.
+
+    python -m fake_spotify.server --port 8765 --latency 0.05 --jitter 0.02
+
+then point the app at it:
+
+    SPOTIFY_API_BASE_URL=http://127.0.0.1:8765/v1 SPOTIFY_ACCOUNTS_BASE_URL=http://127.0.0.1:8765 flask run
+
+It replays fixtures captured from the real API with `python -m fake_spotify.record`, and makes up
+synthetic playlists (`synthetic-<number of tracks>`) and genre search results for everything else.
+"""
+from fake_spotify.catalog import Catalog
+from fake_spotify.server import create_app, serve_in_thread
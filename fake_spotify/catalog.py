@@ -0,0 +1,158 @@
+"""What the fake Spotify server serves: recorded fixtures, plus synthetic data for anything that wasn't recorded."""
+import json
+import os
+import re
+import zlib
+
+from fake_spotify.synthetic import SyntheticTransport
+
+DEFAULT_FIXTURES_PATH = os.path.join(os.path.dirname(__file__), 'fixtures.json')
+FIXTURE_SECTIONS = ['playlists', 'playlist_items', 'audio_features', 'artists', 'top_tracks', 'searches']
+
+SYNTHETIC_PLAYLIST_PATTERN = re.compile(r'synthetic-(\d+)$')
+SYNTHETIC_TRACK_PATTERN = re.compile(r'track\d{17}$')
+SYNTHETIC_ARTIST_PATTERN = re.compile(r'artist\d{18}$')
+SYNTHETIC_ARTIST_COUNT = 200
+SYNTHETIC_TOP_TRACKS = 10
+MAX_SYNTHETIC_PLAYLIST_SIZE = 20000
+
+
+class Catalog:
+    """The playlists, tracks, artists and search results the fake server knows about.
+
+    Fixtures are keyed the way the API is asked for them:
+    - playlists: {playlist id: the playlist object, without its tracks}
+    - playlist_items: {playlist id: every item of the playlist, in order}
+    - audio_features / artists: {track or artist id: the object}
+    - top_tracks: {artist id: the artist's top tracks}
+    - searches: {search query: the playlists found}
+
+    Playlists named `synthetic-<n>` have n made-up tracks (by made-up artists, with made-up audio features),
+    and genre searches that weren't recorded find a made-up Spotify and Every Noise playlist for the genre.
+    """
+
+    def __init__(self, fixtures=None):
+        fixtures = fixtures or {}
+
+        for section in FIXTURE_SECTIONS:
+            setattr(self, section, fixtures.get(section, {}))
+
+        self.synthetic = SyntheticTransport(artist_count=SYNTHETIC_ARTIST_COUNT)
+
+    @classmethod
+    def load(cls, path=DEFAULT_FIXTURES_PATH):
+        """Load fixtures recorded by fake_spotify.record. A missing file is an empty (all synthetic) catalog."""
+
+        if not os.path.exists(path):
+            return cls()
+
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def save(self, path=DEFAULT_FIXTURES_PATH):
+        with open(path, 'w') as f:
+            json.dump(self.fixtures(), f, indent=1, sort_keys=True)
+
+    def fixtures(self):
+        return {section: getattr(self, section) for section in FIXTURE_SECTIONS}
+
+    def get_playlist(self, playlist_id):
+        """Return the playlist object (with tracks.total but no items), or None if there's no such playlist."""
+
+        if playlist_id in self.playlists:
+            return self.playlists[playlist_id]
+
+        size = synthetic_playlist_size(playlist_id)
+
+        if size is None:
+            return None
+
+        return {
+            'id': playlist_id,
+            'name': f'Synthetic Playlist ({size} tracks)',
+            'href': f'/v1/playlists/{playlist_id}',
+            'images': [],
+            'owner': {'id': 'spotify-explorer'},
+            'snapshot_id': f'synthetic-snapshot-{size}',
+            'tracks': {'total': size},
+        }
+
+    def get_playlist_items(self, playlist_id, offset, limit):
+        """Return (the playlist's total number of items, the items from offset to offset + limit), or None."""
+
+        if playlist_id in self.playlist_items:
+            items = self.playlist_items[playlist_id]
+            return len(items), items[offset:offset + limit]
+
+        size = synthetic_playlist_size(playlist_id)
+
+        if size is None:
+            return None
+
+        return size, [{'track': self.synthetic.track(i)} for i in range(offset, min(offset + limit, size))]
+
+    def get_audio_features(self, track_id):
+        if track_id in self.audio_features:
+            return self.audio_features[track_id]
+
+        if SYNTHETIC_TRACK_PATTERN.match(track_id):
+            return self.synthetic.audio_features(track_id)
+
+        return None
+
+    def get_artist(self, artist_id):
+        if artist_id in self.artists:
+            return self.artists[artist_id]
+
+        if SYNTHETIC_ARTIST_PATTERN.match(artist_id):
+            return self.synthetic.artist(artist_id)
+
+        return None
+
+    def get_top_tracks(self, artist_id):
+        """Return the artist's top tracks, or None if there's no such artist."""
+
+        if artist_id in self.top_tracks:
+            return self.top_tracks[artist_id]
+
+        if SYNTHETIC_ARTIST_PATTERN.match(artist_id):
+            artist_number = int(artist_id[len('artist'):])
+            return [self.synthetic.track(artist_number + n * SYNTHETIC_ARTIST_COUNT) for n in range(SYNTHETIC_TOP_TRACKS)]
+
+        return None
+
+    def search_playlists(self, query):
+        """Return the playlists found by a search, like the genre search of SpotifyClient.search_genre_playlists."""
+
+        if query in self.searches:
+            return self.searches[query]
+
+        query = query.strip()
+        genre_title = query[len('the sound of '):] if query.lower().startswith('the sound of ') else query
+
+        # A playlist by someone else comes first, so the client has to pick out the official one
+        found = [search_result(f'{genre_title} bangers', 'some-listener', query + ' (fan)')]
+
+        if genre_title != query:
+            found.append(search_result(f'The Sound of {genre_title.title()}', 'thesoundsofspotify', query))
+        else:
+            found.append(search_result(genre_title.title(), 'spotify', query))
+
+        return found
+
+
+def synthetic_playlist_size(playlist_id):
+    match = SYNTHETIC_PLAYLIST_PATTERN.match(playlist_id)
+
+    if match is None:
+        return None
+
+    return min(int(match.group(1)), MAX_SYNTHETIC_PLAYLIST_SIZE)
+
+
+def search_result(name, owner_id, seed):
+    """A playlist search result pointing at a synthetic playlist, whose size is picked from the `seed` text."""
+
+    playlist_id = f'synthetic-{50 + zlib.crc32(seed.encode()) % 450}'
+
+    return {'id': playlist_id, 'name': name, 'owner': {'id': owner_id}, 'tracks': {'total': synthetic_playlist_size(playlist_id)}}
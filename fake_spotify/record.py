@@ -0,0 +1,128 @@
+"""Capture real Spotify API responses into fixtures the fake server can replay.
+
+    python -m fake_spotify.record --playlist 0qDBVeMndUkk7fwGfCuTR0 --artist 2CIMQHirSU0MQqyYHq0eOx --genre cowpunk
+
+Needs the real credentials in config.py. Recordings are merged into the fixtures file, so it can be run
+again to add more. Playlists are recorded along with the audio features and artists of their tracks.
+"""
+import argparse
+
+from enrichment import EnrichmentPlan
+from fake_spotify.catalog import Catalog, DEFAULT_FIXTURES_PATH
+from spotify_client import SpotifyClient, PLAYLIST_PAGE_LIMIT
+from track import Track
+
+
+class Recorder:
+    """Fetches raw payloads with a SpotifyClient (pointed at the real API) and files them in a Catalog."""
+
+    def __init__(self, spotify, catalog):
+        self.spotify = spotify
+        self.catalog = catalog
+
+    def record_playlist(self, playlist_id):
+        """Record the playlist, every one of its items, and its tracks' audio features and artists. Return the number of items."""
+
+        playlist = self.spotify.api_get(f'{self.spotify.api_base_url}/playlists/{playlist_id}', {'market': 'US'})
+
+        if playlist is None:
+            return None
+
+        items = []
+        url = f'{self.spotify.api_base_url}/playlists/{playlist_id}/tracks'
+        params = {'market': 'US', 'limit': PLAYLIST_PAGE_LIMIT, 'offset': 0}
+
+        while True:
+            page = self.spotify.api_get(url, params)
+
+            if page is None:
+                return None
+
+            items.extend(page['items'])
+
+            if not page.get('next'):
+                break
+
+            params['offset'] += PLAYLIST_PAGE_LIMIT
+
+        playlist.pop('tracks', None)
+        playlist['tracks'] = {'total': len(items)}
+
+        self.catalog.playlists[playlist_id] = playlist
+        self.catalog.playlist_items[playlist_id] = items
+
+        self.record_enrichment([Track.from_spotify(item['track']) for item in items if item.get('track')])
+
+        return len(items)
+
+    def record_enrichment(self, tracks):
+        """Record the audio features and artists the client asks for when it enriches the tracks."""
+
+        plan = EnrichmentPlan(tracks, self.spotify.api_base_url)
+
+        for url, params in plan.audio_features_requests():
+            payload = self.spotify.api_get(url, params)
+
+            for audio_features in (payload or {}).get('audio_features', []):
+                if audio_features:
+                    self.catalog.audio_features[audio_features['id']] = audio_features
+
+        for url, params in plan.artists_requests():
+            payload = self.spotify.api_get(url, params)
+
+            for artist in (payload or {}).get('artists', []):
+                if artist:
+                    self.catalog.artists[artist['id']] = artist
+
+    def record_artist(self, artist_id):
+        """Record the artist and their top tracks."""
+
+        artist = self.spotify.api_get(f'{self.spotify.api_base_url}/artists/{artist_id}')
+        top_tracks = self.spotify.api_get(f'{self.spotify.api_base_url}/artists/{artist_id}/top-tracks', {'market': 'US'})
+
+        if artist is not None:
+            self.catalog.artists[artist_id] = artist
+
+        if top_tracks is not None:
+            self.catalog.top_tracks[artist_id] = top_tracks['tracks']
+
+    def record_genre(self, genre_title):
+        """Record the searches the genre inspector makes for the genre's Spotify and Every Noise playlists."""
+
+        for query in [genre_title, f'the sound of {genre_title}']:
+            params = {'q': query, 'type': 'playlist', 'market': 'US', 'limit': '10'}
+            payload = self.spotify.api_get(f'{self.spotify.api_base_url}/search', params)
+
+            if payload is not None:
+                # Spotify sometimes returns null items for playlists that were removed
+                self.catalog.searches[query] = [item for item in payload['playlists']['items'] if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record Spotify API responses as fake_spotify fixtures.')
+    parser.add_argument('--playlist', action='append', default=[], help='playlist id to record (can be repeated)')
+    parser.add_argument('--artist', action='append', default=[], help='artist id to record (can be repeated)')
+    parser.add_argument('--genre', action='append', default=[], help='genre title whose playlist searches to record (can be repeated)')
+    parser.add_argument('--fixtures', default=DEFAULT_FIXTURES_PATH, help='fixtures file to add the recordings to')
+    args = parser.parse_args()
+
+    catalog = Catalog.load(args.fixtures)
+    recorder = Recorder(SpotifyClient(), catalog)
+
+    for playlist_id in args.playlist:
+        print(f"Playlist {playlist_id}: {recorder.record_playlist(playlist_id)} items")
+
+    for artist_id in args.artist:
+        recorder.record_artist(artist_id)
+        print(f"Artist {artist_id}")
+
+    for genre_title in args.genre:
+        recorder.record_genre(genre_title)
+        print(f"Genre {genre_title}")
+
+    catalog.save(args.fixtures)
+    print(f"Saved to {args.fixtures}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""A Flask app that answers like the parts of the Spotify Web API that SpotifyClient uses.
+
+    python -m fake_spotify.server --port 8765 --latency 0.05 --jitter 0.02 --rate-limit-every 100
+
+Besides serving the catalog, it can misbehave the way the real API does:
+- access tokens expire after `token_ttl` seconds (or all at once, on POST /_fake/expire-tokens), answering 401
+- every `rate_limit_every`th API request is answered with a 429 and a Retry-After header
+- every `error_every`th API request is answered with a 503 (with an HTML body instead of JSON if `html_errors`,
+  like a gateway's error page)
+- every response is delayed by `latency` seconds, give or take up to `jitter` seconds
+
+Requests' `fields` and `market` parameters are ignored: whole objects are always returned.
+"""
+import argparse
+import random
+import secrets
+import threading
+import time
+from urllib.parse import urlencode
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+from fake_spotify.catalog import Catalog
+
+DEFAULT_PORT = 8765
+DEFAULT_TOKEN_TTL = 3600     # seconds, the same as Spotify's
+DEFAULT_RETRY_AFTER = 1      # seconds, sent with every 429
+MAX_PAGE_LIMIT = 50          # largest `limit` the paged endpoints accept
+MAX_IDS = {'audio-features': 100, 'artists': 50}
+HTML_ERROR_PAGE = '<html><head><title>503 Service Temporarily Unavailable</title></head><body><h1>503 Service Temporarily Unavailable</h1></body></html>'
+
+
+class FakeSpotifyState:
+    """The fake server's tokens, request counts and random number generator, shared by its request threads."""
+
+    def __init__(self, latency, jitter, rate_limit_every, retry_after, token_ttl, seed, error_every=0, html_errors=False):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.token_ttl = token_ttl
+        self.error_every = error_every
+        self.html_errors = html_errors
+
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self.tokens = {}  # access token: expires at
+        self.stats = {'api_requests': 0, 'tokens_issued': 0, 'unauthorized': 0, 'rate_limited': 0, 'server_errors': 0}
+
+    def delay(self):
+        with self._lock:
+            seconds = self.latency + self._random.uniform(-self.jitter, self.jitter) if self.jitter else self.latency
+
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def issue_token(self):
+        token = secrets.token_urlsafe(24)
+
+        with self._lock:
+            self.tokens[token] = time.time() + self.token_ttl
+            self.stats['tokens_issued'] += 1
+
+        return token
+
+    def token_is_valid(self, token):
+        with self._lock:
+            return self.tokens.get(token, 0) > time.time()
+
+    def expire_tokens(self):
+        with self._lock:
+            for token in self.tokens:
+                self.tokens[token] = 0
+
+    def count(self, stat):
+        """Add one to the stat. Return the new count."""
+
+        with self._lock:
+            self.stats[stat] += 1
+            return self.stats[stat]
+
+
+def create_app(catalog=None, latency=0.0, jitter=0.0, rate_limit_every=0, retry_after=DEFAULT_RETRY_AFTER, token_ttl=DEFAULT_TOKEN_TTL, seed=None, error_every=0, html_errors=False):
+    """Create the fake Spotify app. Set `rate_limit_every` to 0 to never answer with a 429, and `error_every` to 0 to never answer with a 503."""
+
+    catalog = catalog if catalog is not None else Catalog.load()
+    state = FakeSpotifyState(latency, jitter, rate_limit_every, retry_after, token_ttl, seed, error_every, html_errors)
+
+    app = Flask(__name__)
+    app.config['FAKE_SPOTIFY'] = state
+
+    @app.before_request
+    def misbehave():
+        state.delay()
+
+        if not request.path.startswith('/v1/'):
+            return None
+
+        number = state.count('api_requests')
+
+        header = request.headers.get('Authorization', '')
+        token = header[len('Bearer '):] if header.startswith('Bearer ') else None
+
+        if not state.token_is_valid(token):
+            state.count('unauthorized')
+            return error(401, 'The access token expired' if token in state.tokens else 'Invalid access token')
+
+        if state.rate_limit_every and number % state.rate_limit_every == 0:
+            state.count('rate_limited')
+            response = error(429, 'API rate limit exceeded')
+            response.headers['Retry-After'] = str(state.retry_after)
+            return response
+
+        if state.error_every and number % state.error_every == 0:
+            state.count('server_errors')
+
+            if state.html_errors:
+                return HTML_ERROR_PAGE, 503, {'Content-Type': 'text/html'}
+
+            return error(503, 'Service unavailable')
+
+        return None
+
+    @app.route('/api/token', methods=['POST'])
+    def token():
+        if request.form.get('grant_type') != 'client_credentials':
+            return jsonify({'error': 'unsupported_grant_type'}), 400
+
+        return jsonify({'access_token': state.issue_token(), 'token_type': 'Bearer', 'expires_in': state.token_ttl})
+
+    @app.route('/v1/playlists/<playlist_id>')
+    def playlist(playlist_id):
+        found = catalog.get_playlist(playlist_id)
+
+        if found is None:
+            return error(404, 'Resource not found')
+
+        return jsonify(found)
+
+    @app.route('/v1/playlists/<playlist_id>/tracks')
+    def playlist_tracks(playlist_id):
+        offset, limit = page_params()
+
+        if limit is None:
+            return error(400, 'Invalid limit')
+
+        found = catalog.get_playlist_items(playlist_id, offset, limit)
+
+        if found is None:
+            return error(404, 'Resource not found')
+
+        total, items = found
+
+        return jsonify(page(items, total, offset, limit))
+
+    @app.route('/v1/audio-features')
+    def audio_features():
+        ids = ids_param('audio-features')
+
+        if ids is None:
+            return error(400, 'Too many ids requested')
+
+        return jsonify({'audio_features': [catalog.get_audio_features(track_id) for track_id in ids]})
+
+    @app.route('/v1/artists')
+    def artists():
+        ids = ids_param('artists')
+
+        if ids is None:
+            return error(400, 'Too many ids requested')
+
+        return jsonify({'artists': [catalog.get_artist(artist_id) for artist_id in ids]})
+
+    @app.route('/v1/artists/<artist_id>')
+    def artist(artist_id):
+        found = catalog.get_artist(artist_id)
+
+        if found is None:
+            return error(404, 'Resource not found')
+
+        return jsonify(found)
+
+    @app.route('/v1/artists/<artist_id>/top-tracks')
+    def artist_top_tracks(artist_id):
+        found = catalog.get_top_tracks(artist_id)
+
+        if found is None:
+            return error(404, 'Resource not found')
+
+        return jsonify({'tracks': found})
+
+    @app.route('/v1/search')
+    def search():
+        query = request.args.get('q')
+
+        if not query:
+            return error(400, 'No search query')
+
+        if request.args.get('type') != 'playlist':
+            return error(400, 'The fake only searches for playlists')
+
+        offset, limit = page_params(default_limit=20)
+
+        if limit is None:
+            return error(400, 'Invalid limit')
+
+        found = catalog.search_playlists(query)
+
+        return jsonify({'playlists': page(found[offset:offset + limit], len(found), offset, limit)})
+
+    @app.route('/_fake/expire-tokens', methods=['POST'])
+    def expire_tokens():
+        state.expire_tokens()
+        return jsonify({'expired': len(state.tokens)})
+
+    @app.route('/_fake/stats')
+    def stats():
+        return jsonify(state.stats)
+
+    return app
+
+
+def error(status, message):
+    response = jsonify({'error': {'status': status, 'message': message}})
+    response.status_code = status
+    return response
+
+
+def page_params(default_limit=MAX_PAGE_LIMIT):
+    """Return the request's (offset, limit). The limit is None if it's out of range."""
+
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', default_limit, type=int)
+
+    return max(offset, 0), limit if 1 <= limit <= MAX_PAGE_LIMIT else None
+
+
+def ids_param(endpoint):
+    """Return the request's comma separated ids, or None if there are more than the endpoint allows."""
+
+    ids = [id for id in request.args.get('ids', '').split(',') if id]
+
+    return ids if len(ids) <= MAX_IDS[endpoint] else None
+
+
+def page(items, total, offset, limit):
+    """A paging object like Spotify's, with absolute `next` and `previous` links."""
+
+    def link(new_offset):
+        return f"{request.base_url}?{urlencode({**request.args.to_dict(), 'offset': new_offset, 'limit': limit})}"
+
+    return {
+        'href': request.url,
+        'items': items,
+        'limit': limit,
+        'offset': offset,
+        'total': total,
+        'next': link(offset + limit) if offset + limit < total else None,
+        'previous': link(max(offset - limit, 0)) if offset > 0 else None,
+    }
+
+
+def serve_in_thread(app, host='127.0.0.1', port=0):
+    """Serve the app on a daemon thread. Return the server: its base URL is http://{host}:{server.port}.
+    Port 0 picks any free port. Call server.shutdown() to stop it."""
+
+    server = make_server(host, port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a fake Spotify Web API.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (0.0.0.0 to serve other machines too)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--fixtures', default=None, help='fixtures recorded by fake_spotify.record (default: fake_spotify/fixtures.json)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many seconds more or less than --latency')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='answer every Nth API request with a 429 (0 for never)')
+    parser.add_argument('--retry-after', type=int, default=DEFAULT_RETRY_AFTER, help='Retry-After seconds sent with each 429')
+    parser.add_argument('--error-every', type=int, default=0, help='answer every Nth API request with a 503 (0 for never)')
+    parser.add_argument('--html-errors', action='store_true', help="send the 503s' body as an HTML page, like a gateway does")
+    parser.add_argument('--token-ttl', type=int, default=DEFAULT_TOKEN_TTL, help='seconds before an access token expires')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the latency jitter')
+    args = parser.parse_args()
+
+    catalog = Catalog.load(args.fixtures) if args.fixtures else Catalog.load()
+    app = create_app(catalog, args.latency, args.jitter, args.rate_limit_every, args.retry_after, args.token_ttl, args.seed, args.error_every, args.html_errors)
+
+    print(f"Fake Spotify API on http://{args.host}:{args.port}/v1 (token endpoint http://{args.host}:{args.port}/api/token)")
+    make_server(args.host, args.port, app, threaded=True).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""An in-process stand-in for the Spotify API (no server, no network I/O), for tests and benchmarks. Serves a synthetic playlist of any size.
+
+The fake server (see catalog.py) makes up its synthetic playlists, tracks and artists with it too."""
+import json
+import re
+
+PLAYLIST_PATTERN = re.compile(r'/playlists/([^/]+)$')
+PLAYLIST_TRACKS_PATTERN = re.compile(r'/playlists/([^/]+)/tracks$')
+
+
+class SyntheticResponse:
+    def __init__(self, status_code, payload, headers=None):
+        self.status_code = status_code
+        self.payload = payload
+        self.headers = headers or {}
+
+    def json(self):
+        return self.payload
+
+    @property
+    def text(self):
+        return json.dumps(self.payload)
+
+
+class SyntheticTransport:
+    """Has the PooledTransport interface. Every playlist has `playlist_size` tracks, by `artist_count` different artists."""
+
+    def __init__(self, playlist_size=100, artist_count=200, snapshot_id='synthetic-snapshot'):
+        self.playlist_size = playlist_size
+        self.artist_count = artist_count
+        self.snapshot_id = snapshot_id  # change it to make the playlist look changed
+        self.requests_sent = 0
+
+    def request(self, method, url, headers=None, params=None, data=None):
+        self.requests_sent += 1
+        params = params or {}
+
+        if url.endswith('/api/token'):
+            return SyntheticResponse(200, {'access_token': 'synthetic-token', 'token_type': 'Bearer', 'expires_in': 3600})
+
+        match = PLAYLIST_PATTERN.search(url)
+
+        if match:
+            return SyntheticResponse(200, {'id': match.group(1), 'name': 'Synthetic Playlist', 'snapshot_id': self.snapshot_id, 'tracks': {'total': self.playlist_size}})
+
+        if PLAYLIST_TRACKS_PATTERN.search(url):
+            return SyntheticResponse(200, self.playlist_tracks_page(int(params.get('offset', 0)), int(params.get('limit', 50))))
+
+        if url.endswith('/audio-features'):
+            return SyntheticResponse(200, {'audio_features': [self.audio_features(track_id) for track_id in params['ids'].split(',')]})
+
+        if url.endswith('/artists'):
+            return SyntheticResponse(200, {'artists': [self.artist(artist_id) for artist_id in params['ids'].split(',')]})
+
+        return SyntheticResponse(404, {'error': {'status': 404, 'message': 'Not found'}})
+
+    def playlist_tracks_page(self, offset, limit):
+        end = min(offset + limit, self.playlist_size)
+
+        return {
+            'items': [{'track': self.track(i)} for i in range(offset, end)],
+            'offset': offset,
+            'total': self.playlist_size,
+            'next': 'next-page' if end < self.playlist_size else None,
+        }
+
+    def track(self, i):
+        artist_id = f'artist{i % self.artist_count:018d}'
+
+        return {
+            'id': f'track{i:017d}',
+            'name': f'Synthetic Track {i}',
+            'popularity': i % 100,
+            'duration_ms': 150000 + (i * 7919) % 120000,
+            'is_playable': True,
+            'preview_url': f'https://p.scdn.co/mp3-preview/{i:040x}',
+            'type': 'track',
+            'artists': [{'id': artist_id, 'name': f'Synthetic Artist {i % self.artist_count}'}],
+            'album': {'name': f'Synthetic Album {i // 12}', 'href': f'https://api.spotify.com/v1/albums/{i // 12:022d}'},
+        }
+
+    def audio_features(self, track_id):
+        seed = int(track_id[-6:])
+
+        return {
+            'id': track_id,
+            'danceability': (seed % 97) / 97,
+            'energy': (seed % 89) / 89,
+            'acousticness': (seed % 83) / 83,
+            'instrumentalness': (seed % 79) / 79,
+            'valence': (seed % 73) / 73,
+            'tempo': 80 + seed % 100,
+        }
+
+    def artist(self, artist_id):
+        return {
+            'id': artist_id,
+            'name': f'Synthetic Artist {int(artist_id[-6:])}',
+            'genres': ['synthpop', 'indietronica'],
+            'popularity': int(artist_id[-2:]),
+            'followers': {'total': int(artist_id[-6:]) * 1000},
+        }
+
+    def stats(self):
+        return {'requests_sent': self.requests_sent, 'connections_opened': 0, 'connections_reused': 0}
+
+    def close(self):
+        pass
@@ -0,0 +1,282 @@
+"""Counters and histograms for upstream Spotify calls and the Flask views, exposed in the Prometheus text format at /metrics."""
+import math
+import threading
+import time
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds. Spotify usually answers in 50-300ms, but slow pages of big playlists can take seconds.
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+SQL_QUERY_BUCKETS = [0, 1, 2, 5, 10, 25, 50, 100, 250]
+
+# Path segments that are followed by a Spotify id, which is replaced with {id} so each endpoint gets one label
+ID_RESOURCES = {'playlists', 'artists', 'albums', 'tracks', 'users'}
+
+
+class Metric:
+    """A metric with a value (or several) per combination of label values."""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def label_values(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {labels}")
+        return tuple(str(label) for label in labels)
+
+    def samples(self):
+        """Return [(name suffix, {label: value}, sample value)]."""
+        raise NotImplementedError
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        key = self.label_values(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(self.label_values(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [('', dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = list(buckets) + [math.inf]
+
+    def observe(self, value, *labels):
+        key = self.label_values(labels)
+
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+
+            self._values[key] = (counts, total + value)
+
+    def count(self, *labels):
+        counts, _ = self._values.get(self.label_values(labels), ([0], 0.0))
+        return sum(counts)
+
+    def total(self, *labels):
+        _, total = self._values.get(self.label_values(labels), ([0], 0.0))
+        return total
+
+    def samples(self):
+        samples = []
+
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0
+
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append(('_bucket', {**labels, 'le': format_value(bound)}, cumulative))
+
+                samples.append(('_sum', labels, total))
+                samples.append(('_count', labels, cumulative))
+
+        return samples
+
+
+class Registry:
+    """The metrics /metrics exposes: registered metrics, plus gauges read from `stats()` methods when scraped."""
+
+    def __init__(self):
+        self.metrics = []
+        self.stats_sources = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_stats(self, stats, prefix='', **labels):
+        """Expose each number in the dict returned by `stats()` (e.g. ArtistCache.stats) as a gauge named
+        spotify_explorer_{prefix}{key}, with the given labels."""
+        self.stats_sources.append((stats, prefix, labels))
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+
+        lines = []
+
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(sample_line(metric.name + suffix, labels, value) for suffix, labels, value in metric.samples())
+
+        gauges = {}
+
+        for stats, prefix, labels in self.stats_sources:
+            for key, value in stats().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauges.setdefault(f'spotify_explorer_{prefix}{key}', []).append((labels, value))
+
+        for name, samples in gauges.items():
+            lines.append(f'# TYPE {name} gauge')
+            lines.extend(sample_line(name, labels, value) for labels, value in samples)
+
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+UPSTREAM_LATENCY = REGISTRY.register(Histogram(
+    'spotify_upstream_request_seconds', 'Time taken by requests to the Spotify API, by endpoint.', ['endpoint']))
+UPSTREAM_RESPONSES = REGISTRY.register(Counter(
+    'spotify_upstream_responses_total', "Responses from the Spotify API, by endpoint and status code ('error' if the request failed).", ['endpoint', 'status']))
+UPSTREAM_BYTES = REGISTRY.register(Counter(
+    'spotify_upstream_received_bytes_total', 'Response body bytes received from the Spotify API, by endpoint.', ['endpoint']))
+UPSTREAM_RETRIES = REGISTRY.register(Counter(
+    'spotify_upstream_retries_total', "Requests to the Spotify API sent again, by endpoint and reason ('expired_token', 'rate_limited', 'server_error' or 'connection_error').", ['endpoint', 'reason']))
+UPSTREAM_HEDGES = REGISTRY.register(Counter(
+    'spotify_upstream_hedged_requests_total', "Slow requests to the Spotify API raced by a duplicate, by endpoint and whether the duplicate answered first ('won' or 'lost').", ['endpoint', 'outcome']))
+TOKEN_REFRESHES = REGISTRY.register(Counter(
+    'spotify_token_refreshes_total', 'Access tokens fetched from Spotify.'))
+
+ROUTE_LATENCY = REGISTRY.register(Histogram(
+    'flask_request_seconds', 'Time taken to handle requests, by route.', ['route', 'method']))
+ROUTE_RESPONSES = REGISTRY.register(Counter(
+    'flask_responses_total', 'Responses sent, by route and status code.', ['route', 'method', 'status']))
+ROUTE_SQL_QUERIES = REGISTRY.register(Histogram(
+    'flask_request_sql_queries', 'SQL queries run while handling a request, by route.', ['route'], buckets=SQL_QUERY_BUCKETS))
+
+
+def record_upstream_call(url, seconds, status, received_bytes=0):
+    """Record one request to the Spotify API. `status` is None if no response came back."""
+
+    endpoint = endpoint_name(url)
+
+    UPSTREAM_LATENCY.observe(seconds, endpoint)
+    UPSTREAM_RESPONSES.inc(endpoint, status if status is not None else 'error')
+
+    if received_bytes:
+        UPSTREAM_BYTES.inc(endpoint, amount=received_bytes)
+
+
+def record_retry(url, reason):
+    UPSTREAM_RETRIES.inc(endpoint_name(url), reason)
+
+
+def record_hedge(url, outcome):
+    UPSTREAM_HEDGES.inc(endpoint_name(url), outcome)
+
+
+def endpoint_name(url):
+    """Turn a Spotify API URL into its endpoint, with ids replaced: .../v1/playlists/37i9dQ/tracks -> /playlists/{id}/tracks"""
+
+    segments = [segment for segment in urlsplit(url).path.split('/') if segment]
+
+    if segments and segments[0] == 'v1':
+        segments = segments[1:]
+
+    named = ['{id}' if i > 0 and segments[i - 1] in ID_RESOURCES else segment for i, segment in enumerate(segments)]
+
+    return '/' + '/'.join(named)
+
+
+class QueryCounter:
+    """Counts the SQL queries run for one request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queries = 0
+
+    def add(self):
+        with self._lock:
+            self.queries += 1
+
+
+# The current request's QueryCounter. It's kept in a context variable rather than on `g`: a nested app context
+# (like the ones the caches push) gets a new `g`, but the same context variables. Context variables are also
+# copied to the coroutines the async client runs for the request, and on to the threads those hand work to
+# (asyncio.to_thread), so their queries are counted against the request too.
+REQUEST_SQL_QUERIES = ContextVar('request_sql_queries', default=None)
+SQL_QUERIES_TOKEN_KEY = 'metrics.sql_queries_token'  # in the request's environ, not `g`: requests made while another is active share its `g`
+
+
+def instrument_app(app):
+    """Time every request and count the SQL queries it runs. Call before registering the app's other
+    before_request hooks, so their queries are counted too."""
+
+    if not event.contains(Engine, 'before_cursor_execute', count_sql_query):  # once, however many apps are instrumented
+        event.listen(Engine, 'before_cursor_execute', count_sql_query)
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_started = time.perf_counter()
+        request.environ[SQL_QUERIES_TOKEN_KEY] = REQUEST_SQL_QUERIES.set(QueryCounter())
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'request_started' in g:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+            ROUTE_LATENCY.observe(time.perf_counter() - g.request_started, route, request.method)
+            ROUTE_RESPONSES.inc(route, request.method, response.status_code)
+            ROUTE_SQL_QUERIES.observe(REQUEST_SQL_QUERIES.get().queries, route)
+
+        return response
+
+    @app.teardown_request
+    def stop_counting_sql_queries(error=None):
+        token = request.environ.pop(SQL_QUERIES_TOKEN_KEY, None)
+
+        if token is not None:
+            REQUEST_SQL_QUERIES.reset(token)
+
+
+def count_sql_query(*args):
+    # Queries run outside of a request (e.g. by the caches' background refreshes) aren't counted against a route
+    counter = REQUEST_SQL_QUERIES.get()
+
+    if counter is not None:
+        counter.add()
+
+
+def sample_line(name, labels, value):
+    if labels:
+        label_text = ','.join(f'{label}="{escape(value)}"' for label, value in labels.items())
+        return f'{name}{{{label_text}}} {format_value(value)}'
+
+    return f'{name} {format_value(value)}'
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def escape(label_value):
+    return str(label_value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
@@ -0,0 +1,37 @@
+"""Update an existing genres table for resolved genre playlists (see Genre.playlist_id), keeping its rows.
+
+    python migrate_genre_playlists.py
+
+db.create_all() only creates missing tables, it doesn't change existing ones. This adds the columns saying when
+each playlist was last searched for (playlists already found count as found now), and drops the playlist ids'
+unique constraints (genres can share a playlist).
+It's safe to run more than once. A database made by seed.py after this change doesn't need it.
+"""
+from sqlalchemy import text
+
+from app import app
+from models import db
+
+MIGRATION = [
+    "ALTER TABLE genres ADD COLUMN IF NOT EXISTS spotify_playlist_checked_at TIMESTAMP WITHOUT TIME ZONE",
+    "ALTER TABLE genres ADD COLUMN IF NOT EXISTS en_playlist_checked_at TIMESTAMP WITHOUT TIME ZONE",
+    "ALTER TABLE genres DROP CONSTRAINT IF EXISTS genres_spotify_playlist_id_key",
+    "ALTER TABLE genres DROP CONSTRAINT IF EXISTS genres_en_playlist_id_key",
+    # Playlists found before this change count as found now, rather than being searched for again
+    "UPDATE genres SET spotify_playlist_checked_at = now() WHERE spotify_playlist_id IS NOT NULL AND spotify_playlist_checked_at IS NULL",
+    "UPDATE genres SET en_playlist_checked_at = now() WHERE en_playlist_id IS NOT NULL AND en_playlist_checked_at IS NULL",
+]
+
+
+def migrate():
+    for statement in MIGRATION:
+        db.session.execute(text(statement))
+
+    db.session.commit()
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        migrate()
+
+    print("Migrated the genres table")
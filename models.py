@@ -1,14 +1,27 @@
 """Models for the Spotify Explorer app"""
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import UniqueConstraint, Enum
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm.exc import NoResultFound
 from flask_bcrypt import Bcrypt
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from enums import FavoriteStatus
+from track import Track
 
 bcrypt = Bcrypt()
 
+# How long a genre's resolved playlist is trusted before it's searched for again.
+# "No playlist found" is re-checked sooner, since Spotify may have added one since.
+GENRE_PLAYLIST_MAX_AGE = timedelta(days=30)
+GENRE_PLAYLIST_NOT_FOUND_MAX_AGE = timedelta(days=7)
+
+# EnrichmentJob statuses
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
 # Set expire_on_commit to False to support unit tests
 db = SQLAlchemy(session_options={"expire_on_commit": False})
 
@@ -119,13 +132,14 @@ class Genre(db.Model):
                       nullable=False,
                       unique=True)
 
-    # Not used at this time. May one day become a FK to a playlists table.
-    spotify_playlist_id = db.Column(db.Text,
-                      unique=True)
+    # The genre's playlists, as found by searching Spotify (see `playlist_id()`). May one day become FKs to a playlists table.
+    # The id is None if no playlist was found, and `..._checked_at` is None if it was never searched for.
+    spotify_playlist_id = db.Column(db.Text)
+    spotify_playlist_checked_at = db.Column(db.DateTime)
 
-    # Not used as this time
-    en_playlist_id = db.Column(db.Text,
-                      unique=True)
+    # Every Noise's "The Sound of ..." playlist (owned by thesoundsofspotify)
+    en_playlist_id = db.Column(db.Text)
+    en_playlist_checked_at = db.Column(db.DateTime)
 
     # Data from everynoise's analysis of Spotify genres
     en_energy_score = db.Column(db.Integer)
@@ -151,6 +165,44 @@ class Genre(db.Model):
         return [ug.user for ug in self.user_genres if ug.favorite_status == FavoriteStatus.DISLIKE]
 
     
+    # The columns each playlist source's resolution is stored in
+    PLAYLIST_COLUMNS = {
+        'spotify': ('spotify_playlist_id', 'spotify_playlist_checked_at'),
+        'thesoundsofspotify': ('en_playlist_id', 'en_playlist_checked_at'),
+    }
+
+    def playlist_id(self, source):
+        """Return (True, playlist id) if the source's playlist was resolved recently enough to trust,
+        where the playlist id is None if no playlist was found. Return (False, None) if it needs to be searched for."""
+
+        id_column, checked_at_column = self.PLAYLIST_COLUMNS[source]
+        playlist_id = getattr(self, id_column)
+        checked_at = getattr(self, checked_at_column)
+
+        if checked_at is None:
+            return False, None
+
+        max_age = GENRE_PLAYLIST_MAX_AGE if playlist_id else GENRE_PLAYLIST_NOT_FOUND_MAX_AGE
+
+        if datetime.now() - checked_at > max_age:
+            return False, None
+
+        return True, playlist_id
+
+    def set_playlist_id(self, source, playlist_id):
+        """Record the source's resolved playlist id (None if no playlist was found). Commit the session to save it."""
+
+        id_column, checked_at_column = self.PLAYLIST_COLUMNS[source]
+        setattr(self, id_column, playlist_id)
+        setattr(self, checked_at_column, datetime.now())
+
+    def forget_playlist_id(self, source):
+        """Mark the source's playlist as unresolved, so it's searched for again. Commit the session to save it."""
+
+        id_column, checked_at_column = self.PLAYLIST_COLUMNS[source]
+        setattr(self, id_column, None)
+        setattr(self, checked_at_column, None)
+
     @classmethod
     def lookup_genre(cls, genre_title):
         """See if genre is in the genre table. If so, return it. Otherwise return None."""
@@ -241,4 +293,311 @@ class User_Genre(db.Model):
         self.last_viewed = datetime.now()
         db.session.commit()
 
-    
\ No newline at end of file
+
+class Artist(db.Model):
+    """Artist metadata from the Spotify API, cached so popular artists aren't refetched on every playlist view."""
+    __tablename__ = 'artists'
+
+    # Spotify's artist ID
+    id = db.Column(db.Text,
+                   primary_key=True)
+
+    name = db.Column(db.Text,
+                     nullable=False)
+
+    genres = db.Column(db.JSON,
+                       nullable=False,
+                       default=list)
+
+    popularity = db.Column(db.Integer)
+
+    followers = db.Column(db.Integer)
+
+    images = db.Column(db.JSON)
+
+    fetched_at = db.Column(db.DateTime,
+                           nullable=False,
+                           default=datetime.now)
+
+    def __repr__(self):
+        return f"<Artist id={self.id} name={self.name}>"
+
+    def to_payload(self):
+        """Return the artist in the same shape as the Spotify API's artist object."""
+
+        return {
+            'id': self.id,
+            'name': self.name,
+            'genres': self.genres,
+            'popularity': self.popularity,
+            'followers': {'total': self.followers},
+            'images': self.images or [],
+        }
+
+    @classmethod
+    def get_fresh(cls, artist_ids, ttl):
+        """Return a dict of {artist_id: Artist} for the artists that were fetched within `ttl` (a timedelta)."""
+
+        if not artist_ids:
+            return {}
+
+        cutoff = datetime.now() - ttl
+        artists = cls.query.filter(cls.id.in_(artist_ids), cls.fetched_at >= cutoff).all()
+
+        return {artist.id: artist for artist in artists}
+
+    @classmethod
+    def save_payloads(cls, artist_payloads):
+        """Insert or refresh artists from Spotify API artist objects, in a single statement."""
+
+        now = datetime.now()
+        rows = [{'id': artist['id'],
+                 'name': artist.get('name', ''),
+                 'genres': artist.get('genres') or [],
+                 'popularity': artist.get('popularity'),
+                 'followers': (artist.get('followers') or {}).get('total'),
+                 'images': artist.get('images'),
+                 'fetched_at': now}
+                for artist in artist_payloads]
+
+        if not rows:
+            return
+
+        stmt = insert(cls).values(rows)
+        stmt = stmt.on_conflict_do_update(index_elements=[cls.id],
+                                          set_={column: stmt.excluded[column] for column in ['name', 'genres', 'popularity', 'followers', 'images', 'fetched_at']})
+
+        db.session.execute(stmt)
+        db.session.commit()
+
+
+class TrackAudioFeatures(db.Model):
+    """Audio features for a track from the Spotify API. These never change for a track ID, so they are stored for good."""
+    __tablename__ = 'track_audio_features'
+
+    # Spotify's track ID
+    track_id = db.Column(db.Text,
+                         primary_key=True)
+
+    # floats: 0.0 - 1.0 (other than tempo, which is in BPM)
+    danceability = db.Column(db.Float)
+    energy = db.Column(db.Float)
+    acousticness = db.Column(db.Float)
+    instrumentalness = db.Column(db.Float)
+    valence = db.Column(db.Float)
+    tempo = db.Column(db.Float)
+
+    FEATURES = ['danceability', 'energy', 'acousticness', 'instrumentalness', 'valence', 'tempo']
+
+    def __repr__(self):
+        return f"<TrackAudioFeatures track_id={self.track_id}>"
+
+    def to_payload(self):
+        """Return the features in the same shape as the Spotify API's audio features object."""
+
+        payload = {feature: getattr(self, feature) for feature in self.FEATURES}
+        payload['id'] = self.track_id
+
+        return payload
+
+    @classmethod
+    def get_many(cls, track_ids):
+        """Return a dict of {track_id: TrackAudioFeatures} for the stored tracks among `track_ids`."""
+
+        if not track_ids:
+            return {}
+
+        return {features.track_id: features for features in cls.query.filter(cls.track_id.in_(track_ids)).all()}
+
+    @classmethod
+    def save_payloads(cls, audio_features_payloads):
+        """Store Spotify API audio features objects with a single multi-row insert. Tracks already stored are skipped."""
+
+        rows = [{'track_id': features['id'], **{feature: features.get(feature) for feature in cls.FEATURES}}
+                for features in audio_features_payloads]
+
+        if not rows:
+            return
+
+        db.session.execute(insert(cls).values(rows).on_conflict_do_nothing(index_elements=[cls.track_id]))
+        db.session.commit()
+
+
+class EnrichmentJob(db.Model):
+    """A big playlist being fetched and enriched by the background worker (see enrichment_worker.py), a few pages at a time.
+
+    Every finished page is saved as an EnrichmentJobPage, so a job whose worker crashed is picked up again where
+    it left off rather than starting over. The tracks are read back from the pages once the job is done.
+    """
+    __tablename__ = 'enrichment_jobs'
+
+    # One job per version of a playlist, however many requests for it come in at once
+    __table_args__ = (UniqueConstraint('playlist_id', 'snapshot_id'),)
+
+    id = db.Column(db.Integer,
+                   primary_key=True,
+                   autoincrement=True)
+
+    playlist_id = db.Column(db.Text,
+                            nullable=False)
+
+    snapshot_id = db.Column(db.Text,
+                            nullable=False)
+
+    status = db.Column(db.Text,
+                       nullable=False,
+                       default=JOB_QUEUED)
+
+    # The playlist's number of tracks, and the pages of them that will be fetched (at most max_tracks worth)
+    total = db.Column(db.Integer,
+                      nullable=False)
+
+    pages_total = db.Column(db.Integer,
+                            nullable=False)
+
+    pages_done = db.Column(db.Integer,
+                           nullable=False,
+                           default=0)
+
+    attempts = db.Column(db.Integer,
+                         nullable=False,
+                         default=0)
+
+    error = db.Column(db.Text)
+
+    created_at = db.Column(db.DateTime,
+                           nullable=False,
+                           default=datetime.now)
+
+    # Bumped as pages are saved, so a running job that stops being updated is known to have crashed
+    updated_at = db.Column(db.DateTime,
+                           nullable=False,
+                           default=datetime.now)
+
+    pages = db.relationship('EnrichmentJobPage', cascade='all, delete-orphan', order_by='EnrichmentJobPage.offset')
+
+    def __repr__(self):
+        return f"<EnrichmentJob id={self.id} playlist_id={self.playlist_id} status={self.status} pages={self.pages_done}/{self.pages_total}>"
+
+    @classmethod
+    def for_snapshot(cls, playlist_id, snapshot_id):
+        """Return the job for this version of the playlist, or None."""
+        return cls.query.filter_by(playlist_id=playlist_id, snapshot_id=snapshot_id).first()
+
+    @classmethod
+    def enqueue(cls, playlist_id, snapshot_id, total, pages_total):
+        """Queue a job for this version of the playlist, unless there already is one (e.g. queued by a concurrent
+        request for it). Return the version's job."""
+
+        row = {'playlist_id': playlist_id, 'snapshot_id': snapshot_id, 'total': total, 'pages_total': pages_total}
+        db.session.execute(insert(cls).values(row).on_conflict_do_nothing(index_elements=[cls.playlist_id, cls.snapshot_id]))
+        db.session.commit()
+
+        return cls.for_snapshot(playlist_id, snapshot_id)
+
+    @classmethod
+    def claim_next(cls, stall_timeout, max_attempts):
+        """Mark the oldest queued job (or a running job that hasn't been updated for `stall_timeout`, whose worker
+        must have crashed) as running, and return it. Crashed jobs out of attempts are marked failed instead.
+        Return None if there's nothing to do."""
+
+        stalled_before = datetime.now() - stall_timeout
+
+        while True:
+            job = (cls.query
+                   .filter((cls.status == JOB_QUEUED) | ((cls.status == JOB_RUNNING) & (cls.updated_at < stalled_before)))
+                   .order_by(cls.id)
+                   .with_for_update(skip_locked=True)
+                   .first())
+
+            if job is None:
+                db.session.commit()
+                return None
+
+            if job.status == JOB_RUNNING and job.attempts >= max_attempts:
+                job.status = JOB_FAILED
+                job.error = job.error or "The worker stopped responding"
+                db.session.commit()
+                continue
+
+            job.status = JOB_RUNNING
+            job.attempts += 1
+            job.updated_at = datetime.now()
+            db.session.commit()
+
+            return job
+
+    def done_offsets(self):
+        return {page.offset for page in self.pages}
+
+    def save_page(self, offset, tracks):
+        """Save a page of enriched tracks. This is the job's checkpoint."""
+
+        self.pages.append(EnrichmentJobPage(offset=offset, tracks=[track.to_dict() for track in tracks]))
+        self.pages_done = len(self.pages)
+        self.updated_at = datetime.now()
+        db.session.commit()
+
+    def finish(self):
+        self.status = JOB_DONE
+        self.error = None
+        self.updated_at = datetime.now()
+        db.session.commit()
+
+    def release(self, error, max_attempts):
+        """The job failed. Queue it to be tried again (from where it left off), unless it's out of attempts."""
+
+        self.status = JOB_QUEUED if self.attempts < max_attempts else JOB_FAILED
+        self.error = error
+        self.updated_at = datetime.now()
+        db.session.commit()
+
+    def supersede(self):
+        """The playlist changed since the job was queued, so its pages are of an older version. Fail the job and
+        drop its pages, so none of them are ever served as the playlist's current tracks."""
+
+        self.pages.clear()
+        self.pages_done = 0
+        self.status = JOB_FAILED
+        self.error = "The playlist changed while it was being enriched"
+        self.updated_at = datetime.now()
+        db.session.commit()
+
+    def retry(self):
+        """Queue a failed job again, keeping the pages it already finished."""
+
+        self.status = JOB_QUEUED
+        self.attempts = 0
+        self.updated_at = datetime.now()
+        db.session.commit()
+
+    def tracks(self):
+        """Return the job's enriched Tracks, in playlist order."""
+        return [Track(**track) for page in self.pages for track in page.tracks]
+
+    def progress(self):
+        return {
+            'job_id': self.id,
+            'playlist_id': self.playlist_id,
+            'status': self.status,
+            'pages_done': self.pages_done,
+            'pages_total': self.pages_total,
+            'total': self.total,
+            'attempts': self.attempts,
+            'error': self.error,
+        }
+
+
+class EnrichmentJobPage(db.Model):
+    """One page of a job's enriched tracks (as Track.to_dict() dicts), saved as soon as it's done."""
+    __tablename__ = 'enrichment_job_pages'
+
+    job_id = db.Column(db.Integer,
+                       db.ForeignKey('enrichment_jobs.id', ondelete='CASCADE'),
+                       primary_key=True)
+
+    offset = db.Column(db.Integer,
+                       primary_key=True)
+
+    tracks = db.Column(db.JSON,
+                       nullable=False)
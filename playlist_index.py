@@ -0,0 +1,85 @@
+"""An enriched playlist, indexed for the playlist table's server-side pagination, sorting and search."""
+import threading
+from itertools import islice
+
+from playlist_summary import summarize_tracks
+
+# Sorted when the playlist is indexed. The other sortable columns are sorted the first time they're asked for.
+PRECOMPUTED_SORT_FIELDS = ['tempo', 'energy', 'danceability', 'popularity']
+
+SORTABLE_FIELDS = {
+    'name', 'artist_name', 'album', 'duration_ms', 'tempo', 'popularity', 'artist_popularity', 'artist_followers',
+    'danceability', 'energy', 'positivity', 'acousticness', 'instrumentalness',
+}
+
+
+class IndexedPlaylist:
+    """A playlist's enriched Tracks, plus what it takes to serve any page of them quickly.
+
+    - For each sortable column, the track positions in sorted order (tracks without a value always go last).
+    - For each track, the lowercased text the table's search box matches against.
+    - The playlist's summary statistics (see playlist_summary.py), worked out the first time they're asked for.
+    """
+
+    def __init__(self, tracks):
+        self.tracks = tracks
+        self.search_text = [searchable_text(track) for track in tracks]
+
+        self._lock = threading.Lock()
+        self._sort_orders = {}
+        self._summary = None
+
+        for field in PRECOMPUTED_SORT_FIELDS:
+            self.sort_order(field)
+
+    def sort_order(self, field):
+        """Return (positions with a value in ascending order, positions without a value) for the field."""
+
+        with self._lock:
+            if field not in self._sort_orders:
+                values = [getattr(track, field) for track in self.tracks]
+                ranked = [i for i, value in enumerate(values) if value is not None]
+
+                if ranked and isinstance(values[ranked[0]], str):
+                    ranked.sort(key=lambda i: values[i].casefold())
+                else:
+                    ranked.sort(key=values.__getitem__)
+
+                missing = [i for i, value in enumerate(values) if value is None]
+                self._sort_orders[field] = (ranked, missing)
+
+            return self._sort_orders[field]
+
+    def summary(self):
+        """Return the playlist's summary: audio feature distributions, and genre and artist counts."""
+
+        with self._lock:
+            if self._summary is None:
+                self._summary = summarize_tracks(self.tracks)
+
+            return self._summary
+
+    def page(self, offset=0, limit=50, sort=None, order='asc', search=None):
+        """Return (number of matching tracks, the `limit` matching tracks starting at `offset`).
+        Unknown sort fields are ignored, leaving the tracks in playlist order."""
+
+        if sort in SORTABLE_FIELDS:
+            ranked, missing = self.sort_order(sort)
+            positions = (reversed(ranked) if order == 'desc' else ranked, missing)
+            positions = (i for part in positions for i in part)
+        else:
+            positions = range(len(self.tracks))
+
+        if search:
+            search = search.casefold()
+            positions = [i for i in positions if search in self.search_text[i]]
+            total = len(positions)
+        else:
+            total = len(self.tracks)
+
+        return total, [self.tracks[i] for i in islice(positions, offset, offset + limit)]
+
+
+def searchable_text(track):
+    """The text the table's search box matches a track against: its name, artist, album and genres."""
+    return ' '.join(filter(None, [track.name, track.artist_name, track.album, *(track.artist_genres or [])])).casefold()
@@ -0,0 +1,67 @@
+"""Summary statistics of a playlist's enriched tracks: how its audio features and popularity are distributed,
+and how often each genre and artist comes up. Computed with numpy, one array per feature."""
+import numpy as np
+
+# Features summarized, with the range their histograms cover (None for the range of the playlist's own values)
+SUMMARY_FEATURES = {
+    'energy': (0.0, 1.0),
+    'danceability': (0.0, 1.0),
+    'positivity': (0.0, 1.0),  # Spotify's "valence"
+    'tempo': None,
+    'popularity': (0, 100),
+}
+
+PERCENTILES = [10, 25, 75, 90]
+HISTOGRAM_BINS = 10
+TOP_COUNTS = 50  # genres and artists listed, most common first
+
+
+def summarize_tracks(tracks):
+    """Return the summary of a list of Tracks, ready to be sent as JSON."""
+
+    return {
+        'tracks': len(tracks),
+        'features': {feature: summarize_feature(feature_values(tracks, feature), value_range) for feature, value_range in SUMMARY_FEATURES.items()},
+        'genres': count_values([genre for track in tracks for genre in track.artist_genres or ()]),
+        'artists': count_values([track.artist_name for track in tracks if track.artist_name]),
+    }
+
+
+def feature_values(tracks, feature):
+    """The feature's values as a float array, with NaN for tracks without one (e.g. no audio features)."""
+    return np.array([np.nan if value is None else value for value in (getattr(track, feature) for track in tracks)], dtype=np.float64)
+
+
+def summarize_feature(values, value_range=None):
+    """Mean, median, percentiles and a histogram of the values, leaving out the missing (NaN) ones."""
+
+    values = values[~np.isnan(values)]
+
+    if not values.size:
+        return {'count': 0, 'mean': None, 'median': None, 'min': None, 'max': None, 'percentiles': {}, 'histogram': None}
+
+    percentiles = np.percentile(values, [50, *PERCENTILES])
+    counts, edges = np.histogram(values, bins=HISTOGRAM_BINS, range=value_range)
+
+    return {
+        'count': int(values.size),
+        'mean': float(values.mean()),
+        'median': float(percentiles[0]),
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'percentiles': {f'p{percentile}': float(value) for percentile, value in zip(PERCENTILES, percentiles[1:])},
+        'histogram': {'counts': counts.tolist(), 'edges': edges.tolist()},
+    }
+
+
+def count_values(values, top=TOP_COUNTS):
+    """Count each distinct value. Return the `top` most common as [{'name', 'count'}], most common first
+    (ties in alphabetical order)."""
+
+    if not values:
+        return []
+
+    names, counts = np.unique(np.array(values, dtype=str), return_counts=True)
+    order = np.argsort(-counts, kind='stable')[:top]
+
+    return [{'name': str(names[i]), 'count': int(counts[i])} for i in order]
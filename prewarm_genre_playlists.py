@@ -0,0 +1,100 @@
+"""Resolve the Spotify and Every Noise playlists of every genre ahead of time, so genre pages don't pay for the search on first view.
+
+    python prewarm_genre_playlists.py --rps 5 --workers 4
+
+Genres are searched for on a pool of worker threads. Their requests are taken from the web workers' shared rate
+limit bucket, so the two together stay within Spotify's quota, and at most --rps of them per second. Results are
+saved to the genres table (see Genre.set_playlist_id) after every batch of genres, which is also the checkpoint:
+after an interruption, run it again and it picks up with the genres that aren't resolved yet (or whose
+resolution is too old).
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app
+from models import db, Genre
+from rate_limiter import FileTokenBucket, RateLimitScheduler, SlicedTokenBucket
+from spotify_client import SpotifyClient
+
+DEFAULT_RPS = 5
+DEFAULT_WORKERS = 4
+DEFAULT_BATCH_SIZE = 50
+
+
+def sources_to_resolve(genre):
+    """The genre's playlist sources that have never been resolved, or were resolved too long ago."""
+    return [source for source in Genre.PLAYLIST_COLUMNS if not genre.playlist_id(source)[0]]
+
+
+def prewarm(spotify, workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE, limit=None):
+    """Resolve the playlists of every genre that needs it, committing after each batch. Return the run's stats."""
+
+    pending = [(genre, sources_to_resolve(genre)) for genre in Genre.query.order_by(Genre.id)]
+    pending = [(genre, sources) for genre, sources in pending if sources][:limit]
+
+    stats = {'genres': len(pending), 'resolved': 0, 'found': 0, 'not_found': 0, 'failed': 0}
+    started = time.monotonic()
+
+    print(f"{len(pending)} genres to resolve")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+
+            # Only the searches run on the pool. The database is only touched from this thread.
+            searches = [(genre.title, sources) for genre, sources in batch]
+            results = executor.map(lambda search: spotify.find_genre_playlists(*search), searches)
+
+            for (genre, sources), found in zip(batch, results):
+                for source, playlist_id in found.items():
+                    genre.set_playlist_id(source, playlist_id)
+                    stats['found' if playlist_id else 'not_found'] += 1
+
+                stats['failed'] += len(sources) - len(found)
+                stats['resolved'] += 1
+
+            db.session.commit()
+            print_progress(stats, spotify, time.monotonic() - started)
+
+    stats['seconds'] = time.monotonic() - started
+
+    return stats
+
+
+def print_progress(stats, spotify, seconds):
+    requests_sent = spotify.transport_stats()['requests_sent']
+    genres_per_second = stats['resolved'] / seconds if seconds else 0.0
+    remaining = (stats['genres'] - stats['resolved']) / genres_per_second if genres_per_second else 0.0
+
+    print(f"{stats['resolved']}/{stats['genres']} genres | {genres_per_second:.1f} genres/s | {requests_sent / seconds if seconds else 0:.1f} requests/s | "
+          f"found {stats['found']}, not found {stats['not_found']}, failed {stats['failed']} | "
+          f"rate limited {spotify.scheduler.rate_limited_responses}x | about {remaining / 60:.0f} min left")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rps', type=float, default=DEFAULT_RPS, help="most requests per second to take from the web workers' shared budget")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='genres searched for at a time')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='genres resolved between checkpoints')
+    parser.add_argument('--limit', type=int, default=None, help='stop after this many genres')
+    args = parser.parse_args()
+
+    # Spend from the web workers' shared bucket, so this job can't push the host over Spotify's quota, but only a slice of it
+    scheduler = RateLimitScheduler(SlicedTokenBucket(FileTokenBucket(), rate=args.rps, capacity=max(1, int(args.rps))))
+    spotify = SpotifyClient(max_workers=1, scheduler=scheduler)
+
+    with app.app_context():
+        try:
+            stats = prewarm(spotify, args.workers, args.batch_size, args.limit)
+        except KeyboardInterrupt:
+            db.session.rollback()
+            print("Interrupted. Run again to pick up where this left off.")
+            return
+
+    print(f"Done: {stats['resolved']} genres in {stats['seconds']:.0f}s "
+          f"({stats['found']} playlists found, {stats['not_found']} not found, {stats['failed']} searches failed)")
+
+
+if __name__ == '__main__':
+    main()
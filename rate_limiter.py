@@ -0,0 +1,221 @@
+"""Rate limiting for calls to the Spotify API, shared by all of the app's gunicorn workers."""
+import asyncio
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_RATE = 10           # requests per second, across all workers
+DEFAULT_CAPACITY = 20       # largest burst allowed after a quiet period
+DEFAULT_MAX_QUEUE_TIME = 60 # seconds a request may wait for its turn before giving up
+DEFAULT_RETRY_AFTER = 5     # seconds to back off if a 429 doesn't say how long to wait
+MAX_RATE_LIMIT_RETRIES = 3
+
+# /dev/shm is a RAM-backed filesystem on Linux, so the bucket file never touches the disk there
+DEFAULT_BUCKET_PATH = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'spotify-explorer-rate-limit.json')
+
+
+class TokenBucket:
+    """A token bucket that refills at `rate` tokens per second, up to `capacity` tokens.
+
+    The bucket can also be paused (when Spotify sends a 429 with Retry-After), in which case nobody
+    gets a token until the pause is over. Subclasses decide where the bucket's state is kept.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, capacity=DEFAULT_CAPACITY):
+        self.rate = rate
+        self.capacity = capacity
+
+    def try_acquire(self):
+        """Take a token if one is available. Return 0 if we got one, otherwise the seconds to wait before trying again."""
+
+        with self.locked_state() as state:
+            now = time.time()
+
+            if state['paused_until'] > now:
+                return state['paused_until'] - now
+
+            tokens = min(self.capacity, state['tokens'] + (now - state['updated_at']) * self.rate)
+            state['updated_at'] = now
+
+            if tokens >= 1:
+                state['tokens'] = tokens - 1
+                return 0
+
+            state['tokens'] = tokens
+            return (1 - tokens) / self.rate
+
+    def pause(self, seconds):
+        """Stop handing out tokens for `seconds` (and drain the bucket so we don't burst when the pause ends)."""
+
+        with self.locked_state() as state:
+            now = time.time()
+            state['paused_until'] = max(state['paused_until'], now + seconds)
+            state['tokens'] = 0
+            state['updated_at'] = now
+
+    def initial_state(self):
+        return {'tokens': self.capacity, 'updated_at': time.time(), 'paused_until': 0}
+
+    @contextmanager
+    def locked_state(self):
+        raise NotImplementedError
+
+
+class MemoryTokenBucket(TokenBucket):
+    """A token bucket shared by the threads of a single process."""
+
+    def __init__(self, rate=DEFAULT_RATE, capacity=DEFAULT_CAPACITY):
+        super().__init__(rate, capacity)
+        self._lock = threading.Lock()
+        self._state = self.initial_state()
+
+    @contextmanager
+    def locked_state(self):
+        with self._lock:
+            yield self._state
+
+
+class FileTokenBucket(TokenBucket):
+    """A token bucket shared by every process on the host, kept in a small file guarded by an exclusive flock."""
+
+    def __init__(self, rate=DEFAULT_RATE, capacity=DEFAULT_CAPACITY, path=DEFAULT_BUCKET_PATH):
+        super().__init__(rate, capacity)
+        self.path = path
+        self._lock = threading.Lock()  # flock is per process, so threads in this process also need to take turns
+
+    @contextmanager
+    def locked_state(self):
+        with self._lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+
+                with os.fdopen(os.dup(fd), 'r+') as f:
+                    try:
+                        state = json.loads(f.read() or 'null') or self.initial_state()
+                    except ValueError:
+                        state = self.initial_state()
+
+                    yield state
+
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+
+class SlicedTokenBucket:
+    """Takes its tokens from a shared bucket, but at most `rate` per second of them: a fixed slice of the shared
+    budget, for a batch job (e.g. prewarm_genre_playlists.py) running alongside the web workers.
+
+    A token from the slice is used up even when the shared bucket then says to wait, so when the web workers are
+    busy the job gets less than its slice, never more."""
+
+    def __init__(self, shared, rate=DEFAULT_RATE, capacity=DEFAULT_CAPACITY):
+        self.shared = shared
+        self.slice = MemoryTokenBucket(rate, capacity)
+
+    def try_acquire(self):
+        return self.slice.try_acquire() or self.shared.try_acquire()
+
+    def pause(self, seconds):
+        # A 429 is for everyone using the shared budget
+        self.shared.pause(seconds)
+
+
+class RateLimitScheduler:
+    """Queues upstream requests so we stay within the token bucket's budget, and backs off when Spotify says so.
+
+    Requests wait their turn (up to `max_queue_time` seconds) rather than failing. When Spotify responds
+    with a 429, the whole bucket is paused for the Retry-After period, so every worker backs off together.
+    """
+
+    def __init__(self, bucket=None, max_queue_time=DEFAULT_MAX_QUEUE_TIME, max_retries=MAX_RATE_LIMIT_RETRIES):
+        self.bucket = bucket or FileTokenBucket()
+        self.max_queue_time = max_queue_time
+        self.max_retries = max_retries
+
+        self._lock = threading.Lock()
+        self.requests_queued = 0
+        self.seconds_queued = 0.0
+        self.rate_limited_responses = 0
+        self.requests_dropped = 0
+
+    def wait_for_slot(self):
+        """Block until it's this request's turn. Return False if it waited longer than `max_queue_time`."""
+
+        deadline = time.monotonic() + self.max_queue_time
+        waited = 0.0
+
+        while True:
+            wait = self.bucket.try_acquire()
+
+            if wait == 0:
+                self.record_wait(waited)
+                return True
+
+            if time.monotonic() + wait > deadline:
+                self.record_wait(waited, dropped=True)
+                return False
+
+            time.sleep(wait)
+            waited += wait
+
+    async def wait_for_slot_async(self):
+        """The same as `wait_for_slot`, but without blocking the event loop: the bucket (which may take an flock
+        and read and write its file) is checked in a thread, and waits are asyncio sleeps."""
+
+        deadline = time.monotonic() + self.max_queue_time
+        waited = 0.0
+
+        while True:
+            wait = await asyncio.to_thread(self.bucket.try_acquire)
+
+            if wait == 0:
+                self.record_wait(waited)
+                return True
+
+            if time.monotonic() + wait > deadline:
+                self.record_wait(waited, dropped=True)
+                return False
+
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def rate_limited(self, headers):
+        """Handle a 429 response: pause the shared bucket for the Retry-After period."""
+
+        try:
+            retry_after = float(headers.get('Retry-After', DEFAULT_RETRY_AFTER))
+        except ValueError:
+            retry_after = DEFAULT_RETRY_AFTER
+
+        print(f"Rate limited by Spotify. Backing off for {retry_after} seconds.")
+
+        with self._lock:
+            self.rate_limited_responses += 1
+
+        self.bucket.pause(retry_after)
+
+    def record_wait(self, waited, dropped=False):
+        with self._lock:
+            if waited:
+                self.requests_queued += 1
+                self.seconds_queued += waited
+            if dropped:
+                self.requests_dropped += 1
+
+    def stats(self):
+        return {
+            'requests_queued': self.requests_queued,
+            'seconds_queued': self.seconds_queued,
+            'rate_limited_responses': self.rate_limited_responses,
+            'requests_dropped': self.requests_dropped,
+        }
@@ -0,0 +1,124 @@
+"""Retry policies for requests to the Spotify API: which failures are worth trying again, how long to back off
+between tries, and when to hedge a slow request with a duplicate."""
+import asyncio
+import random
+import threading
+from collections import deque
+
+import aiohttp
+import requests
+
+from metrics import endpoint_name, record_retry, record_hedge
+
+DEFAULT_MAX_ATTEMPTS = 3                              # tries per request, including the first
+DEFAULT_RETRY_STATUSES = frozenset({500, 502, 503, 504})
+DEFAULT_RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout, aiohttp.ClientConnectionError, asyncio.TimeoutError)
+DEFAULT_BACKOFF_BASE = 0.2                            # seconds: the first retry waits up to this long, doubling each time
+DEFAULT_BACKOFF_MAX = 5                               # seconds: the longest wait between tries
+
+LATENCY_WINDOW = 200      # recent response times kept per endpoint, to work out when a request is slow
+HEDGE_MIN_SAMPLES = 20    # responses seen from an endpoint before its requests are hedged
+
+
+class RetryPolicy:
+    """How to retry one endpoint's requests.
+
+    A request that fails with one of `retry_statuses`, or raises one of `retry_exceptions` (timeouts and dropped
+    connections), is sent again, up to `max_attempts` tries in all. Before each retry it waits a random time
+    between 0 and `backoff_base` * 2^retry seconds (capped at `backoff_max`), so clients that failed together
+    don't all retry together.
+
+    With `hedge_percentile` (e.g. 95), a request that's taking longer than that percentile of the endpoint's recent
+    response times gets a duplicate sent alongside it, and whichever answers first is used. Only use it for
+    requests that are safe to send twice (all of the client's GETs are).
+
+    429s aren't covered here: the rate limit scheduler backs off for the Retry-After period (see rate_limiter.py).
+    """
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, retry_statuses=DEFAULT_RETRY_STATUSES, retry_exceptions=DEFAULT_RETRY_EXCEPTIONS,
+                 backoff_base=DEFAULT_BACKOFF_BASE, backoff_max=DEFAULT_BACKOFF_MAX, hedge_percentile=None, rng=None):
+        self.max_attempts = max_attempts
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_exceptions = tuple(retry_exceptions)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.rng = rng or random.Random()
+
+    def __repr__(self):
+        return f"<RetryPolicy max_attempts={self.max_attempts} retry_statuses={sorted(self.retry_statuses)} hedge_percentile={self.hedge_percentile}>"
+
+    def should_retry_status(self, status, attempt):
+        """Should a response with this status be retried, after `attempt` tries (counting from 1)?"""
+        return status in self.retry_statuses and attempt < self.max_attempts
+
+    def should_retry_exception(self, exception, attempt):
+        return isinstance(exception, self.retry_exceptions) and attempt < self.max_attempts
+
+    def backoff(self, attempt):
+        """Seconds to wait before the next try, after `attempt` tries (counting from 1)."""
+        return self.rng.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+
+class RetryPolicies:
+    """The RetryPolicy for each endpoint family (e.g. {'/search': RetryPolicy(max_attempts=2)}), falling back to
+    `default`. Also keeps each endpoint's recent response times, to know when a request is slow enough to hedge,
+    and counts retries and hedges. Share one instance between clients to share what they learn."""
+
+    def __init__(self, default=None, endpoints=None):
+        self.default = default or RetryPolicy()
+        self.endpoints = dict(endpoints or {})
+
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self.retries = 0
+        self.hedged_requests = 0
+        self.hedges_won = 0
+
+    def for_url(self, url):
+        return self.endpoints.get(endpoint_name(url), self.default)
+
+    def record_latency(self, url, seconds):
+        endpoint = endpoint_name(url)
+
+        with self._lock:
+            if endpoint not in self._latencies:
+                self._latencies[endpoint] = deque(maxlen=LATENCY_WINDOW)
+            self._latencies[endpoint].append(seconds)
+
+    def hedge_delay(self, url):
+        """Seconds to wait for a response before hedging the request, or None if it shouldn't be hedged
+        (the endpoint's policy doesn't hedge, or not enough of its responses have been seen yet)."""
+
+        policy = self.for_url(url)
+
+        if policy.hedge_percentile is None:
+            return None
+
+        with self._lock:
+            latencies = sorted(self._latencies.get(endpoint_name(url), ()))
+
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+
+        return latencies[min(len(latencies) - 1, int(len(latencies) * policy.hedge_percentile / 100))]
+
+    def record_retry(self, url, reason):
+        with self._lock:
+            self.retries += 1
+        record_retry(url, reason)
+
+    def record_hedge(self, url, won):
+        """Record a hedged request, and whether the duplicate answered before the original."""
+
+        with self._lock:
+            self.hedged_requests += 1
+            self.hedges_won += bool(won)
+        record_hedge(url, 'won' if won else 'lost')
+
+    def stats(self):
+        return {
+            'retries': self.retries,
+            'hedged_requests': self.hedged_requests,
+            'hedges_won': self.hedges_won,
+        }
@@ -63,6 +63,147 @@ $("#playlist-table").bootstrapTable({
     },
 });
 
+/* Stream playlist tracks into the table (newline-delimited JSON), appending rows as each batch arrives */
+
+function streamPlaylistTracks($table) {
+    const streamUrl = $table.data("stream-url");
+
+    if (!streamUrl) {
+        return;
+    }
+
+    $table.bootstrapTable("showLoading");
+
+    fetch(streamUrl)
+        .then(async function (response) {
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = "";
+
+            while (true) {
+                const { value, done } = await reader.read();
+
+                if (done) {
+                    break;
+                }
+
+                buffer += decoder.decode(value, { stream: true });
+
+                // Keep any partial line in the buffer until the rest of it arrives
+                const lines = buffer.split("\n");
+                buffer = lines.pop();
+
+                const rows = [];
+                for (const line of lines) {
+                    if (!line) {
+                        continue;
+                    }
+
+                    const row = JSON.parse(line);
+
+                    if (row.error) {
+                        console.error("Error:", row.error);
+                    } else {
+                        rows.push(row);
+                    }
+                }
+
+                if (rows.length) {
+                    $table.bootstrapTable("hideLoading");
+                    $table.bootstrapTable("append", rows);
+                }
+            }
+
+            $table.bootstrapTable("hideLoading");
+            loadGenreCounts();
+        })
+        .catch(function (error) {
+            $table.bootstrapTable("hideLoading");
+            console.error("Error:", error);
+        });
+}
+
+$(document).ready(function () {
+    streamPlaylistTracks($("#playlist-table"));
+});
+
+/* Big playlists are enriched by a background job: show its progress, then load the table once it's done */
+
+const JOB_POLL_INTERVAL_MS = 2000;
+
+function followEnrichmentJob($table) {
+    let jobUrl = $table.data("job-url");
+
+    if (!jobUrl) {
+        return;
+    }
+
+    $table.bootstrapTable("showLoading");
+
+    function showProgress(job) {
+        if (job.status === "failed") {
+            $table.bootstrapTable("hideLoading");
+            $("#job-progress").text(`Wasn't able to enrich the tracks (${job.pages_done} of ${job.pages_total} pages done)`);
+            $("#job-retry").show();
+        } else {
+            $("#job-progress").text(`Enriching tracks: ${job.pages_done} of ${job.pages_total} pages`);
+        }
+    }
+
+    function loadTable() {
+        $("#job-progress").remove();
+        $("#job-retry").remove();
+        // The first page's request caches the job's tracks, which is what the summary is worked out from
+        $table.one("load-success.bs.table", loadGenreCounts);
+        $table.bootstrapTable("refreshOptions", { url: $table.data("page-url") });
+    }
+
+    function poll() {
+        $.getJSON(jobUrl)
+            .done(function (job) {
+                showProgress(job);
+
+                if (job.status === "done") {
+                    loadTable();
+                } else if (job.status !== "failed") {
+                    setTimeout(poll, JOB_POLL_INTERVAL_MS);
+                }
+            })
+            .fail(function (error) {
+                console.error("Error:", error);
+                setTimeout(poll, JOB_POLL_INTERVAL_MS);
+            });
+    }
+
+    // Queue the failed job again: it picks up from the last page it saved. If the playlist changed since,
+    // that's a different job (for its new version), so poll the one the response points at
+    $("#job-retry").click(function () {
+        $("#job-retry").hide();
+        $table.bootstrapTable("showLoading");
+
+        $.post($table.data("retry-url"))
+            .done(function (job, textStatus, xhr) {
+                if (xhr.status === 204) {
+                    loadTable();
+                } else {
+                    jobUrl = job.status_url;
+                    showProgress(job);
+                    setTimeout(poll, JOB_POLL_INTERVAL_MS);
+                }
+            })
+            .fail(function (error) {
+                console.error("Error:", error);
+                $("#job-retry").show();
+            });
+    });
+
+    poll();
+}
+
+$(document).ready(function () {
+    followEnrichmentJob($("#playlist-table"));
+});
+
 function trackPreviewFormatter(value, row) {
     // value is the track audio preview url
     if (value) {
@@ -88,6 +229,26 @@ function artistNameFormatter(value, row) {
     }
 }
 
+function durationFormatter(value, row) {
+    // value is the track duration in milliseconds, shown as minutes & seconds (e.g. 3:05)
+    const seconds = Math.floor(value / 1000);
+    return `${Math.floor(seconds / 60)}:${String(seconds % 60).padStart(2, "0")}`;
+}
+
+function tempoFormatter(value, row) {
+    // value is the tempo in beats per minute
+    return value == null ? "" : Math.round(value);
+}
+
+function percentFormatter(value, row) {
+    // value is an audio feature between 0.0 and 1.0
+    return value == null ? "" : `${(value * 100).toFixed(1)}%`;
+}
+
+function followersFormatter(value, row) {
+    return value == null ? "" : value.toLocaleString("en-US");
+}
+
 let playlist_source = $("h1").data("source");
 
 function artistGenresFormatter(value, row) {
@@ -107,6 +268,27 @@ function artistGenresFormatter(value, row) {
     }
 }
 
+/* Genre count table: the genres from the playlist summary. It's only loaded once the tracks table has its tracks:
+   the summary is worked out from the tracks cached by that request, and is a 404 until they are. */
+
+function loadGenreCounts() {
+    const $genreTable = $("#genre-count-table");
+    $genreTable.bootstrapTable("refreshOptions", { url: $genreTable.data("summary-url") });
+}
+
+function genreCountsResponseHandler(res) {
+    return res.genres || [];
+}
+
+$(document).ready(function () {
+    const $table = $("#playlist-table");
+
+    // Server-side tables load a page at a time (streamed and background-job tables call loadGenreCounts themselves)
+    if ($table.data("url")) {
+        $table.one("load-success.bs.table", loadGenreCounts);
+    }
+});
+
 function loadingTemplate(message) {
     return `<div class="mt-5 mb-5"></div>
             <div class="mt-5 mb-5"><i class="fa fa-spinner fa-spin fa-fw fa-2x"></i></div>
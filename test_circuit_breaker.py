@@ -0,0 +1,241 @@
+from unittest import TestCase
+import os
+import tempfile
+import time
+
+from datetime import timedelta
+import threading
+
+import requests
+
+from fake_spotify.synthetic import SyntheticResponse, SyntheticTransport
+import app as app_module
+from app import app
+from async_spotify_client import AsyncSpotifyClient
+from caches import StaleWhileRevalidateCache
+from circuit_breaker import CircuitBreaker, CircuitBreakers
+from fake_spotify import Catalog, create_app, serve_in_thread
+from playlist_index import IndexedPlaylist
+from spotify_client import PlaylistTracks
+from track import Track
+from retry_policy import RetryPolicies, RetryPolicy
+from spotify_client import SpotifyClient
+from token_manager import TokenManager
+
+
+class FailingTransport:
+    """Stands in for the PooledTransport. Hands out tokens, but every API request times out."""
+
+    def __init__(self):
+        self.api_requests = 0
+
+    def request(self, method, url, headers=None, params=None, data=None):
+        if url.endswith('/api/token'):
+            return TokenResponse()
+
+        self.api_requests += 1
+        raise requests.Timeout('read timed out')
+
+
+class MissingPlaylistTransport(SyntheticTransport):
+    """Has no playlists: asking for one is answered with a 404."""
+
+    def request(self, method, url, headers=None, params=None, data=None):
+        if '/playlists/' in url:
+            return SyntheticResponse(404, {'error': {'status': 404, 'message': 'Resource not found'}})
+
+        return super().request(method, url, headers, params, data)
+
+
+class TokenResponse:
+    status_code = 200
+    content = b''
+
+    def json(self):
+        return {'access_token': 'token', 'token_type': 'Bearer', 'expires_in': 3600}
+
+
+class CircuitBreakerTests(TestCase):
+    """Tests for the circuit breakers around Spotify endpoints."""
+
+    def test_opens_after_failures(self):
+        """Does the circuit open after the failure threshold, and let one trial request through after the reset timeout?"""
+
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.05)
+
+        for _ in range(3):
+            self.assertTrue(breaker.allow())
+            breaker.record_failure()
+
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.06)
+
+        self.assertTrue(breaker.allow())   # the trial request
+        self.assertFalse(breaker.allow())  # everyone else waits for it
+
+        breaker.record_success()
+
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.is_open())
+
+    def test_failed_trial_reopens(self):
+        """Does a failed trial request open the circuit again straight away?"""
+
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.05)
+
+        for _ in range(3):
+            breaker.record_failure()
+
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+
+        self.assertFalse(breaker.allow())
+
+    def test_endpoint_families(self):
+        """Do endpoints get their own circuits, whatever the ids in the URL, and do 404s count as the endpoint being up?"""
+
+        breakers = CircuitBreakers(failure_threshold=2)
+
+        breakers.record('https://api.spotify.com/v1/search', 503)
+        breakers.record('https://api.spotify.com/v1/search', None)
+        breakers.record('https://api.spotify.com/v1/playlists/abc', 404)
+        breakers.record('https://api.spotify.com/v1/playlists/def', 404)
+
+        self.assertTrue(breakers.is_open('/search'))
+        self.assertFalse(breakers.is_open('/playlists/{id}'))
+        self.assertTrue(breakers.for_url('https://api.spotify.com/v1/playlists/xyz').allow())
+
+    def test_client_stops_calling_failing_endpoint(self):
+        """Once an endpoint keeps timing out, does the client stop sending it requests?"""
+
+        transport = FailingTransport()
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as token_cache:
+            client = SpotifyClient(transport=transport, token_manager=TokenManager(transport, cache_path=token_cache.name),
+                                   breakers=CircuitBreakers(failure_threshold=3, reset_timeout=60), retry_policies=RetryPolicies(RetryPolicy(max_attempts=1)))
+
+            for n in range(10):
+                self.assertIsNone(client.get_playlist_info(f'playlist{n}'))
+
+        self.assertEqual(transport.api_requests, 3)
+
+
+    def test_status_tells_timeout_from_not_found(self):
+        """Does a timed out playlist fetch report no status code, and a missing playlist a 404 (so only that forgets a stored playlist)?"""
+
+        transport = FailingTransport()
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as token_cache:
+            client = SpotifyClient(transport=transport, token_manager=TokenManager(transport, cache_path=token_cache.name),
+                                   retry_policies=RetryPolicies(RetryPolicy(max_attempts=1)))
+
+            self.assertEqual(client.get_playlist_info('playlist0', with_status=True), (None, None))
+
+            transport = MissingPlaylistTransport()
+            client = SpotifyClient(transport=transport, token_manager=TokenManager(transport, cache_path=token_cache.name))
+
+            self.assertEqual(client.get_playlist_info('no-such-playlist', with_status=True), (None, 404))
+            self.assertIsNone(client.get_playlist_info('no-such-playlist'))
+
+
+class StaleWhileRevalidateCacheTests(TestCase):
+    """Tests for serving the last good payload while it's refreshed, or while Spotify is failing."""
+
+    def test_fresh_payload_not_fetched(self):
+        """Is a fresh payload served without calling Spotify?"""
+
+        cache = StaleWhileRevalidateCache()
+        cache.put('playlist0', {'name': 'Cowpunk'})
+
+        payload, stale = cache.get('playlist0', lambda: self.fail("fetched a fresh payload"))
+
+        self.assertEqual(payload, {'name': 'Cowpunk'})
+        self.assertFalse(stale)
+
+    def test_stale_payload_served_while_refreshing(self):
+        """Is a stale payload served straight away, and replaced once the background refresh is done?"""
+
+        cache = StaleWhileRevalidateCache(fresh_for=timedelta(0))
+        cache.put('playlist0', {'name': 'Old'})
+        refreshed = threading.Event()
+
+        def fetch():
+            refreshed.set()
+            return {'name': 'New'}
+
+        payload, stale = cache.get('playlist0', fetch)
+
+        self.assertEqual(payload, {'name': 'Old'})
+        self.assertTrue(stale)
+        self.assertTrue(refreshed.wait(1))
+
+        for _ in range(100):
+            if cache.lookup('playlist0')[0] == {'name': 'New'}:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(cache.lookup('playlist0')[0], {'name': 'New'})
+
+    def test_failed_refresh_keeps_stale_payload(self):
+        """If Spotify is failing, is the stale payload kept (and still served)?"""
+
+        cache = StaleWhileRevalidateCache(fresh_for=timedelta(0))
+        cache.put('playlist0', {'name': 'Old'})
+
+        cache.get('playlist0', lambda: None)
+
+        for _ in range(100):
+            if cache.stats()['failed_refreshes']:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(cache.get('playlist0', lambda: None), ({'name': 'Old'}, True))
+
+    def test_missing_payload_fetched(self):
+        """Is a payload that isn't cached fetched straight away, and only cached if the fetch worked?"""
+
+        cache = StaleWhileRevalidateCache()
+
+        self.assertEqual(cache.get('playlist0', lambda: None), (None, False))
+        self.assertEqual(cache.get('playlist0', lambda: {'name': 'Cowpunk'}), ({'name': 'Cowpunk'}, False))
+        self.assertEqual(cache.lookup('playlist0'), ({'name': 'Cowpunk'}, False))
+
+
+class StalePlaylistTests(TestCase):
+    """Tests for serving the last cached version of a playlist when its current tracks can't be fetched."""
+
+    def test_stale_playlist_tagged_with_its_own_snapshot(self):
+        """If the playlist changed but its tracks can't be fetched, is the old version served with the old snapshot's
+        ETag (so browsers don't keep it as the current version)?"""
+
+        # Spotify has the playlist's details (now at snapshot2), but answers its tracks with a 404
+        catalog = Catalog({'playlists': {'changed': {'id': 'changed', 'name': 'Changed', 'snapshot_id': 'snapshot2', 'tracks': {'total': 2}}}})
+        server = serve_in_thread(create_app(catalog))
+        base_url = f'http://127.0.0.1:{server.port}'
+        fd, token_cache_path = tempfile.mkstemp()
+        os.close(fd)
+
+        tracks = PlaylistTracks(1)
+        tracks.append(Track(id='track0', name='Old Track'))
+        app_module.playlist_cache.put('changed', IndexedPlaylist(tracks), 'snapshot1')
+
+        spotify_async = app_module.spotify_async
+        app_module.spotify_async = AsyncSpotifyClient(api_base_url=f'{base_url}/v1', token_manager=TokenManager(cache_path=token_cache_path, token_url=f'{base_url}/api/token'))
+
+        try:
+            with app.test_client() as client:
+                tracks_response = client.get('/get-playlist-tracks/changed')
+                page_response = client.get('/get-playlist-tracks/changed/page')
+        finally:
+            app_module.spotify_async.run_sync(app_module.spotify_async.close())
+            app_module.spotify_async = spotify_async
+            server.shutdown()
+            os.remove(token_cache_path)
+
+        self.assertEqual(tracks_response.status_code, 200)
+        self.assertEqual(tracks_response.get_json()[0]['name'], 'Old Track')
+        self.assertEqual(tracks_response.headers['ETag'], '"snapshot1"')
+        self.assertIn('Stale', tracks_response.headers['Warning'])
+        self.assertEqual(page_response.headers['ETag'], '"snapshot1"')
@@ -0,0 +1,138 @@
+from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+import time
+
+from coalesce import SingleFlight, AsyncSingleFlight, coalesced
+from spotify_client import PlaylistTracks
+from track import Track
+
+
+class FakeClient:
+    """Counts how many times the 'upstream' call actually runs."""
+
+    def __init__(self):
+        self.single_flight = SingleFlight()
+        self.upstream_calls = 0
+        self.lock = threading.Lock()
+
+    @coalesced
+    def get_playlist_tracks(self, playlist_id):
+        with self.lock:
+            self.upstream_calls += 1
+        time.sleep(0.1)
+        return [f'{playlist_id}-track']
+
+
+class CoalesceTests(TestCase):
+    """Tests for single-flight request coalescing."""
+
+    def test_concurrent_calls_share_one_call(self):
+        """Do concurrent callers for the same playlist share one upstream call?"""
+
+        client = FakeClient()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: client.get_playlist_tracks('abc'), range(8)))
+
+        self.assertEqual(client.upstream_calls, 1)
+        self.assertTrue(all(result == ['abc-track'] for result in results))
+        self.assertEqual(client.single_flight.stats(), {'calls': 8, 'coalesced': 7})
+
+    def test_different_arguments_not_coalesced(self):
+        """Do calls for different playlists each make their own upstream call?"""
+
+        client = FakeClient()
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(client.get_playlist_tracks, ['abc', 'xyz']))
+
+        self.assertEqual(client.upstream_calls, 2)
+
+    def test_sequential_calls_not_cached(self):
+        """Once a call finishes, does the next caller make a fresh upstream call?"""
+
+        client = FakeClient()
+        client.get_playlist_tracks('abc')
+        client.get_playlist_tracks('abc')
+
+        self.assertEqual(client.upstream_calls, 2)
+
+    def test_errors_are_shared(self):
+        """Do waiting callers get the leader's exception?"""
+
+        single_flight = SingleFlight()
+
+        def fail():
+            time.sleep(0.1)
+            raise ValueError("upstream failed")
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [executor.submit(single_flight.do, 'key', fail) for _ in range(3)]
+
+        for future in futures:
+            self.assertIsInstance(future.exception(), ValueError)
+
+    def test_async_concurrent_calls_share_one_call(self):
+        """Do concurrent coroutines for the same key share one call?"""
+
+        single_flight = AsyncSingleFlight()
+        upstream_calls = []
+
+        async def fetch():
+            upstream_calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'result'
+
+        async def main():
+            return await asyncio.gather(*(single_flight.do('key', fetch) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(main()), ['result'] * 5)
+        self.assertEqual(len(upstream_calls), 1)
+        self.assertEqual(single_flight.stats()['coalesced'], 4)
+
+    def test_callers_get_their_own_copy(self):
+        """Does each caller get its own copy of a shared PlaylistTracks (with its metadata), so changing one doesn't change the others?"""
+
+        single_flight = SingleFlight()
+        started = threading.Event()
+
+        def fetch():
+            started.set()
+            time.sleep(0.1)
+            tracks = PlaylistTracks(total=3)
+            tracks.add_batch([Track(id='track0'), Track(id='track1'), Track(id='track2')])
+            return tracks
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            leader = executor.submit(single_flight.do, 'key', fetch)
+            started.wait()
+            follower = executor.submit(single_flight.do, 'key', fetch)
+
+        leader, follower = leader.result(), follower.result()
+        follower.sort(key=lambda track: track.id, reverse=True)
+        follower.truncated_reason = 'max_memory'
+
+        self.assertEqual(single_flight.stats()['coalesced'], 1)
+        self.assertIsInstance(follower, PlaylistTracks)
+        self.assertEqual(follower.total, 3)
+        self.assertEqual([track.id for track in leader], ['track0', 'track1', 'track2'])
+        self.assertIsNone(leader.truncated_reason)
+
+    def test_async_callers_get_their_own_copy(self):
+        """Do coroutines sharing a call get their own copy of its result?"""
+
+        single_flight = AsyncSingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return {'id': 'playlist0'}, 200
+
+        async def main():
+            return await asyncio.gather(*(single_flight.do('key', fetch) for _ in range(3)))
+
+        results = asyncio.run(main())
+        results[1][0]['id'] = 'changed'
+
+        self.assertEqual([payload['id'] for payload, _ in results], ['playlist0', 'changed', 'playlist0'])
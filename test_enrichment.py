@@ -0,0 +1,77 @@
+from unittest import TestCase
+
+from enrichment import EnrichmentPlan
+from track import Track
+
+
+class EnrichmentPlanTests(TestCase):
+    """Tests for planning and applying playlist track enrichment."""
+
+    def setUp(self):
+        """Set up 200 tracks: the first 150 by the same artist, the rest by 50 different artists."""
+        self.tracks = [Track(id=f'track{i}', artist_id='artist0' if i < 150 else f'artist{i}') for i in range(200)]
+
+    def test_plan_batches(self):
+        """Are track and artist ids de-duplicated and packed into the largest batches allowed?"""
+
+        plan = EnrichmentPlan(self.tracks)
+
+        self.assertEqual(len(plan.audio_features_batches), 2)
+        self.assertEqual(len(plan.artist_ids), 51)
+        self.assertEqual(len(plan.artists_batches), 2)
+
+        # the old approach made an audio features call and an artists call for each page of 50 tracks
+        self.assertEqual(plan.calls_without_plan(), 8)
+        self.assertEqual(plan.calls_planned(), 4)
+        self.assertEqual(plan.calls_saved(), 4)
+
+    def test_apply_fans_out_results(self):
+        """Do the batched results get added to every track that shares the id?"""
+
+        plan = EnrichmentPlan(self.tracks)
+
+        audio_features_payloads = [{'audio_features': [{'id': track_id, 'danceability': 0.5, 'energy': 0.25, 'acousticness': 0.1,
+                                                        'instrumentalness': 0.0, 'valence': 0.75, 'tempo': 120.4}
+                                                       for track_id in batch]}
+                                   for batch in plan.audio_features_batches]
+        artists_payloads = [{'artists': [{'id': artist_id, 'followers': {'total': 1000}, 'popularity': 50, 'genres': ['cowpunk']}
+                                         for artist_id in batch]}
+                            for batch in plan.artists_batches]
+
+        tracks = plan.apply(audio_features_payloads + artists_payloads)
+
+        self.assertEqual(tracks[0].tempo, 120.4)
+        self.assertEqual(tracks[0].energy, 0.25)
+        self.assertEqual(tracks[149].artist_genres, ['cowpunk'])
+        self.assertEqual(tracks[199].artist_followers, 1000)
+
+    def test_cached_artists_are_not_fetched(self):
+        """Are cached artists left out of the artists batches but still added to the tracks?"""
+
+        plan = EnrichmentPlan(self.tracks)
+        plan.use_cached_artists({'artist0': {'id': 'artist0', 'followers': {'total': 5}, 'popularity': 10, 'genres': ['cowpunk']}})
+
+        self.assertEqual(len(plan.artist_ids), 50)
+        self.assertEqual(len(plan.artists_batches), 1)
+
+        plan.apply_artists([{'artists': [{'id': artist_id, 'followers': {'total': 1}, 'popularity': 1, 'genres': []} for artist_id in plan.artist_ids]}])
+
+        self.assertEqual(self.tracks[0].artist_genres, ['cowpunk'])
+        self.assertEqual(len(plan.fetched_artists), 50)
+
+    def test_stored_audio_features_are_not_fetched(self):
+        """Are tracks with stored audio features left out of the audio features batches but still added to the tracks?"""
+
+        stored = {f'track{i}': {'id': f'track{i}', 'danceability': 0.5, 'energy': 0.5, 'acousticness': 0.5,
+                                'instrumentalness': 0.5, 'valence': 0.5, 'tempo': 99.6} for i in range(150)}
+
+        plan = EnrichmentPlan(self.tracks)
+        plan.use_stored_audio_features(stored)
+
+        self.assertEqual(len(plan.track_ids), 50)
+        self.assertEqual(len(plan.audio_features_batches), 1)
+
+        plan.apply_audio_features([{'audio_features': [None] * 50}])
+
+        self.assertEqual(self.tracks[0].tempo, 99.6)
+        self.assertIsNone(self.tracks[199].tempo)
@@ -0,0 +1,158 @@
+from unittest import TestCase
+from datetime import datetime, timedelta
+import tempfile
+
+from app import app, db, TESTING
+from models import EnrichmentJob, EnrichmentJobPage, JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING
+from fake_spotify.synthetic import SyntheticResponse, SyntheticTransport
+from enrichment_worker import MAX_ATTEMPTS, JOB_STALL_TIMEOUT, work
+from retry_policy import RetryPolicies, RetryPolicy
+from spotify_client import SpotifyClient
+from token_manager import TokenManager
+
+
+class FailingPageTransport(SyntheticTransport):
+    """Fails the page of the playlist at `failing_offset` (`failures` times), and counts the pages requested.
+    The playlist's snapshot changes to `changes_to` once the page at `changes_at` has been served."""
+
+    def __init__(self, playlist_size, failing_offset=None, failures=0, changes_at=None, changes_to=None):
+        super().__init__(playlist_size, snapshot_id='snapshot0')
+        self.failing_offset = failing_offset
+        self.failures = failures
+        self.changes_at = changes_at
+        self.changes_to = changes_to
+        self.offsets_requested = []
+
+    def request(self, method, url, headers=None, params=None, data=None):
+        if url.endswith('/tracks'):
+            offset = int(params['offset'])
+            self.offsets_requested.append(offset)
+
+            if offset == self.failing_offset and self.failures > 0:
+                self.failures -= 1
+                return SyntheticResponse(500, {'error': {'status': 500, 'message': 'Server error'}})
+
+            if offset == self.changes_at:
+                self.snapshot_id = self.changes_to
+
+        return super().request(method, url, headers, params, data)
+
+
+if TESTING:
+
+    db.create_all()
+
+
+    class EnrichmentJobTests(TestCase):
+        """Tests for the background enrichment job queue and worker."""
+
+        def setUp(self):
+            with app.app_context():
+                db.session.rollback()
+                EnrichmentJobPage.query.delete()
+                EnrichmentJob.query.delete()
+                db.session.commit()
+
+            self.token_cache = tempfile.NamedTemporaryFile(suffix='.json')
+
+        def tearDown(self):
+            self.token_cache.close()
+
+        def make_client(self, transport):
+            # No retries within a request, so a failed page fails the attempt and the job's own retries are what's tested
+            return SpotifyClient(transport=transport, token_manager=TokenManager(transport, cache_path=self.token_cache.name),
+                                 retry_policies=RetryPolicies(RetryPolicy(max_attempts=1)))
+
+        def test_job_resumes_from_saved_pages(self):
+            """Is a job whose page failed tried again without fetching the pages it already saved?"""
+
+            transport = FailingPageTransport(playlist_size=230, failing_offset=100, failures=1)
+
+            with app.app_context():
+                job = EnrichmentJob.enqueue('playlist0', 'snapshot0', total=230, pages_total=5)
+                work(self.make_client(transport), once=True)
+
+                job = EnrichmentJob.query.get(job.id)
+
+                self.assertEqual(job.status, JOB_DONE)
+                self.assertEqual(job.attempts, 2)
+                self.assertEqual(job.pages_done, 5)
+                self.assertEqual(transport.offsets_requested.count(0), 1)
+                self.assertEqual([track.id for track in job.tracks()], [transport.track(i)['id'] for i in range(230)])
+                self.assertIsNotNone(job.tracks()[229].tempo)
+
+        def test_job_fails_after_max_attempts(self):
+            """Is a job that keeps failing marked failed, and can it be retried keeping its saved pages?"""
+
+            transport = FailingPageTransport(playlist_size=230, failing_offset=100, failures=MAX_ATTEMPTS)
+
+            with app.app_context():
+                job = EnrichmentJob.enqueue('playlist0', 'snapshot0', total=230, pages_total=5)
+                work(self.make_client(transport), once=True)
+
+                job = EnrichmentJob.query.get(job.id)
+
+                self.assertEqual(job.status, JOB_FAILED)
+                self.assertEqual(job.attempts, MAX_ATTEMPTS)
+                self.assertEqual(job.pages_done, 2)
+
+                job.retry()
+                work(self.make_client(transport), once=True)
+
+                self.assertEqual(EnrichmentJob.query.get(job.id).status, JOB_DONE)
+
+        def test_one_job_per_snapshot(self):
+            """Does queueing a version of the playlist that already has a job return that job, instead of adding another?"""
+
+            with app.app_context():
+                job = EnrichmentJob.enqueue('playlist0', 'snapshot0', total=230, pages_total=5)
+                again = EnrichmentJob.enqueue('playlist0', 'snapshot0', total=230, pages_total=5)
+                changed = EnrichmentJob.enqueue('playlist0', 'snapshot1', total=240, pages_total=5)
+
+                self.assertEqual(again.id, job.id)
+                self.assertNotEqual(changed.id, job.id)
+                self.assertEqual(EnrichmentJob.query.count(), 2)
+
+        def test_changed_playlist_job_superseded(self):
+            """If the playlist changes while its job runs, are the job's pages dropped and its new version enriched instead?"""
+
+            transport = FailingPageTransport(playlist_size=230, changes_at=100, changes_to='snapshot1')
+
+            with app.app_context():
+                job = EnrichmentJob.enqueue('playlist0', 'snapshot0', total=230, pages_total=5)
+                work(self.make_client(transport), once=True)
+
+                job = EnrichmentJob.query.get(job.id)
+                new_job = EnrichmentJob.for_snapshot('playlist0', 'snapshot1')
+
+                self.assertEqual(job.status, JOB_FAILED)
+                self.assertEqual(job.pages_done, 0)
+                self.assertEqual(EnrichmentJobPage.query.filter_by(job_id=job.id).count(), 0)
+                self.assertEqual(new_job.status, JOB_DONE)
+                self.assertEqual(new_job.pages_done, 5)
+
+        def test_stalled_job_claimed_again(self):
+            """Is a running job that stopped being updated (its worker crashed) claimed again, or failed if it's out of attempts?"""
+
+            with app.app_context():
+                stalled = datetime.now() - JOB_STALL_TIMEOUT - timedelta(minutes=1)
+
+                worn_out = EnrichmentJob.enqueue('playlist0', 'snapshot0', total=1000, pages_total=20)
+                worn_out.status, worn_out.attempts, worn_out.updated_at = JOB_RUNNING, MAX_ATTEMPTS, stalled
+
+                crashed = EnrichmentJob.enqueue('playlist1', 'snapshot1', total=1000, pages_total=20)
+                crashed.status, crashed.attempts, crashed.updated_at = JOB_RUNNING, 1, stalled
+
+                running = EnrichmentJob.enqueue('playlist2', 'snapshot2', total=1000, pages_total=20)
+                running.status, running.attempts = JOB_RUNNING, 1
+                db.session.commit()
+
+                claimed = EnrichmentJob.claim_next(JOB_STALL_TIMEOUT, MAX_ATTEMPTS)
+
+                self.assertEqual(claimed.id, crashed.id)
+                self.assertEqual(claimed.attempts, 2)
+                self.assertEqual(EnrichmentJob.query.get(worn_out.id).status, JOB_FAILED)
+                self.assertIsNone(EnrichmentJob.claim_next(JOB_STALL_TIMEOUT, MAX_ATTEMPTS))
+
+                claimed.release("Server error", MAX_ATTEMPTS)
+                self.assertEqual(claimed.status, JOB_QUEUED)
@@ -0,0 +1,74 @@
+from unittest import TestCase, skipIf
+import csv
+import io
+
+from export import EXPORT_COLUMNS, iter_arrow, iter_csv, iter_parquet, pyarrow
+from track import Track
+
+
+def make_batches(batch_count, batch_size=100):
+    return [[Track(id=f'track{i}', name=f'Song {i}', artist_name='Jason & the Scorchers', popularity=i % 100, energy=0.5, tempo=120.5,
+                   artist_followers=3_000_000_000, artist_genres=['cowpunk', 'alt country'])
+             for i in range(start, start + batch_size)]
+            for start in range(0, batch_count * batch_size, batch_size)]
+
+
+class CsvExportTests(TestCase):
+    """Tests for exporting playlist tracks to CSV."""
+
+    def test_rows(self):
+        """Does the CSV have a header and a row per track, with genres in one column and missing values left blank?"""
+
+        batches = make_batches(2)
+        batches[0][0].energy = None
+
+        rows = list(csv.DictReader(io.StringIO(b''.join(iter_csv(batches)).decode())))
+
+        self.assertEqual(list(rows[0].keys()), EXPORT_COLUMNS)
+        self.assertEqual(len(rows), 200)
+        self.assertEqual(rows[0]['artist_genres'], 'cowpunk; alt country')
+        self.assertEqual(rows[0]['energy'], '')
+        self.assertEqual(rows[1]['energy'], '0.5')
+
+    def test_written_batch_by_batch(self):
+        """Is a chunk of the file yielded as each batch comes in, before the next batch is read?"""
+
+        batches_read = []
+
+        def batches():
+            for tracks in make_batches(3):
+                batches_read.append(tracks)
+                yield tracks
+
+        chunks = iter_csv(batches())
+
+        self.assertEqual(next(chunks).decode().count('\n'), 101)
+        self.assertEqual(len(batches_read), 1)
+
+
+@skipIf(pyarrow is None, "pyarrow isn't installed")
+class ColumnarExportTests(TestCase):
+    """Tests for exporting playlist tracks to Arrow and Parquet."""
+
+    def test_parquet_typed_columns(self):
+        """Does the Parquet file have numeric audio feature columns, a list of genres, and a row group per 1000 tracks?"""
+
+        data = b''.join(iter_parquet(make_batches(25)))
+        parquet_file = pyarrow.parquet.ParquetFile(io.BytesIO(data))
+        table = parquet_file.read()
+
+        self.assertEqual(table.num_rows, 2500)
+        self.assertEqual(parquet_file.num_row_groups, 3)
+        self.assertEqual(table.schema.field('energy').type, pyarrow.float32())
+        self.assertEqual(table.schema.field('popularity').type, pyarrow.int8())
+        self.assertEqual(table.column('artist_followers')[0].as_py(), 3_000_000_000)
+        self.assertEqual(table.column('artist_genres')[0].as_py(), ['cowpunk', 'alt country'])
+
+    def test_arrow_stream(self):
+        """Is each batch of tracks sent as its own record batch in the Arrow stream?"""
+
+        chunks = list(iter_arrow(make_batches(3)))
+        reader = pyarrow.ipc.open_stream(b''.join(chunks))
+
+        self.assertEqual([batch.num_rows for batch in reader], [100, 100, 100])
+        self.assertGreater(len(chunks), 3)
@@ -0,0 +1,98 @@
+from unittest import TestCase
+import os
+import tempfile
+
+from fake_spotify import Catalog, create_app, serve_in_thread
+from metrics import UPSTREAM_RETRIES
+from rate_limiter import MemoryTokenBucket, RateLimitScheduler
+from spotify_client import SpotifyClient
+from token_manager import TokenManager
+from transport import PooledTransport
+
+
+class FakeSpotifyTests(TestCase):
+    """Tests for the SpotifyClient against the fake Spotify server."""
+
+    def setUp(self):
+        """Set up a token cache file, so tokens aren't shared with other clients on the host"""
+        fd, self.token_cache_path = tempfile.mkstemp()
+        os.close(fd)
+        self.servers = []
+
+    def tearDown(self):
+        """Stop the fake servers and clean up the token cache file"""
+        for server in self.servers:
+            server.shutdown()
+        os.remove(self.token_cache_path)
+
+    def start(self, catalog=None, scheduler=None, **options):
+        """Start a fake server and return a client pointed at it."""
+
+        server = serve_in_thread(create_app(catalog or Catalog(), **options))
+        self.servers.append(server)
+        base_url = f'http://127.0.0.1:{server.port}'
+
+        transport = PooledTransport()
+        tokens = TokenManager(transport, cache_path=self.token_cache_path, token_url=f'{base_url}/api/token')
+
+        return SpotifyClient(transport=transport, token_manager=tokens, scheduler=scheduler, api_base_url=f'{base_url}/v1')
+
+    def test_playlist_pages(self):
+        """Are all pages of a long playlist fetched and enriched, with next links on all but the last page?"""
+
+        client = self.start()
+        tracks = client.get_playlist_tracks('synthetic-120')
+
+        self.assertEqual(len(tracks), 120)
+        self.assertEqual(tracks.total, 120)
+        self.assertIsNotNone(tracks[119].tempo)
+        self.assertEqual(tracks[0].artist_genres, ['synthpop', 'indietronica'])
+
+        url = f'{client.api_base_url}/playlists/synthetic-120/tracks'
+        self.assertIn('offset=50', client.api_get(url, {'limit': 50})['next'])
+        self.assertIsNone(client.api_get(url, {'limit': 50, 'offset': 100})['next'])
+
+    def test_replays_fixtures(self):
+        """Are recorded playlists and searches served instead of synthetic ones?"""
+
+        catalog = Catalog({
+            'playlists': {'recorded': {'id': 'recorded', 'name': 'Recorded', 'snapshot_id': 'abc', 'tracks': {'total': 1}}},
+            'searches': {'cowpunk': [{'id': 'cowpunk-playlist', 'name': 'Cowpunk', 'owner': {'id': 'spotify'}}]},
+        })
+        client = self.start(catalog)
+
+        self.assertEqual(client.get_playlist_info('recorded')['snapshot_id'], 'abc')
+        self.assertIsNone(client.get_playlist_info('not-recorded'))
+        self.assertEqual(client.get_playlist_by_genre('cowpunk', 'spotify'), 'cowpunk-playlist')
+
+    def test_synthetic_genre_search(self):
+        """Do unrecorded genre searches find a playlist from each source?"""
+
+        client = self.start()
+        found = client.find_genre_playlists('shoegaze', ['spotify', 'thesoundsofspotify'])
+
+        self.assertTrue(found['spotify'].startswith('synthetic-'))
+        self.assertTrue(found['thesoundsofspotify'].startswith('synthetic-'))
+
+    def test_expired_token_is_refreshed(self):
+        """When the token expires, does the client get a new one and retry the request?"""
+
+        client = self.start()
+        self.assertIsNotNone(client.get_playlist_info('synthetic-10'))
+
+        client.transport.request('POST', f'http://127.0.0.1:{self.servers[0].port}/_fake/expire-tokens')
+        retries = UPSTREAM_RETRIES.value('/playlists/{id}', 'expired_token')
+
+        self.assertIsNotNone(client.get_playlist_info('synthetic-10'))
+        self.assertEqual(client.tokens.tokens_fetched, 2)
+        self.assertEqual(UPSTREAM_RETRIES.value('/playlists/{id}', 'expired_token') - retries, 1)
+
+    def test_rate_limited_request_is_retried(self):
+        """Does the client back off for the Retry-After period and retry a request answered with a 429?"""
+
+        scheduler = RateLimitScheduler(MemoryTokenBucket(rate=100, capacity=100))
+        client = self.start(scheduler=scheduler, rate_limit_every=2, retry_after=0)
+
+        self.assertIsNotNone(client.get_playlist_info('synthetic-10'))
+        self.assertIsNotNone(client.get_playlist_info('synthetic-10'))
+        self.assertEqual(scheduler.rate_limited_responses, 1)
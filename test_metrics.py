@@ -0,0 +1,145 @@
+from unittest import TestCase
+import asyncio
+import tempfile
+import threading
+
+from flask import Flask, redirect
+from sqlalchemy import create_engine, text
+
+from fake_spotify.synthetic import SyntheticTransport
+from metrics import Counter, Histogram, Registry, UPSTREAM_RESPONSES, ROUTE_RESPONSES, ROUTE_SQL_QUERIES, endpoint_name, instrument_app
+from spotify_client import SpotifyClient
+from token_manager import TokenManager
+
+
+class MetricsTests(TestCase):
+    """Tests for the metrics and their Prometheus text format."""
+
+    def test_render(self):
+        """Are counters, histograms and stats gauges rendered in the Prometheus text format?"""
+
+        registry = Registry()
+        counter = registry.register(Counter('requests_total', 'Requests.', ['endpoint']))
+        histogram = registry.register(Histogram('request_seconds', 'Latency.', buckets=[0.1, 1]))
+        registry.add_stats(lambda: {'hits': 3, 'hit_ratio': 0.75, 'note': 'ignored'}, prefix='cache_')
+
+        counter.inc('/search')
+        counter.inc('/search', amount=2)
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        text = registry.render()
+
+        self.assertIn('# TYPE requests_total counter', text)
+        self.assertIn('requests_total{endpoint="/search"} 3', text)
+        self.assertIn('request_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('request_seconds_bucket{le="1"} 2', text)
+        self.assertIn('request_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn('request_seconds_count 3', text)
+        self.assertIn('spotify_explorer_cache_hit_ratio 0.75', text)
+        self.assertNotIn('note', text)
+
+    def test_endpoint_name(self):
+        """Are ids replaced, so each Spotify endpoint gets one label?"""
+
+        self.assertEqual(endpoint_name('https://api.spotify.com/v1/playlists/37i9dQZF1EIgtiaACXv6tQ/tracks'), '/playlists/{id}/tracks')
+        self.assertEqual(endpoint_name('https://api.spotify.com/v1/artists/2CIMQHirSU0MQqyYHq0eOx/top-tracks'), '/artists/{id}/top-tracks')
+        self.assertEqual(endpoint_name('https://api.spotify.com/v1/artists'), '/artists')
+        self.assertEqual(endpoint_name('https://accounts.spotify.com/api/token'), '/api/token')
+
+    def test_client_calls_recorded(self):
+        """Are the client's upstream calls counted by endpoint and status?"""
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as token_cache:
+            transport = SyntheticTransport(playlist_size=120)
+            client = SpotifyClient(transport=transport, token_manager=TokenManager(transport, cache_path=token_cache.name))
+
+            tracks_before = UPSTREAM_RESPONSES.value('/playlists/{id}/tracks', 200)
+            audio_features_before = UPSTREAM_RESPONSES.value('/audio-features', 200)
+            client.get_playlist_tracks('metrics')
+
+            self.assertEqual(UPSTREAM_RESPONSES.value('/playlists/{id}/tracks', 200) - tracks_before, 3)
+            self.assertEqual(UPSTREAM_RESPONSES.value('/audio-features', 200) - audio_features_before, 2)
+
+    def test_route_metrics(self):
+        """Are requests counted by route (not by URL) and status code?"""
+
+        app = Flask(__name__)
+        instrument_app(app)
+
+        @app.route('/things/<thing_id>')
+        def thing(thing_id):
+            return thing_id
+
+        client = app.test_client()
+        before = ROUTE_RESPONSES.value('/things/<thing_id>', 'GET', 200)
+
+        client.get('/things/1')
+        client.get('/things/2')
+
+        self.assertEqual(ROUTE_RESPONSES.value('/things/<thing_id>', 'GET', 200) - before, 2)
+
+    def test_sql_queries_counted_in_nested_contexts(self):
+        """Are queries run in a nested app context (like the caches'), or in a thread working for the request
+        from the async client's shared loop, counted against the request's route?"""
+
+        app = Flask(__name__)
+        instrument_app(app)
+        engine = create_engine('sqlite://')
+
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+
+        def query():
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+
+        async def query_in_thread():
+            await asyncio.to_thread(query)
+
+        @app.route('/queries')
+        def queries():
+            query()
+
+            with app.app_context():
+                query()
+
+            asyncio.run_coroutine_threadsafe(query_in_thread(), loop).result()
+
+            return 'done'
+
+        before = ROUTE_SQL_QUERIES.total('/queries')
+
+        app.test_client().get('/queries')
+        query()  # outside of a request, so not counted
+
+        self.assertEqual(ROUTE_SQL_QUERIES.total('/queries') - before, 3)
+        loop.call_soon_threadsafe(loop.stop)
+
+    def test_sql_queries_counted_across_redirects(self):
+        """Is each request of a followed redirect counted against its own route? (The test client keeps the first
+        request's context around while it makes the second, so the two share a `g`.)"""
+
+        app = Flask(__name__)
+        instrument_app(app)
+        engine = create_engine('sqlite://')
+
+        @app.route('/old')
+        def old():
+            return redirect('/query')
+
+        @app.route('/query')
+        def query():
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+
+            return 'done'
+
+        before = ROUTE_SQL_QUERIES.total('/query'), ROUTE_SQL_QUERIES.total('/old')
+
+        with app.test_client() as client:
+            client.get('/old', follow_redirects=True)
+
+        self.assertEqual(ROUTE_SQL_QUERIES.total('/query') - before[0], 1)
+        self.assertEqual(ROUTE_SQL_QUERIES.total('/old') - before[1], 0)
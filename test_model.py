@@ -1,7 +1,8 @@
 from unittest import TestCase
 
 from app import app, db, TESTING
-from models import db, User, Genre, User_Genre
+from models import db, User, Genre, User_Genre, Artist, TrackAudioFeatures
+from datetime import datetime, timedelta
 from enums import FavoriteStatus
 from sqlalchemy.exc import IntegrityError, NoResultFound
 
@@ -22,6 +23,8 @@ if TESTING:
                 User.query.delete()
                 Genre.query.delete()
                 User_Genre.query.delete()
+                Artist.query.delete()
+                TrackAudioFeatures.query.delete()
 
                 # Seed test db
                 u1 = User.signup("u1", "test1@example.com", "testpass1")
@@ -235,5 +238,54 @@ if TESTING:
                 self.assertEqual(len(rock_saved_by_users), 0)
                 self.assertEqual(len(rock_disliked_by_users), 1)
 
+        def test_artist_cache_freshness(self):
+            """Are cached artists only returned while they are within the TTL?"""
+            with app.app_context():
+                Artist.save_payloads([{'id': 'artist1', 'name': 'Ween', 'genres': ['alternative rock'], 'popularity': 60, 'followers': {'total': 1000}}])
+
+                fresh = Artist.get_fresh(['artist1', 'artist2'], timedelta(days=1))
+                self.assertEqual(list(fresh.keys()), ['artist1'])
+                self.assertEqual(fresh['artist1'].to_payload()['followers']['total'], 1000)
+
+                artist = Artist.query.get('artist1')
+                artist.fetched_at = datetime.now() - timedelta(days=2)
+                db.session.commit()
+
+                self.assertEqual(Artist.get_fresh(['artist1'], timedelta(days=1)), {})
+
+        def test_track_audio_features_bulk_save(self):
+            """Are audio features stored in bulk, without overwriting tracks that are already stored?"""
+            with app.app_context():
+                features = {'danceability': 0.5, 'energy': 0.9, 'acousticness': 0.1, 'instrumentalness': 0.0, 'valence': 0.3, 'tempo': 121.5}
+
+                TrackAudioFeatures.save_payloads([{'id': 'track1', **features}, {'id': 'track2', **features}])
+                TrackAudioFeatures.save_payloads([{'id': 'track2', **features, 'tempo': 90.0}, {'id': 'track3', **features}])
+
+                stored = TrackAudioFeatures.get_many(['track1', 'track2', 'track3', 'track4'])
+
+                self.assertEqual(sorted(stored.keys()), ['track1', 'track2', 'track3'])
+                self.assertEqual(stored['track2'].to_payload()['tempo'], 121.5)
+
+        def test_genre_playlist_resolution(self):
+            """Are resolved genre playlists (including "not found") trusted until they're too old, and negatives re-checked sooner?"""
+            with app.app_context():
+                genre = Genre.query.filter_by(title='pop').one()
+
+                self.assertEqual(genre.playlist_id('spotify'), (False, None))
+
+                genre.set_playlist_id('spotify', 'playlist1')
+                genre.set_playlist_id('thesoundsofspotify', None)
+                db.session.commit()
+
+                self.assertEqual(genre.playlist_id('spotify'), (True, 'playlist1'))
+                self.assertEqual(genre.playlist_id('thesoundsofspotify'), (True, None))
+
+                genre.spotify_playlist_checked_at = datetime.now() - timedelta(days=10)
+                genre.en_playlist_checked_at = datetime.now() - timedelta(days=10)
+                db.session.commit()
+
+                self.assertEqual(genre.playlist_id('spotify'), (True, 'playlist1'))
+                self.assertEqual(genre.playlist_id('thesoundsofspotify'), (False, None))
+
 else:
     print("Be sure to set TESTING to True in the app.py file.")
\ No newline at end of file
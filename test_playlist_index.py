@@ -0,0 +1,106 @@
+from unittest import TestCase
+
+from caches import PlaylistCache
+from playlist_index import IndexedPlaylist
+from track import Track
+
+
+class IndexedPlaylistTests(TestCase):
+    """Tests for the server-side pagination, sorting and search of a playlist."""
+
+    def setUp(self):
+        """Set up a playlist of 120 tracks, with no audio features for every 10th track."""
+
+        self.tracks = [Track(id=f'track{i}', name=f'Song {i}', artist_name='Jason & the Scorchers' if i % 2 else 'Rank and File',
+                             popularity=i % 7, tempo=None if i % 10 == 0 else 60 + i, artist_genres=['cowpunk'] if i < 60 else ['alt country'])
+                       for i in range(120)]
+        self.playlist = IndexedPlaylist(self.tracks)
+
+    def test_page_in_playlist_order(self):
+        """Without a sort, is a page a slice of the playlist in playlist order?"""
+
+        total, rows = self.playlist.page(offset=50, limit=25)
+
+        self.assertEqual(total, 120)
+        self.assertEqual([track.id for track in rows], [f'track{i}' for i in range(50, 75)])
+
+    def test_sort_precomputed(self):
+        """Are tempo, energy, danceability and popularity sorted when the playlist is indexed?"""
+
+        self.assertTrue({'tempo', 'energy', 'danceability', 'popularity'} <= set(self.playlist._sort_orders))
+
+    def test_sort_desc_missing_last(self):
+        """Does sorting descending put the highest tempo first, and tracks without a tempo last?"""
+
+        total, rows = self.playlist.page(offset=0, limit=120, sort='tempo', order='desc')
+
+        self.assertEqual(rows[0].id, 'track119')
+        self.assertEqual([track.tempo for track in rows[-12:]], [None] * 12)
+
+    def test_sort_text(self):
+        """Are text columns sorted case-insensitively?"""
+
+        total, rows = self.playlist.page(limit=1, sort='artist_name')
+
+        self.assertEqual(rows[0].artist_name, 'Jason & the Scorchers')
+
+    def test_search(self):
+        """Does search match artist names and genres, and count only the matching tracks?"""
+
+        total, rows = self.playlist.page(limit=10, search='COWPUNK')
+        self.assertEqual(total, 60)
+        self.assertEqual(len(rows), 10)
+
+        total, rows = self.playlist.page(limit=100, sort='tempo', search='scorchers')
+        self.assertEqual(total, 60)
+        self.assertTrue(all(track.artist_name == 'Jason & the Scorchers' for track in rows))
+
+    def test_unknown_sort_field(self):
+        """Is an unknown sort field ignored?"""
+
+        total, rows = self.playlist.page(limit=3, sort='__class__')
+
+        self.assertEqual([track.id for track in rows], ['track0', 'track1', 'track2'])
+
+
+class PlaylistCacheTests(TestCase):
+    """Tests for the snapshot-aware playlist cache."""
+
+    def test_same_snapshot_hits(self):
+        """Is the cached playlist returned for the snapshot it was cached under?"""
+
+        cache = PlaylistCache()
+        playlist = IndexedPlaylist([Track(id='track0')])
+        cache.put('playlist0', playlist, 'snapshot1')
+
+        self.assertIs(cache.get('playlist0', 'snapshot1'), playlist)
+        self.assertEqual(cache.stats()['playlist_cache_hits'], 1)
+
+    def test_new_snapshot_misses(self):
+        """Is a changed playlist (new snapshot) a miss, with the old version kept until it's replaced?"""
+
+        cache = PlaylistCache()
+        old_playlist = IndexedPlaylist([Track(id='track0')])
+        cache.put('playlist0', old_playlist, 'snapshot1')
+
+        self.assertIsNone(cache.get('playlist0', 'snapshot2'))
+        self.assertEqual(cache.stats()['playlist_cache_snapshot_changes'], 1)
+        self.assertIs(cache.previous('playlist0'), old_playlist)
+
+        new_playlist = IndexedPlaylist([Track(id='track1')])
+        cache.put('playlist0', new_playlist, 'snapshot2')
+
+        self.assertIsNone(cache.get('playlist0', 'snapshot1'))
+        self.assertIs(cache.previous('playlist0'), new_playlist)
+
+    def test_least_recently_used_evicted(self):
+        """Is the least recently used playlist dropped once the cache is full?"""
+
+        cache = PlaylistCache(max_playlists=2)
+        cache.put('playlist0', IndexedPlaylist([]), 'snapshot')
+        cache.put('playlist1', IndexedPlaylist([]), 'snapshot')
+        cache.get('playlist0', 'snapshot')
+        cache.put('playlist2', IndexedPlaylist([]), 'snapshot')
+
+        self.assertIsNotNone(cache.get('playlist0', 'snapshot'))
+        self.assertIsNone(cache.get('playlist1', 'snapshot'))
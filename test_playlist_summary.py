@@ -0,0 +1,111 @@
+from unittest import TestCase
+
+import app as app_module
+from app import app
+from playlist_index import IndexedPlaylist
+from playlist_summary import HISTOGRAM_BINS, count_values, summarize_tracks
+from track import Track
+
+
+class PlaylistSummaryTests(TestCase):
+    """Tests for the playlist summary statistics and genre counts."""
+
+    def setUp(self):
+        """Set up a playlist of 100 tracks with energy 0.00 - 0.99, and no audio features for the last 10 tracks."""
+
+        self.tracks = [Track(id=f'track{i}', artist_name='Jason & the Scorchers' if i % 4 else 'Rank and File', popularity=i,
+                             energy=i / 100 if i < 90 else None, tempo=100 + i if i < 90 else None,
+                             artist_genres=['cowpunk', 'alt country'] if i % 2 else ['cowpunk'])
+                       for i in range(100)]
+
+    def test_feature_statistics(self):
+        """Are the mean, median and percentiles worked out from the tracks that have the feature?"""
+
+        energy = summarize_tracks(self.tracks)['features']['energy']
+
+        self.assertEqual(energy['count'], 90)
+        self.assertAlmostEqual(energy['mean'], 0.445)
+        self.assertAlmostEqual(energy['median'], 0.445)
+        self.assertAlmostEqual(energy['min'], 0.0)
+        self.assertAlmostEqual(energy['max'], 0.89)
+        self.assertAlmostEqual(energy['percentiles']['p90'], 0.801)
+
+    def test_histograms(self):
+        """Do the 0 - 1 features get a fixed-range histogram, and tempo one over the playlist's own range?"""
+
+        features = summarize_tracks(self.tracks)['features']
+
+        self.assertEqual(features['energy']['histogram']['edges'][0], 0.0)
+        self.assertEqual(features['energy']['histogram']['edges'][-1], 1.0)
+        self.assertEqual(sum(features['energy']['histogram']['counts']), 90)
+        self.assertEqual(features['energy']['histogram']['counts'][-1], 0)
+        self.assertEqual(features['tempo']['histogram']['edges'][0], 100.0)
+        self.assertEqual(sum(features['tempo']['histogram']['counts']), 90)
+        self.assertEqual(len(features['popularity']['histogram']['counts']), HISTOGRAM_BINS)
+
+    def test_no_audio_features(self):
+        """Is a feature no track has summarized as empty, rather than as NaNs?"""
+
+        summary = summarize_tracks([Track(id='track0'), Track(id='track1')])
+
+        self.assertEqual(summary['features']['danceability']['count'], 0)
+        self.assertIsNone(summary['features']['danceability']['mean'])
+        self.assertEqual(summary['genres'], [])
+
+    def test_genre_and_artist_counts(self):
+        """Are genres counted over every track's artist genres, most common first?"""
+
+        summary = summarize_tracks(self.tracks)
+
+        self.assertEqual(summary['genres'], [{'name': 'cowpunk', 'count': 100}, {'name': 'alt country', 'count': 50}])
+        self.assertEqual(summary['artists'][0], {'name': 'Jason & the Scorchers', 'count': 75})
+
+    def test_count_ties_alphabetical(self):
+        """Are values with the same count listed alphabetically, and cut off at `top`?"""
+
+        self.assertEqual(count_values(['zydeco', 'bluegrass', 'zydeco', 'bluegrass', 'cajun'], top=2),
+                         [{'name': 'bluegrass', 'count': 2}, {'name': 'zydeco', 'count': 2}])
+
+    def test_summary_cached_with_playlist(self):
+        """Is the summary worked out once per indexed playlist (i.e. per snapshot)?"""
+
+        playlist = IndexedPlaylist(self.tracks)
+
+        self.assertIs(playlist.summary(), playlist.summary())
+
+
+class NoSpotify:
+    """Stands in for the Spotify clients, failing the test if anything is asked of them."""
+
+    def __getattr__(self, name):
+        raise AssertionError(f"Spotify was called ({name})")
+
+
+class PlaylistSummaryRouteTests(TestCase):
+    """Tests for the genre count table's summary endpoint."""
+
+    def setUp(self):
+        self.clients = app_module.spotify, app_module.spotify_async
+        app_module.spotify = app_module.spotify_async = NoSpotify()
+
+    def tearDown(self):
+        app_module.spotify, app_module.spotify_async = self.clients
+
+    def test_summary_served_from_playlist_cache(self):
+        """Is the summary worked out from the cached tracks, tagged with their snapshot, without calling Spotify
+        or touching the cache entry (and is a playlist that isn't cached a 404)?"""
+
+        playlist = IndexedPlaylist([Track(id='track0', artist_name='Rank and File', artist_genres=['cowpunk'])])
+        app_module.playlist_cache.put('summarized', playlist, 'snapshot1')
+
+        with app.test_client() as client:
+            response = client.get('/get-playlist-tracks/summarized/summary')
+            not_modified = client.get('/get-playlist-tracks/summarized/summary', headers={'If-None-Match': '"snapshot1"'})
+            missing = client.get('/get-playlist-tracks/not-cached/summary')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], '"snapshot1"')
+        self.assertEqual(response.get_json()['genres'], [{'name': 'cowpunk', 'count': 1}])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(app_module.playlist_cache.previous_snapshot('summarized'), ('snapshot1', playlist))
@@ -0,0 +1,177 @@
+from unittest import TestCase
+import json
+import tempfile
+
+from fake_spotify.synthetic import SyntheticTransport
+from spotify_client import SpotifyClient, PlaylistTracks, estimate_enriched_size, estimate_size
+from token_manager import TokenManager
+from track import Track
+
+
+def make_tracks(count, start=0):
+    return [Track(id=f'track{i}', name=f'Track {i}') for i in range(start, start + count)]
+
+
+class PlaylistTracksTests(TestCase):
+    """Tests for the track cap and memory ceiling applied to large playlists."""
+
+    def test_not_truncated(self):
+        """Is a playlist within the limits returned whole, with no truncation reason?"""
+
+        tracks = PlaylistTracks(total=120, max_tracks=1000)
+
+        self.assertTrue(tracks.add_batch(make_tracks(50)))
+        self.assertTrue(tracks.add_batch(make_tracks(50, 50)))
+        self.assertTrue(tracks.add_batch(make_tracks(20, 100)))
+
+        self.assertEqual(len(tracks), 120)
+        self.assertEqual(tracks.metadata(), {'total': 120, 'returned': 120, 'truncated': False, 'truncated_reason': None})
+
+    def test_max_tracks(self):
+        """Does the list stop at `max_tracks`, in playlist order, and say why?"""
+
+        tracks = PlaylistTracks(total=500, max_tracks=120)
+
+        self.assertTrue(tracks.add_batch(make_tracks(50)))
+        self.assertTrue(tracks.add_batch(make_tracks(50, 50)))
+        self.assertFalse(tracks.add_batch(make_tracks(50, 100)))
+
+        self.assertEqual(len(tracks), 120)
+        self.assertEqual(tracks[-1].id, 'track119')
+        self.assertEqual(tracks.truncated_reason, 'max_tracks')
+
+    def test_max_memory(self):
+        """Does adding tracks stop before a batch would take their estimated size past the memory ceiling?"""
+
+        batch_size = sum(estimate_enriched_size(track) for track in make_tracks(50))
+        tracks = PlaylistTracks(total=500, max_tracks=1000, max_memory_bytes=batch_size * 1.5)
+
+        self.assertTrue(tracks.add_batch(make_tracks(50)))
+        self.assertFalse(tracks.add_batch(make_tracks(50, 50)))
+
+        self.assertEqual(len(tracks), 50)
+        self.assertLessEqual(tracks.estimated_bytes, tracks.max_memory_bytes)
+        self.assertTrue(tracks.truncated)
+        self.assertEqual(tracks.truncated_reason, 'max_memory')
+
+    def test_max_memory_counts_enrichment(self):
+        """Are tracks that aren't enriched yet counted at the size they'll be once they are?"""
+
+        unenriched_size = sum(estimate_size(track) for track in make_tracks(50))
+        tracks = PlaylistTracks(total=50, max_tracks=1000, max_memory_bytes=unenriched_size * 1.1)
+
+        self.assertGreater(estimate_enriched_size(make_tracks(1)[0]), estimate_size(make_tracks(1)[0]))
+        self.assertFalse(tracks.add_batch(make_tracks(50)))
+        self.assertEqual(tracks.truncated_reason, 'max_memory')
+
+    def test_serializes_as_list(self):
+        """Does the track list still serialize as a plain JSON list?"""
+
+        tracks = PlaylistTracks(total=2)
+        tracks.add_batch([{'id': 'track0'}, {'id': 'track1'}])
+
+        self.assertEqual(json.loads(json.dumps(tracks)), [{'id': 'track0'}, {'id': 'track1'}])
+
+
+class TrackTests(TestCase):
+    """Tests for the compact Track record."""
+
+    def test_from_spotify(self):
+        """Does a Spotify track object become a Track with just the fields the tables use?"""
+
+        track = Track.from_spotify({'id': 'track0', 'name': 'Rawhide', 'popularity': 40, 'duration_ms': 185000, 'is_playable': True,
+                                    'preview_url': None, 'type': 'track', 'artists': [{'id': 'artist0', 'name': 'Blue Rodeo'}],
+                                    'album': {'name': 'Outskirts', 'href': 'https://api.spotify.com/v1/albums/album0'}})
+
+        self.assertEqual(track.album, 'Outskirts')
+        self.assertEqual(track.artist_name, 'Blue Rodeo')
+        self.assertEqual(track.duration, '3:05')
+        self.assertIsNone(track.energy)
+        self.assertNotIn('is_playable', track.to_dict())
+
+    def test_slots(self):
+        """Is the Track slotted (no per-instance __dict__)?"""
+
+        self.assertFalse(hasattr(Track(), '__dict__'))
+
+
+class ChangingPlaylistTransport(SyntheticTransport):
+    """Serves a playlist made of the synthetic tracks numbered in `track_numbers`, and counts the enrichment calls."""
+
+    def __init__(self, track_numbers):
+        super().__init__()
+        self.track_numbers = track_numbers
+        self.enriched_ids = []
+
+    def playlist_tracks_page(self, offset, limit):
+        page_numbers = self.track_numbers[offset:offset + limit]
+        return {'items': [{'track': self.track(i)} for i in page_numbers], 'offset': offset, 'total': len(self.track_numbers)}
+
+    def request(self, method, url, headers=None, params=None, data=None):
+        if url.endswith('/audio-features'):
+            self.enriched_ids.extend(params['ids'].split(','))
+        return super().request(method, url, headers, params, data)
+
+
+class UpdatePlaylistTracksTests(TestCase):
+    """Tests for incrementally re-enriching a playlist that changed."""
+
+    def setUp(self):
+        self.token_cache = tempfile.NamedTemporaryFile(suffix='.json')
+        self.transport = ChangingPlaylistTransport(list(range(120)))
+        self.client = SpotifyClient(transport=self.transport, token_manager=TokenManager(self.transport, cache_path=self.token_cache.name))
+
+    def tearDown(self):
+        self.token_cache.close()
+
+    def test_only_added_tracks_enriched(self):
+        """Are only the added tracks enriched, removed tracks dropped and the new playlist order kept?"""
+
+        previous_tracks = self.client.get_playlist_tracks('playlist0')
+
+        # Drop tracks 10-19, add 5 new tracks at the start and move track 0 to the end
+        self.transport.track_numbers = [500, 501, 502, 503, 504] + list(range(1, 10)) + list(range(20, 120)) + [0]
+        self.transport.enriched_ids = []
+
+        tracks = self.client.update_playlist_tracks('playlist0', previous_tracks)
+
+        self.assertEqual(len(self.transport.enriched_ids), 5)
+        self.assertEqual([track.id for track in tracks], [self.transport.track(i)['id'] for i in self.transport.track_numbers])
+        self.assertIs(tracks[-1], previous_tracks[0])
+        self.assertIsNotNone(tracks[0].tempo)
+        self.assertEqual(self.client.enrichment_stats()['tracks_reused'], 110)
+
+
+class IterPlaylistTracksTests(TestCase):
+    """Tests for streaming a playlist's enriched tracks in batches."""
+
+    def setUp(self):
+        self.token_cache = tempfile.NamedTemporaryFile(suffix='.json')
+
+    def tearDown(self):
+        self.token_cache.close()
+
+    def test_limits_applied(self):
+        """Does streaming stop at the memory ceiling like get_playlist_tracks does, and return the tracks saying why?"""
+
+        transport = SyntheticTransport(playlist_size=500)
+        page_size = sum(estimate_enriched_size(track) for track in make_tracks(50))
+        client = SpotifyClient(transport=transport, token_manager=TokenManager(transport, cache_path=self.token_cache.name),
+                               max_memory_bytes=page_size * 4.5)
+
+        def stream():
+            return (yield from client.iter_playlist_tracks('playlist0'))
+
+        batches = []
+        generator = stream()
+
+        try:
+            while True:
+                batches.append(next(generator))
+        except StopIteration as stop:
+            tracks = stop.value
+
+        self.assertEqual(sum(len(batch) for batch in batches), len(tracks))
+        self.assertEqual(tracks.truncated_reason, 'max_memory')
+        self.assertEqual(len(tracks), len(client.get_playlist_tracks('playlist0')))
+        self.assertIsNotNone(batches[-1][-1].tempo)
@@ -0,0 +1,81 @@
+from unittest import TestCase
+
+from app import app, db, TESTING
+from models import Genre, User_Genre
+from prewarm_genre_playlists import prewarm
+from rate_limiter import MemoryTokenBucket, RateLimitScheduler
+
+
+class FakeGenreSearch:
+    """Stands in for the SpotifyClient. Finds a playlist from every source for each genre, except that the searches of
+    genres in `failing` fail, and searching for `interrupt_at` raises KeyboardInterrupt (like a Ctrl-C mid-run)."""
+
+    def __init__(self, failing=(), interrupt_at=None):
+        self.failing = failing
+        self.interrupt_at = interrupt_at
+        self.searched = []
+        self.scheduler = RateLimitScheduler(MemoryTokenBucket())
+
+    def find_genre_playlists(self, genre_title, sources):
+        self.searched.append(genre_title)
+
+        if genre_title == self.interrupt_at:
+            raise KeyboardInterrupt
+
+        if genre_title in self.failing:
+            return {}
+
+        return {source: f'{genre_title}-{source}' for source in sources}
+
+    def transport_stats(self):
+        return {'requests_sent': len(self.searched)}
+
+
+if TESTING:
+
+    with app.app_context():
+        db.create_all()
+
+
+    class PrewarmGenrePlaylistsTests(TestCase):
+        """Tests for resolving every genre's playlists ahead of time, and resuming an interrupted run."""
+
+        def setUp(self):
+            with app.app_context():
+                db.session.rollback()
+                User_Genre.query.delete()
+                Genre.query.delete()
+                db.session.add_all([Genre(title=f'genre{i}') for i in range(5)])
+                db.session.commit()
+
+        def test_resumes_after_interruption(self):
+            """After a run is interrupted, does the next run only search for the genres whose batch wasn't saved?"""
+
+            with app.app_context():
+                with self.assertRaises(KeyboardInterrupt):
+                    prewarm(FakeGenreSearch(interrupt_at='genre3'), workers=1, batch_size=2)
+
+                db.session.rollback()
+
+                self.assertEqual(Genre.query.filter_by(title='genre1').one().playlist_id('spotify'), (True, 'genre1-spotify'))
+                self.assertEqual(Genre.query.filter_by(title='genre2').one().playlist_id('spotify'), (False, None))
+
+                spotify = FakeGenreSearch()
+                stats = prewarm(spotify, workers=1, batch_size=2)
+
+                self.assertEqual(spotify.searched, ['genre2', 'genre3', 'genre4'])
+                self.assertEqual(stats['resolved'], 3)
+                self.assertEqual(stats['found'], 6)
+
+        def test_failed_search_retried_next_run(self):
+            """Is a genre whose search failed left unresolved, so the next run tries it again (and only it)?"""
+
+            with app.app_context():
+                stats = prewarm(FakeGenreSearch(failing={'genre1'}), workers=2, batch_size=2)
+
+                self.assertEqual(stats['failed'], len(Genre.PLAYLIST_COLUMNS))
+
+                spotify = FakeGenreSearch()
+                prewarm(spotify, workers=2, batch_size=2)
+
+                self.assertEqual(spotify.searched, ['genre1'])
@@ -0,0 +1,97 @@
+from unittest import TestCase
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+from rate_limiter import MemoryTokenBucket, FileTokenBucket, RateLimitScheduler, SlicedTokenBucket
+
+
+class RateLimiterTests(TestCase):
+    """Tests for the shared rate limit token bucket and scheduler."""
+
+    def setUp(self):
+        """Set up a temp file for the file-backed bucket"""
+        fd, self.bucket_path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        """Clean up the bucket file"""
+        os.remove(self.bucket_path)
+
+    def test_bucket_capacity(self):
+        """Does the bucket hand out a burst of `capacity` tokens and then ask callers to wait?"""
+
+        bucket = MemoryTokenBucket(rate=1, capacity=3)
+
+        self.assertEqual([bucket.try_acquire() for _ in range(3)], [0, 0, 0])
+        self.assertGreater(bucket.try_acquire(), 0)
+
+    def test_file_bucket_is_shared(self):
+        """Do two buckets using the same file share one budget (like two gunicorn workers would)?"""
+
+        worker_1 = FileTokenBucket(rate=1, capacity=2, path=self.bucket_path)
+        worker_2 = FileTokenBucket(rate=1, capacity=2, path=self.bucket_path)
+
+        self.assertEqual(worker_1.try_acquire(), 0)
+        self.assertEqual(worker_2.try_acquire(), 0)
+        self.assertGreater(worker_1.try_acquire(), 0)
+
+    def test_retry_after_pauses_bucket(self):
+        """Does a 429 with Retry-After pause the bucket for that long?"""
+
+        scheduler = RateLimitScheduler(MemoryTokenBucket(rate=100, capacity=100))
+        scheduler.rate_limited({'Retry-After': '2'})
+
+        self.assertGreater(scheduler.bucket.try_acquire(), 1.5)
+        self.assertEqual(scheduler.stats()['rate_limited_responses'], 1)
+
+    def test_requests_queue_instead_of_failing(self):
+        """Do requests over the budget wait for a turn rather than failing?"""
+
+        scheduler = RateLimitScheduler(MemoryTokenBucket(rate=20, capacity=1), max_queue_time=5)
+
+        start = time.monotonic()
+        self.assertTrue(all(scheduler.wait_for_slot() for _ in range(5)))
+
+        self.assertGreater(time.monotonic() - start, 0.15)
+        self.assertEqual(scheduler.stats()['requests_dropped'], 0)
+        self.assertGreater(scheduler.stats()['requests_queued'], 0)
+
+    def test_async_wait_off_event_loop(self):
+        """Is the (possibly blocking) bucket checked in a thread, rather than on the event loop waiting for a slot?"""
+
+        bucket = MemoryTokenBucket(rate=100, capacity=1)
+        bucket_threads = []
+        try_acquire = bucket.try_acquire
+
+        def recording_try_acquire():
+            bucket_threads.append(threading.get_ident())
+            return try_acquire()
+
+        bucket.try_acquire = recording_try_acquire
+        scheduler = RateLimitScheduler(bucket, max_queue_time=5)
+
+        async def wait_twice():
+            return [await scheduler.wait_for_slot_async(), await scheduler.wait_for_slot_async()], threading.get_ident()
+
+        results, loop_thread = asyncio.run(wait_twice())
+
+        self.assertEqual(results, [True, True])
+        self.assertGreater(len(bucket_threads), 2)
+        self.assertNotIn(loop_thread, bucket_threads)
+
+    def test_sliced_bucket(self):
+        """Does a slice take its tokens from the shared bucket, no more than its own rate, and pause the shared bucket on a 429?"""
+
+        shared = FileTokenBucket(rate=1, capacity=5, path=self.bucket_path)
+        batch_job = SlicedTokenBucket(shared, rate=1, capacity=2)
+
+        self.assertEqual([batch_job.try_acquire() for _ in range(2)], [0, 0])
+        self.assertGreater(batch_job.try_acquire(), 0)
+        self.assertEqual([shared.try_acquire() for _ in range(3)], [0, 0, 0])
+        self.assertGreater(shared.try_acquire(), 0)
+
+        batch_job.pause(2)
+        self.assertGreater(FileTokenBucket(rate=100, capacity=100, path=self.bucket_path).try_acquire(), 1.5)
@@ -0,0 +1,242 @@
+from unittest import TestCase
+import os
+import random
+import tempfile
+import threading
+import time
+
+import requests
+
+from async_spotify_client import AsyncSpotifyClient
+from fake_spotify.synthetic import SyntheticResponse, SyntheticTransport
+from fake_spotify import Catalog, create_app, serve_in_thread
+from metrics import UPSTREAM_HEDGES
+from retry_policy import RetryPolicies, RetryPolicy, HEDGE_MIN_SAMPLES
+from spotify_client import HEDGE_POOL_SIZE, SpotifyClient
+from token_manager import TokenManager
+from transport import PooledTransport
+
+
+class FlakyTransport(SyntheticTransport):
+    """Answers the first `failures` API requests with `failure` (a status code, or an exception to raise),
+    and delays the first request by `first_delay` seconds."""
+
+    def __init__(self, failures=0, failure=503, first_delay=0):
+        super().__init__(playlist_size=50)
+        self.failures = failures
+        self.failure = failure
+        self.first_delay = first_delay
+        self.api_requests = 0
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers=None, params=None, data=None):
+        if url.endswith('/api/token'):
+            return super().request(method, url, headers, params, data)
+
+        with self._lock:
+            self.api_requests += 1
+            number = self.api_requests
+
+        if number == 1 and self.first_delay:
+            time.sleep(self.first_delay)
+
+        if number <= self.failures:
+            if isinstance(self.failure, Exception):
+                raise self.failure
+            return SyntheticResponse(self.failure, {'error': {'status': self.failure, 'message': 'Server error'}})
+
+        return super().request(method, url, headers, params, data)
+
+
+class SlowTransport(SyntheticTransport):
+    """Takes `delay` seconds to answer every API request, and counts them."""
+
+    def __init__(self, delay):
+        super().__init__(playlist_size=50)
+        self.delay = delay
+        self.api_requests = 0
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers=None, params=None, data=None):
+        if not url.endswith('/api/token'):
+            with self._lock:
+                self.api_requests += 1
+            time.sleep(self.delay)
+
+        return super().request(method, url, headers, params, data)
+
+
+# Retry straight away, so the tests don't wait on backoff
+NO_BACKOFF = RetryPolicy(backoff_base=0)
+
+
+class RetryPolicyTests(TestCase):
+    """Tests for retrying failed Spotify requests with backoff, and hedging slow ones."""
+
+    def setUp(self):
+        self.token_cache = tempfile.NamedTemporaryFile(suffix='.json')
+
+    def tearDown(self):
+        self.token_cache.close()
+
+    def make_client(self, transport, policies):
+        return SpotifyClient(transport=transport, token_manager=TokenManager(transport, cache_path=self.token_cache.name), retry_policies=policies)
+
+    def test_backoff(self):
+        """Does the wait before each retry double (up to the cap), with a random amount of it skipped?"""
+
+        policy = RetryPolicy(backoff_base=1, backoff_max=5, rng=random.Random(0))
+        waits = [[policy.backoff(attempt) for _ in range(200)] for attempt in (1, 2, 3, 4)]
+
+        self.assertTrue(all(0 <= wait <= 1 for wait in waits[0]))
+        self.assertTrue(all(0 <= wait <= 4 for wait in waits[2]))
+        self.assertTrue(all(0 <= wait <= 5 for wait in waits[3]))
+        self.assertGreater(max(waits[3]), 4)
+        self.assertGreater(len(set(waits[0])), 100)
+
+    def test_server_errors_retried(self):
+        """Are 503s retried until Spotify answers, and counted?"""
+
+        transport = FlakyTransport(failures=2)
+        client = self.make_client(transport, RetryPolicies(NO_BACKOFF))
+
+        self.assertIsNotNone(client.get_playlist_tracks_page('playlist0', 0))
+        self.assertEqual(transport.api_requests, 3)
+        self.assertEqual(client.retry_stats()['retries'], 2)
+
+    def test_gives_up_after_max_attempts(self):
+        """Does a request that keeps failing give up after the policy's max attempts, and are 404s never retried?"""
+
+        transport = FlakyTransport(failures=10, failure=502)
+        client = self.make_client(transport, RetryPolicies(NO_BACKOFF))
+
+        self.assertIsNone(client.get_playlist_tracks_page('playlist0', 0))
+        self.assertEqual(transport.api_requests, 3)
+
+        transport = FlakyTransport(failures=10, failure=404)
+        client = self.make_client(transport, RetryPolicies(NO_BACKOFF))
+
+        self.assertIsNone(client.get_playlist_tracks_page('playlist0', 0))
+        self.assertEqual(transport.api_requests, 1)
+
+    def test_connection_reset_retried(self):
+        """Is a dropped connection retried?"""
+
+        transport = FlakyTransport(failures=1, failure=requests.ConnectionError('Connection reset by peer'))
+        client = self.make_client(transport, RetryPolicies(NO_BACKOFF))
+
+        self.assertIsNotNone(client.get_playlist_tracks_page('playlist0', 0))
+        self.assertEqual(transport.api_requests, 2)
+
+    def test_policy_per_endpoint(self):
+        """Does an endpoint's own policy replace the default?"""
+
+        transport = FlakyTransport(failures=10)
+        client = self.make_client(transport, RetryPolicies(NO_BACKOFF, {'/audio-features': RetryPolicy(max_attempts=1)}))
+
+        self.assertIsNone(client.api_get(f'{client.api_base_url}/audio-features', {'ids': 'track0'}))
+        self.assertEqual(transport.api_requests, 1)
+
+    def test_slow_request_hedged(self):
+        """Once an endpoint's usual response time is known, is a request slower than that raced by a duplicate?"""
+
+        transport = FlakyTransport(first_delay=1)
+        policies = RetryPolicies(endpoints={'/playlists/{id}/tracks': RetryPolicy(hedge_percentile=95)})
+        client = self.make_client(transport, policies)
+        url = f'{client.api_base_url}/playlists/playlist0/tracks'
+
+        for _ in range(HEDGE_MIN_SAMPLES):
+            policies.record_latency(url, 0.01)
+
+        hedges_won = UPSTREAM_HEDGES.value('/playlists/{id}/tracks', 'won')
+        started = time.perf_counter()
+
+        self.assertIsNotNone(client.get_playlist_tracks_page('playlist0', 0))
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(transport.api_requests, 2)
+        self.assertEqual(policies.stats(), {'retries': 0, 'hedged_requests': 1, 'hedges_won': 1})
+        self.assertEqual(UPSTREAM_HEDGES.value('/playlists/{id}/tracks', 'won'), hedges_won + 1)
+
+    def test_busy_hedging_threads_not_counted_as_slow(self):
+        """Under more concurrent requests than there are hedging threads, are requests that are no slower than usual
+        left unhedged (the time spent waiting for a thread isn't counted as the request being slow)?"""
+
+        transport = SlowTransport(delay=0.1)
+        policies = RetryPolicies(endpoints={'/playlists/{id}/tracks': RetryPolicy(hedge_percentile=95)})
+        client = self.make_client(transport, policies)
+        url = f'{client.api_base_url}/playlists/playlist0/tracks'
+
+        for _ in range(HEDGE_MIN_SAMPLES):
+            policies.record_latency(url, 0.3)
+
+        client.access_token  # fetch the token up front, so the requests only race each other
+        pages = []
+        threads = [threading.Thread(target=lambda: pages.append(client.get_playlist_tracks_page('playlist0', 0))) for _ in range(3 * HEDGE_POOL_SIZE)]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(pages), 3 * HEDGE_POOL_SIZE)
+        self.assertNotIn(None, pages)
+        self.assertEqual(policies.stats()['hedged_requests'], 0)
+        self.assertEqual(transport.api_requests, 3 * HEDGE_POOL_SIZE)
+
+    def test_async_client_retries(self):
+        """Does the async client retry the fake server's 503s too?"""
+
+        server = serve_in_thread(create_app(Catalog(), error_every=3))
+        base_url = f'http://127.0.0.1:{server.port}'
+        fd, token_cache_path = tempfile.mkstemp()
+        os.close(fd)
+
+        tokens = TokenManager(cache_path=token_cache_path, token_url=f'{base_url}/api/token')
+        client = AsyncSpotifyClient(token_manager=tokens, api_base_url=f'{base_url}/v1', retry_policies=RetryPolicies(NO_BACKOFF))
+
+        try:
+            tracks = client.run_sync(client.get_playlist_tracks('synthetic-120'))
+        finally:
+            client.run_sync(client.close())
+            server.shutdown()
+            os.remove(token_cache_path)
+
+        self.assertEqual(len(tracks), 120)
+        self.assertGreater(client.retry_stats()['retries'], 0)
+
+    def test_async_client_retries_html_errors(self):
+        """Does the async client retry 503s whose body is an HTML page (like a gateway's), rather than failing on the body?"""
+
+        server = serve_in_thread(create_app(Catalog(), error_every=4, html_errors=True))
+        base_url = f'http://127.0.0.1:{server.port}'
+        fd, token_cache_path = tempfile.mkstemp()
+        os.close(fd)
+
+        tokens = TokenManager(cache_path=token_cache_path, token_url=f'{base_url}/api/token')
+        client = AsyncSpotifyClient(token_manager=tokens, api_base_url=f'{base_url}/v1', retry_policies=RetryPolicies(RetryPolicy(backoff_base=0, max_attempts=10)))
+
+        try:
+            tracks = client.run_sync(client.get_playlist_tracks('synthetic-120'))
+        finally:
+            client.run_sync(client.close())
+            server.shutdown()
+            os.remove(token_cache_path)
+
+        self.assertEqual(len(tracks), 120)
+        self.assertGreater(client.retry_stats()['retries'], 0)
+
+    def test_html_error_reported(self):
+        """Does the sync client report a server error whose body is an HTML page (like a gateway's) by its status code,
+        rather than failing to decode the page?"""
+
+        server = serve_in_thread(create_app(Catalog(), error_every=1, html_errors=True))
+        base_url = f'http://127.0.0.1:{server.port}'
+        transport = PooledTransport()
+
+        try:
+            client = SpotifyClient(transport=transport, api_base_url=f'{base_url}/v1', retry_policies=RetryPolicies(RetryPolicy(max_attempts=1)),
+                                   token_manager=TokenManager(transport, cache_path=self.token_cache.name, token_url=f'{base_url}/api/token'))
+
+            self.assertEqual(client.get_playlist_info('synthetic-120', with_status=True), (None, 503))
+        finally:
+            server.shutdown()
@@ -1,33 +1,59 @@
 from unittest import TestCase
+import os
+import tempfile
 
 from spotify_client import SpotifyClient
-import requests
-import time
+from async_spotify_client import AsyncSpotifyClient
+from fake_spotify import Catalog, create_app, serve_in_thread
+from token_manager import TokenManager
+from transport import PooledTransport
+from track import Track
+
+# Every test runs against the fake Spotify server (see fake_spotify), so no credentials or network access are needed.
+# Its playlists named synthetic-<n> have n made-up tracks. The one search recorded here finds nothing.
+catalog = Catalog({'searches': {'the sound of post spinal tap': []}})
+server = serve_in_thread(create_app(catalog))
+BASE_URL = f'http://127.0.0.1:{server.port}'
+API_BASE_URL = f'{BASE_URL}/v1'
+
+fd, TOKEN_CACHE_PATH = tempfile.mkstemp()
+os.close(fd)
+
+
+def make_client(**options):
+    transport = PooledTransport()
+    tokens = TokenManager(transport, cache_path=TOKEN_CACHE_PATH, token_url=f'{BASE_URL}/api/token')
+
+    return SpotifyClient(transport=transport, token_manager=tokens, api_base_url=API_BASE_URL, **options)
+
+def tearDownModule():
+    server.shutdown()
+    os.remove(TOKEN_CACHE_PATH)
 
 # spin up client before tests
-spotify = SpotifyClient()
+spotify = make_client()
 
 class SpotifyClientTests(TestCase):
     """Tests for the Spotify Explorer API integration and helper methods."""
 
     def setUp(self):
          """Set up before each test"""
-         self.ex_artist_id = "3u1ulLq00Y3bfmq9FfjsPu"
-         self.ex_short_playlist_id = "37i9dQZF1EIgtiaACXv6tQ"
-         self.ex_long_playlist_id = "6VbtVCyMUz0eoiWGl2r6g7"
-         self.ex_track_id = "7cGwqXXVav9Tg0XNoONPlo"
-            
+         self.ex_artist_id = "artist000000000000000007"
+         self.ex_short_playlist_id = "synthetic-30"
+         self.ex_long_playlist_id = "synthetic-230"
+         self.ex_track_id = "track00000000000000042"
+
     def tearDown(self):
         """Clean up after each test"""
         pass
 
     def test_token_retrieval(self):
         """Does the spotify instance have a valid access token associated with it?"""
-        
+
         self.assertIsNotNone(spotify.access_token)
 
-        artists_url = f'https://api.spotify.com/v1/artists/{self.ex_artist_id}'
-        response = requests.get(artists_url, headers=spotify.headers)
+        artists_url = f'{API_BASE_URL}/artists/{self.ex_artist_id}'
+        response = spotify.transport.request('GET', artists_url, headers=spotify.headers)
 
         self.assertEqual(response.status_code, 200)
 
@@ -40,7 +66,7 @@ class SpotifyClientTests(TestCase):
 
     def test_invalid_token(self):
         """If token is invalid, does fetching new token work?"""
-        
+
         spotify.access_token = 'invalidtoken12345'
         payload = spotify.get_playlist_info(self.ex_short_playlist_id)
 
@@ -49,13 +75,10 @@ class SpotifyClientTests(TestCase):
     def test_get_playlist_tracks(self):
         """Does the getting playlist tracks work?"""
 
-        playlist_tracks_url = f'https://api.spotify.com/v1/playlists/{self.ex_short_playlist_id}/tracks' 
-        fields =  'next, offset, total, items(track(id, name, popularity, duration_ms, is_playable, preview_url, type, artists(id, name), album(name, href)))'
-        params = {'fields': fields, 'market': 'US', 'limit': 50} 
-        response = requests.get(playlist_tracks_url, headers=spotify.headers, params=params)
-        local_payload = response.json()
+        playlist_tracks_url = f'{API_BASE_URL}/playlists/{self.ex_short_playlist_id}/tracks'
+        params = {'market': 'US', 'limit': 50}
+        local_payload = spotify.transport.request('GET', playlist_tracks_url, headers=spotify.headers, params=params).json()
 
-        time.sleep(1) # sleep to avoid rate limits
         client_payload = spotify.get_playlist_tracks(self.ex_short_playlist_id)
 
         self.assertEqual(len(client_payload), local_payload['total'])
@@ -63,24 +86,22 @@ class SpotifyClientTests(TestCase):
     def test_get_playlist_tracks_long(self):
         """Does the getting playlist tracks for a playlist with more than 100 tracks work?"""
 
-        playlist_tracks_url = f'https://api.spotify.com/v1/playlists/{self.ex_long_playlist_id}/tracks' 
-        fields =  'next, offset, total, items(track(id, name, popularity, duration_ms, is_playable, preview_url, type, artists(id, name), album(name, href)))'
-        params = {'fields': fields, 'market': 'US', 'limit': 50} 
-        response = requests.get(playlist_tracks_url, headers=spotify.headers, params=params)
-        local_payload = response.json()
+        playlist_tracks_url = f'{API_BASE_URL}/playlists/{self.ex_long_playlist_id}/tracks'
+        params = {'market': 'US', 'limit': 50}
+        local_payload = spotify.transport.request('GET', playlist_tracks_url, headers=spotify.headers, params=params).json()
 
-        time.sleep(1) # sleep to avoid rate limits
         client_payload = spotify.get_playlist_tracks(self.ex_long_playlist_id)
 
         self.assertEqual(len(client_payload), local_payload['total'])
+        self.assertEqual(len(client_payload), 230)
 
     def test_get_track_audio_features(self):
         """Does the getting track audio features work?"""
 
-        payload = spotify.get_track_audio_features([{'id': self.ex_track_id}])
+        payload = spotify.get_track_audio_features([Track(id=self.ex_track_id)])
 
         self.assertEqual(len(payload), 1)
-        self.assertEqual(payload[0]['tempo'], 112)
+        self.assertEqual(payload[0].tempo, catalog.get_audio_features(self.ex_track_id)['tempo'])
 
     def test_get_artist_details(self):
             """Does the getting artist details work?"""
@@ -110,5 +131,40 @@ class SpotifyClientTests(TestCase):
             playlist_id = spotify.get_playlist_by_genre('post spinal tap', 'thesoundsofspotify')
 
             self.assertEqual(playlist_id, None)
-    
-    
\ No newline at end of file
+
+    def test_transport_reuses_connections(self):
+            """Do repeated requests reuse the pooled connection instead of opening a new one each time?"""
+
+            spotify.get_artist_details(self.ex_artist_id)
+            before = spotify.transport_stats()
+
+            spotify.get_artist_details(self.ex_artist_id)
+            spotify.get_artist_details(self.ex_artist_id)
+            after = spotify.transport_stats()
+
+            self.assertEqual(after['requests_sent'], before['requests_sent'] + 2)
+            self.assertEqual(after['connections_opened'], before['connections_opened'])
+            self.assertGreater(after['connections_reused'], before['connections_reused'])
+
+    def test_get_playlist_tracks_parallel_order(self):
+            """Does fetching pages in parallel return the same tracks, in the same order, as fetching them one at a time?"""
+
+            serial_client = make_client(max_workers=1)
+            parallel_client = make_client(max_workers=8)
+
+            serial_payload = serial_client.get_playlist_tracks(self.ex_long_playlist_id)
+            parallel_payload = parallel_client.get_playlist_tracks(self.ex_long_playlist_id)
+
+            self.assertEqual([track.id for track in parallel_payload], [track.id for track in serial_payload])
+
+    def test_async_get_playlist_tracks(self):
+            """Does the async client return the same playlist tracks, in the same order, as the sync client?"""
+
+            spotify_async = AsyncSpotifyClient(api_base_url=API_BASE_URL, token_manager=TokenManager(cache_path=TOKEN_CACHE_PATH, token_url=f'{BASE_URL}/api/token'))
+
+            sync_payload = spotify.get_playlist_tracks(self.ex_long_playlist_id)
+            async_payload = spotify_async.run_sync(spotify_async.get_playlist_tracks(self.ex_long_playlist_id))
+            spotify_async.run_sync(spotify_async.close())
+
+            self.assertEqual([track.id for track in async_payload], [track.id for track in sync_payload])
+            self.assertIsNotNone(async_payload[0].artist_genres)
@@ -0,0 +1,110 @@
+from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
+import os
+import tempfile
+import threading
+import time
+
+from token_manager import TokenManager, default_token_cache_path
+
+
+class FakeTokenResponse:
+    status_code = 200
+
+    def __init__(self, token_number):
+        self.token_number = token_number
+
+    def json(self):
+        return {'access_token': f'token{self.token_number}', 'token_type': 'Bearer', 'expires_in': 3600}
+
+
+class FakeTokenTransport:
+    """Stands in for the PooledTransport, counting token requests."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests_sent = 0
+
+    def request(self, method, url, headers=None, params=None, data=None):
+        time.sleep(0.05)  # give other threads a chance to pile up behind the refresh
+        with self.lock:
+            self.requests_sent += 1
+            return FakeTokenResponse(self.requests_sent)
+
+
+class TokenManagerTests(TestCase):
+    """Tests for lazy, shared access token handling."""
+
+    def setUp(self):
+        """Set up a temp token cache file"""
+        fd, self.cache_path = tempfile.mkstemp()
+        os.close(fd)
+        self.transport = FakeTokenTransport()
+
+    def tearDown(self):
+        """Clean up the token cache file"""
+        os.remove(self.cache_path)
+
+    def test_token_fetched_lazily(self):
+        """Is the token only fetched when it's first needed?"""
+
+        tokens = TokenManager(self.transport, cache_path=self.cache_path)
+        self.assertEqual(self.transport.requests_sent, 0)
+
+        self.assertEqual(tokens.get_token(), 'token1')
+        self.assertEqual(tokens.get_token(), 'token1')
+        self.assertEqual(self.transport.requests_sent, 1)
+
+    def test_single_refresh_across_threads(self):
+        """If many threads need a token at once, is only one fetched?"""
+
+        tokens = TokenManager(self.transport, cache_path=self.cache_path)
+
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(lambda _: tokens.get_token(), range(10)))
+
+        self.assertEqual(set(results), {'token1'})
+        self.assertEqual(self.transport.requests_sent, 1)
+
+    def test_proactive_refresh(self):
+        """Is a new token fetched shortly before the current one expires?"""
+
+        tokens = TokenManager(self.transport, cache_path=self.cache_path, refresh_margin=60)
+        tokens.get_token()
+
+        # move the token's expiry (in memory and in the shared cache) inside the refresh margin
+        tokens.expires_at = time.time() + 30
+        with tokens.locked_cache() as cache:
+            cache['expires_at'] = tokens.expires_at
+
+        self.assertEqual(tokens.get_token(), 'token2')
+
+    def test_token_shared_across_processes(self):
+        """Does a second worker (using the same cache file) reuse the first worker's token?"""
+
+        worker_1 = TokenManager(self.transport, cache_path=self.cache_path)
+        worker_2 = TokenManager(self.transport, cache_path=self.cache_path)
+
+        self.assertEqual(worker_1.get_token(), 'token1')
+        self.assertEqual(worker_2.get_token(), 'token1')
+        self.assertEqual(self.transport.requests_sent, 1)
+
+    def test_refresh_expired_token(self):
+        """If Spotify rejects a token, is it replaced (once) even though it hasn't reached `expires_in`?"""
+
+        tokens = TokenManager(self.transport, cache_path=self.cache_path)
+        expired_token = tokens.get_token()
+
+        self.assertEqual(tokens.refresh(expired_token=expired_token), 'token2')
+        self.assertEqual(tokens.refresh(expired_token=expired_token), 'token2')
+        self.assertEqual(self.transport.requests_sent, 2)
+
+    def test_cache_path_keyed_by_client_id(self):
+        """Do other credentials (or another token URL) get their own default cache file?"""
+
+        path = default_token_cache_path('client1')
+
+        self.assertEqual(default_token_cache_path('client1'), path)
+        self.assertNotEqual(default_token_cache_path('client2'), path)
+        self.assertNotEqual(default_token_cache_path('client1', 'http://127.0.0.1:8000/api/token'), path)
+        self.assertEqual(TokenManager(self.transport).cache_path, default_token_cache_path())
@@ -1,6 +1,12 @@
 from unittest import TestCase
+import json
+import tempfile
 
+import app as app_module
 from app import app, CURR_USER_KEY, g, TESTING
+from async_spotify_client import AsyncSpotifyClient
+from fake_spotify import Catalog, create_app, serve_in_thread
+from token_manager import TokenManager
 from models import db, User, Genre, User_Genre
 from enums import FavoriteStatus
 
@@ -282,6 +288,36 @@ if TESTING:
                 self.assertIn('Cowpunk Mix</h1>', html)
                 self.assertIn('<a href="/genre-inspector/cowpunk?source=thesoundsofspotify">', html)
 
+        def test_genre_inspector_timeout_keeps_playlist(self):
+            """If fetching a genre's stored playlist times out, is the stored playlist kept (only a 404 forgets it)?"""
+
+            server = serve_in_thread(create_app(Catalog(), latency=0.3))
+            base_url = f'http://127.0.0.1:{server.port}'
+            spotify_async = app_module.spotify_async
+
+            with tempfile.NamedTemporaryFile(suffix='.json') as token_cache:
+                app_module.spotify_async = AsyncSpotifyClient(read_timeout=0.05, api_base_url=f'{base_url}/v1',
+                                                              token_manager=TokenManager(cache_path=token_cache.name, token_url=f'{base_url}/api/token'))
+
+                try:
+                    with app.app_context():
+                        genre = Genre.query.get(self.genre_3.id)
+                        genre.set_playlist_id('spotify', 'synthetic-timeout-50')
+                        genre.set_playlist_id('thesoundsofspotify', None)
+                        db.session.commit()
+
+                    with app.test_client() as client:
+                        resp = client.get("/genre-inspector/cowpunk?source=spotify")
+
+                    self.assertEqual(resp.status_code, 302)
+
+                    with app.app_context():
+                        self.assertEqual(Genre.query.get(self.genre_3.id).playlist_id('spotify'), (True, 'synthetic-timeout-50'))
+                finally:
+                    app_module.spotify_async.run_sync(app_module.spotify_async.close())
+                    app_module.spotify_async = spotify_async
+                    server.shutdown()
+
         def test_playlist_search(self):
             """Test whether a playlist page loads when a search is performed"""
 
@@ -325,7 +361,7 @@ if TESTING:
                 resp = client.get(f"/artists/{self.ex_artist_id}/top-tracks")
                 
                 self.assertEqual(len(resp.json),10)
-                self.assertEqual(resp.json[0]['artists'][0]['name'],"Ween")
+                self.assertEqual(resp.json[0]['artist_name'],"Ween")
 
         def test_playlist_tracks(self):
             """Test whether the playlist tracks AJAX call responds with data"""
@@ -337,6 +373,75 @@ if TESTING:
                 self.assertIn("cowpunk",resp.json[0]['artist_genres'])
 
 
+        def test_stream_playlist_tracks(self):
+            """Test whether the playlist tracks stream responds with one JSON track per line"""
+
+            with app.test_client() as client:
+                resp = client.get(f"/get-playlist-tracks/{self.ex_short_playlist_id}/stream")
+                lines = resp.get_data(as_text=True).splitlines()
+
+                self.assertEqual(resp.mimetype, 'application/x-ndjson')
+                self.assertEqual(len(lines), 50)
+                self.assertIn("cowpunk", json.loads(lines[0])['artist_genres'])
+
+        def test_export_playlist_tracks(self):
+            """Test whether the CSV export downloads a header and one row per track"""
+
+            with app.test_client() as client:
+                resp = client.get(f"/get-playlist-tracks/{self.ex_short_playlist_id}/export.csv")
+                lines = resp.get_data(as_text=True).splitlines()
+
+                self.assertEqual(resp.mimetype, 'text/csv')
+                self.assertIn('attachment', resp.headers['Content-Disposition'])
+                self.assertEqual(len(lines), 51)
+                self.assertIn("cowpunk", lines[1])
+
+        def test_playlist_tracks_summary(self):
+            """Test whether the playlist summary counts genres and summarizes the audio features"""
+
+            with app.test_client() as client:
+                # The summary is worked out from the tracks the table loaded, so load them first
+                client.get(f"/get-playlist-tracks/{self.ex_short_playlist_id}")
+                resp = client.get(f"/get-playlist-tracks/{self.ex_short_playlist_id}/summary")
+
+                self.assertEqual(resp.json['tracks'], 50)
+                self.assertIn("cowpunk", [genre['name'] for genre in resp.json['genres']])
+                self.assertLessEqual(resp.json['features']['energy']['max'], 1.0)
+
+        def test_playlist_tracks_page(self):
+            """Test whether the server-side table call responds with one sorted page of tracks"""
+
+            with app.test_client() as client:
+                resp = client.get(f"/get-playlist-tracks/{self.ex_short_playlist_id}/page?offset=10&limit=20&sort=tempo&order=desc")
+
+                self.assertEqual(resp.json['total'], 50)
+                self.assertEqual(len(resp.json['rows']), 20)
+                self.assertGreaterEqual(resp.json['rows'][0]['tempo'], resp.json['rows'][-1]['tempo'])
+
+        def test_playlist_tracks_not_modified(self):
+            """Test whether asking for a playlist snapshot the browser already has gets a 304 with no body"""
+
+            with app.test_client() as client:
+                resp = client.get(f"/get-playlist-tracks/{self.ex_short_playlist_id}")
+                etag = resp.headers['ETag']
+
+                resp = client.get(f"/get-playlist-tracks/{self.ex_short_playlist_id}", headers={'If-None-Match': etag})
+
+                self.assertEqual(resp.status_code, 304)
+                self.assertEqual(resp.get_data(), b'')
+
+        def test_metrics(self):
+            """Test whether /metrics exposes upstream call and route metrics in the Prometheus text format"""
+
+            with app.test_client() as client:
+                client.get(f"/get-playlist-tracks/{self.ex_short_playlist_id}")
+                resp = client.get("/metrics")
+
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn('text/plain', resp.content_type)
+                self.assertIn('spotify_upstream_request_seconds_count{endpoint="/playlists/{id}/tracks"}', resp.get_data(as_text=True))
+                self.assertIn('flask_responses_total{route="/get-playlist-tracks/<playlist_id>",method="GET",status="200"}', resp.get_data(as_text=True))
+
         def test_update_genre_favorite_status(self): 
             """Test whether updating user genre preference works."""
 
@@ -0,0 +1,165 @@
+"""Access token handling for the Spotify API (client credentials flow)."""
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+from config import SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET
+from transport import PooledTransport, ACCOUNTS_BASE_URL
+from metrics import TOKEN_REFRESHES, record_upstream_call
+
+ACCESS_TOKEN_URL = f'{ACCOUNTS_BASE_URL}/api/token'
+DEFAULT_REFRESH_MARGIN = 60  # seconds before `expires_in` runs out that we fetch a new token
+
+# Shared by every worker on the host. /dev/shm keeps the token in memory rather than on disk.
+TOKEN_CACHE_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def default_token_cache_path(client_id=SPOTIFY_CLIENT_ID, token_url=ACCESS_TOKEN_URL):
+    """The token cache file for these credentials. It's keyed by a hash of the client ID (and of the token URL,
+    e.g. the fake server's), so deployments on the same host with other credentials don't read each other's tokens."""
+
+    key = hashlib.sha256(f'{client_id} {token_url}'.encode()).hexdigest()[:16]
+
+    return os.path.join(TOKEN_CACHE_DIR, f'spotify-explorer-token-{key}.json')
+
+
+class TokenManager:
+    """Hands out a valid access token, fetching one only when it's first needed.
+
+    - The token is refreshed `refresh_margin` seconds before it expires, so requests rarely see a 401.
+    - When many threads need a new token at once, only one of them fetches it; the rest wait and reuse it.
+    - The token is cached in a file (guarded by an flock), so N gunicorn workers share one token
+      instead of each fetching their own at startup.
+    """
+
+    def __init__(self, transport=None, cache_path=None, refresh_margin=DEFAULT_REFRESH_MARGIN, token_url=ACCESS_TOKEN_URL):
+        self.transport = transport or PooledTransport(pool_size=1)
+        self.token_url = token_url
+        self.cache_path = cache_path or default_token_cache_path(token_url=token_url)
+        self.refresh_margin = refresh_margin
+
+        self.access_token = None
+        self.expires_at = 0
+
+        self._lock = threading.Lock()
+        self.tokens_fetched = 0
+
+    def is_fresh(self, access_token=None, expires_at=None):
+        access_token = access_token if access_token is not None else self.access_token
+        expires_at = expires_at if expires_at is not None else self.expires_at
+
+        return access_token is not None and time.time() < expires_at - self.refresh_margin
+
+    def current_token(self):
+        """Return the token if it's still fresh, without doing any I/O. Otherwise return None."""
+        return self.access_token if self.is_fresh() else None
+
+    def get_token(self):
+        """Return a valid access token, fetching a new one if needed. Return None if one couldn't be fetched."""
+
+        token = self.current_token()
+
+        if token is not None:
+            return token
+
+        return self.refresh()
+
+    def refresh(self, expired_token=None):
+        """Get a new token. If another thread (or worker) already replaced `expired_token`, use theirs instead."""
+
+        with self._lock:
+            # Someone else refreshed while we were waiting for the lock
+            if self.is_fresh() and self.access_token != expired_token:
+                return self.access_token
+
+            with self.locked_cache() as cache:
+                if self.is_fresh(cache.get('access_token'), cache.get('expires_at', 0)) and cache['access_token'] != expired_token:
+                    self.access_token = cache['access_token']
+                    self.expires_at = cache['expires_at']
+                    return self.access_token
+
+                token_data = self.fetch_token()
+
+                if token_data is None:
+                    return None
+
+                self.access_token = token_data['access_token']
+                self.expires_at = time.time() + token_data.get('expires_in', 3600)
+
+                cache['access_token'] = self.access_token
+                cache['expires_at'] = self.expires_at
+
+                return self.access_token
+
+    def fetch_token(self):
+        """ Get API token used to get data from Spotify using client credentials """
+
+        print("Getting access token...")
+
+        TOKEN_REQUEST_PARAMS = {
+            'grant_type': 'client_credentials',
+            'client_id': SPOTIFY_CLIENT_ID,
+            'client_secret': SPOTIFY_CLIENT_SECRET,
+        }
+
+        started = time.perf_counter()
+
+        try:
+            response = self.transport.request('POST', self.token_url, data=TOKEN_REQUEST_PARAMS)
+        except requests.RequestException as e:
+            record_upstream_call(self.token_url, time.perf_counter() - started, None)
+            print(f"Error: {e}")
+            return None
+
+        record_upstream_call(self.token_url, time.perf_counter() - started, response.status_code, len(getattr(response, 'content', b'')))
+
+        if response.status_code != 200:
+            print("Status code: ", response.status_code)
+            print(response.json())
+
+            return None
+
+        response_data = response.json()
+
+        if 'access_token' not in response_data:
+            print(f"Error: no access token in response: {response_data}")
+            return None
+
+        self.tokens_fetched += 1
+        TOKEN_REFRESHES.inc()
+
+        return response_data
+
+    @contextmanager
+    def locked_cache(self):
+        """Lock the token cache file and yield its contents as a dict. Changes to the dict are saved on exit."""
+
+        fd = os.open(self.cache_path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+
+            with os.fdopen(os.dup(fd), 'r+') as f:
+                try:
+                    cache = json.loads(f.read() or '{}')
+                except ValueError:
+                    cache = {}
+
+                original = dict(cache)
+
+                yield cache
+
+                if cache != original:
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(cache))
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
@@ -0,0 +1,69 @@
+"""The compact track record shared by the playlist and artist top tracks tables."""
+from dataclasses import dataclass
+
+
+@dataclass(slots=True)
+class Track:
+    """One row of a tracks table: only the fields the tables use.
+
+    Audio features and artist details are filled in by enrichment, and stay None until then.
+    Numbers are kept as numbers (e.g. energy is 0.0 - 1.0, not "64.0%"). They're formatted for display
+    by the table's formatters in static/script.js.
+    """
+
+    id: str | None = None
+    name: str | None = None
+    album: str | None = None
+    artist_id: str | None = None
+    artist_name: str | None = None
+    duration_ms: int = 0
+    popularity: int | None = None
+    preview_url: str | None = None
+
+    # audio features (0.0 - 1.0, except tempo in BPM)
+    danceability: float | None = None
+    energy: float | None = None
+    acousticness: float | None = None
+    instrumentalness: float | None = None
+    positivity: float | None = None
+    tempo: float | None = None
+
+    # artist details
+    artist_popularity: int | None = None
+    artist_followers: int | None = None
+    artist_genres: list[str] | None = None
+
+    @classmethod
+    def from_spotify(cls, track):
+        """Make a Track from a Spotify track object (from a playlist page or an artist's top tracks)."""
+
+        artists = track.get('artists') or [{}]
+
+        return cls(
+            id=track.get('id'),
+            name=track.get('name'),
+            album=(track.get('album') or {}).get('name'),
+            artist_id=artists[0].get('id'),
+            artist_name=artists[0].get('name'),
+            duration_ms=track.get('duration_ms') or 0,
+            popularity=track.get('popularity'),
+            preview_url=track.get('preview_url'),
+        )
+
+    @property
+    def duration(self):
+        """Duration in minutes & seconds (e.g. '3:05')."""
+        return convert_ms_to_mins(self.duration_ms)
+
+    def to_dict(self):
+        """The track as a dict, ready to be sent to the table as JSON."""
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+def convert_ms_to_mins(ms):
+    min = (ms//1000)//60
+    sec = (ms//1000)%60
+    if sec >=0 and sec < 10:
+        sec = f'0{sec}'
+
+    return f'{min}:{sec}'
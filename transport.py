@@ -0,0 +1,72 @@
+"""HTTP transport used by the SpotifyClient to talk to the Spotify Web API."""
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 3.05  # seconds to wait for a TCP/TLS connection
+DEFAULT_READ_TIMEOUT = 15       # seconds to wait for Spotify to send a response
+
+# Where the Spotify API lives. Set these environment variables to point the app (or tests) at a stand-in,
+# e.g. the fake_spotify server: SPOTIFY_API_BASE_URL=http://localhost:8765/v1 SPOTIFY_ACCOUNTS_BASE_URL=http://localhost:8765
+API_BASE_URL = os.environ.get('SPOTIFY_API_BASE_URL', 'https://api.spotify.com/v1')
+ACCOUNTS_BASE_URL = os.environ.get('SPOTIFY_ACCOUNTS_BASE_URL', 'https://accounts.spotify.com')
+
+
+class PooledTransport:
+    """A keep-alive transport backed by a pooled requests.Session.
+
+    Connections to accounts.spotify.com and api.spotify.com are kept open and reused between calls,
+    so paging through a large playlist only pays for the TLS handshake once per pooled connection.
+    Every request is sent with a (connect, read) timeout so a stalled socket can't hang a worker.
+
+    Any object with `request(method, url, headers=None, params=None, data=None)` and `stats()`
+    methods can be handed to the SpotifyClient in place of this class.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._lock = threading.Lock()
+        self.requests_sent = 0
+
+    def request(self, method, url, headers=None, params=None, data=None):
+        """Send a request over the pooled session. Raises requests.RequestException on timeouts / connection errors."""
+
+        with self._lock:
+            self.requests_sent += 1
+
+        return self.session.request(method, url, headers=headers, params=params, data=data, timeout=self.timeout)
+
+    def connections_opened(self):
+        """Count the connections urllib3 has opened across all of the session's connection pools."""
+
+        opened = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    opened += pool.num_connections
+        return opened
+
+    def stats(self):
+        """Return request and connection counts so we can check that connections are being reused."""
+
+        opened = self.connections_opened()
+        return {
+            'requests_sent': self.requests_sent,
+            'connections_opened': opened,
+            'connections_reused': max(self.requests_sent - opened, 0),
+        }
+
+    def close(self):
+        self.session.close()